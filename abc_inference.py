@@ -0,0 +1,247 @@
+"""
+Approximate Bayesian computation (ABC) of the phase parameters from the Oregon observations. This
+is the sequential Monte Carlo form of ABC: each generation is a population of particles (parameter
+points) whose simulations are within the tolerance of the observations, and the tolerance shrinks
+from generation to generation. The parameters and observations are the same as for calibrate.py,
+e.g.:
+
+    python abc_inference.py -ph ./data/expl3/covid_phases.json
+        -v "normal:transmission probability:0.015:0.035"
+        -v "lock down:daily contacts:6:14" -o ./data/abc_posterior.json
+
+Most of the cost of fitting by simulation is finishing runs that are already hopeless. The distance
+(see calibrate.distance) never decreases as days are added, so each simulation checks its partial
+distance at the checkpoint days through the simulation daily hook, and stops as soon as it exceeds
+the tolerance - it would be rejected anyway.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import numpy as np
+import simulate as s
+import scenario
+import calibrate
+
+
+def _simulate_particle(task):
+    """
+    Run the simulation of a particle in a worker process.
+
+    :return: ((float, int)) The distance (None if the simulation was stopped because it exceeded the
+    tolerance) and the number of days that were simulated.
+    """
+    (point_config, event_list, population, simulation_days, initial_infection, seed,
+     observed, tolerance, checkpoints, deaths_weight) = task
+
+    def stop_if_rejected(sim_state, day):
+        return day in checkpoints and \
+            calibrate.distance(sim_state, observed, last_day=day, deaths_weight=deaths_weight) > tolerance
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(point_config, event_list, population, simulation_days,
+                                          initial_infection, seed, daily_hook=stop_if_rejected)
+    if sim_state[s.STOPPED_DAY] is not None:
+        return None, sim_state[s.STOPPED_DAY]
+    return calibrate.distance(sim_state, observed, deaths_weight=deaths_weight), simulation_days
+
+
+def _perturbation_kernel(particles, weights, bounds):
+    """
+    The perturbation kernel for the next generation - independent normal perturbations with twice
+    the weighted variance of the particles (the usual choice for ABC-SMC).
+    """
+    mean = np.average(particles, axis=0, weights=weights)
+    variance = np.average((particles - mean) ** 2, axis=0, weights=weights)
+    # a particle population that has collapsed onto a point still needs to move
+    return np.sqrt(np.maximum(2.0 * variance, ((bounds[:, 1] - bounds[:, 0]) * 1.0e-3) ** 2))
+
+
+def run_abc(phases_config, parameters, observed, event_list=None,
+            population=s.DEFAULT_POPULATION, simulation_days=None,
+            initial_infection=s.DEFAULT_INITIAL_INFECTION,
+            particles=50, generations=4, quantile=0.5, initial_tolerance=float('inf'),
+            checkpoints=None, batch=None, max_simulations=None, seed=42,
+            deaths_weight=1.0, workers=None):
+    """
+    Run ABC-SMC for the phase parameters.
+
+    :param phases_config: (dict, required) The base phases description.
+    :param parameters: ([(str, str, float, float)], required) The (phase, parameter, low, high) - the
+    uniform prior of each parameter.
+    :param observed: (dict, required) The observed series, see calibrate.read_observed().
+    :param event_list: ([dict], optional, default=None) The event descriptions.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The simulated population.
+    :param simulation_days: (int, optional, default=None) The days to simulate, None for the days observed.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The initial infection.
+    :param particles: (int, optional, default=50) The particles accepted in each generation.
+    :param generations: (int, optional, default=4) The number of generations.
+    :param quantile: (float, optional, default=0.5) The tolerance of a generation is this quantile of
+    the distances of the particles accepted in the generation before it.
+    :param initial_tolerance: (float, optional, default=inf) The tolerance of the first generation.
+    :param checkpoints: ([int], optional, default=None) The days the partial distance is checked, None
+    for every 10 days.
+    :param batch: (int, optional, default=None) The simulations submitted at a time, None for 2 x particles.
+    :param max_simulations: (int, optional, default=None) The most simulations for a generation, None
+    for 50 x particles.
+    :param seed: (int, optional, default=42) The seed of the inference.
+    :param deaths_weight: (float, optional, default=1.0) The weight of the deaths in the distance.
+    :param workers: (int, optional, default=None) The worker processes, None for the number of cores.
+    :return: ([dict]) A description of each generation - the 'tolerance', the accepted 'particles',
+    their 'weights' and 'distances', and the simulation statistics.
+    """
+    if simulation_days is None:
+        simulation_days = len(observed[s.CUMULATIVE_CONFIRMED_CASES_SERIES]) - 1
+    if checkpoints is None:
+        checkpoints = range(10, simulation_days, 10)
+    checkpoints = frozenset(checkpoints)
+    if batch is None:
+        batch = 2 * particles
+    if max_simulations is None:
+        max_simulations = 50 * particles
+    rng = np.random.default_rng(seed)
+    bounds = np.array([[low, high] for _, _, low, high in parameters])
+    tolerance = initial_tolerance
+    previous = None
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for generation in range(generations):
+            if previous is not None:
+                sigma = _perturbation_kernel(previous['particles'], previous['weights'], bounds)
+            accepted = []
+            distances = []
+            simulations = 0
+            stopped = 0
+            simulated_days = 0
+            while len(accepted) < particles and simulations < max_simulations:
+                # propose a batch of particles - from the prior for the first generation,
+                # otherwise perturbations of the particles of the last generation
+                proposals = []
+                while len(proposals) < batch:
+                    if previous is None:
+                        proposal = bounds[:, 0] + rng.random(len(bounds)) * (bounds[:, 1] - bounds[:, 0])
+                    else:
+                        parent = previous['particles'][rng.choice(len(previous['particles']),
+                                                                  p=previous['weights'])]
+                        proposal = parent + rng.normal(0.0, sigma)
+                    if np.all((proposal >= bounds[:, 0]) & (proposal <= bounds[:, 1])):
+                        proposals.append(proposal)
+                futures = [executor.submit(
+                    _simulate_particle,
+                    (calibrate.apply_point(phases_config, parameters, proposal), event_list, population,
+                     simulation_days, initial_infection, int(rng.integers(2 ** 31)), observed, tolerance,
+                     checkpoints, deaths_weight)) for proposal in proposals]
+                for proposal, future in zip(proposals, futures):
+                    distance, days = future.result()
+                    simulations += 1
+                    simulated_days += days
+                    if distance is None:
+                        stopped += 1
+                    elif distance <= tolerance and len(accepted) < particles:
+                        accepted.append(proposal)
+                        distances.append(distance)
+            if len(accepted) == 0:
+                print(f'generation {generation}: no particles accepted in {simulations} simulations')
+                break
+
+            accepted = np.array(accepted)
+            if previous is None:
+                weights = np.ones(len(accepted))
+            else:
+                # uniform prior, so the weight is 1 / the probability of proposing the particle
+                kernel = np.exp(-0.5 * np.sum(((accepted[:, None, :] - previous['particles'][None, :, :])
+                                               / sigma) ** 2, axis=2))
+                weights = 1.0 / (kernel @ previous['weights'])
+            weights /= weights.sum()
+            previous = {
+                'generation': generation,
+                'tolerance': tolerance,
+                'particles': accepted,
+                'weights': weights,
+                'distances': np.array(distances),
+                'simulations': simulations,
+                'stopped early': stopped,
+                'simulated days': simulated_days
+            }
+            results.append(previous)
+            mean = np.average(accepted, axis=0, weights=weights)
+            print(f'generation {generation}: tolerance {tolerance:.4f}, accepted {len(accepted)} of '
+                  f'{simulations} simulations, {stopped} stopped early, '
+                  f'{simulated_days / (simulations * simulation_days):.0%} of the simulation days run, '
+                  f'posterior mean {mean}')
+            tolerance = float(np.quantile(distances, quantile))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Approximate Bayesian computation of the phase parameters from the Oregon observations.')
+    parser.add_argument(
+        '-ph', '--phases', dest='phases', type=str, required=True,
+        help='The JSON file containing the simulation phases description.')
+    parser.add_argument(
+        '-v', '--vary', dest='vary', type=str, action='append', required=True,
+        help='A parameter and its uniform prior, "phase:parameter:low:high", may be repeated.')
+    parser.add_argument(
+        '-e', '--events', dest='events', type=str, default=None,
+        help='The JSON files containing the events descriptions, comma separated.')
+    parser.add_argument(
+        '-o', '--output', dest='output', type=str, default=None,
+        help='The .json file to which the generations will be written.')
+    parser.add_argument(
+        '-p', '--population', dest='population', type=int, default=s.DEFAULT_POPULATION,
+        help='The population for the simulation.')
+    parser.add_argument(
+        '-d', '--days', dest='sim_days', type=int, default=None,
+        help='The length of the simulation in days, default is the days of observations.')
+    parser.add_argument(
+        '-i', '--infection', dest='infection', type=int, default=s.DEFAULT_INITIAL_INFECTION,
+        help='The default infection (not tested).')
+    parser.add_argument(
+        '-n', '--particles', dest='particles', type=int, default=50,
+        help='The number of particles accepted in each generation.')
+    parser.add_argument(
+        '-g', '--generations', dest='generations', type=int, default=4,
+        help='The number of generations.')
+    parser.add_argument(
+        '-q', '--quantile', dest='quantile', type=float, default=0.5,
+        help='The quantile of the accepted distances that is the tolerance of the next generation.')
+    parser.add_argument(
+        '-t', '--tolerance', dest='tolerance', type=float, default=float('inf'),
+        help='The tolerance of the first generation.')
+    parser.add_argument(
+        '--checkpoints', dest='checkpoints', type=str, default=None,
+        help='The days the partial distance is checked, comma separated, default is every 10 days.')
+    parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='The number of worker processes, default is the number of cores.')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=42,
+        help='The seed for the inference.')
+    parser.add_argument(
+        '--deaths-weight', dest='deaths_weight', type=float, default=1.0,
+        help='The weight of the deaths relative to the cases in the distance.')
+    args = parser.parse_args()
+
+    base_phases = scenario.read_phases(args.phases)
+    abc_generations = run_abc(
+        base_phases, [calibrate.parse_parameter(description, base_phases) for description in args.vary],
+        calibrate.read_observed(args.population),
+        event_list=None if args.events is None else
+        scenario.read_events([file_name.strip() for file_name in args.events.split(',')]),
+        population=args.population, simulation_days=args.sim_days, initial_infection=args.infection,
+        particles=args.particles, generations=args.generations, quantile=args.quantile,
+        initial_tolerance=args.tolerance,
+        checkpoints=None if args.checkpoints is None else
+        [int(day) for day in args.checkpoints.split(',')],
+        seed=args.seed, deaths_weight=args.deaths_weight, workers=args.workers)
+
+    if args.output is not None:
+        with open(args.output, "w") as fw:
+            json.dump({
+                'parameters': args.vary,
+                'generations': [{key: value.tolist() if isinstance(value, np.ndarray) else value
+                                 for key, value in abc_generation.items()}
+                                for abc_generation in abc_generations]
+            }, fw, indent=2)
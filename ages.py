@@ -0,0 +1,134 @@
+"""
+An age-structured population for the array population model (see array_population.py). Every
+person is in one of the age bands of the Oregon weekly reports (see oregon_data.py), the chances of
+becoming severe or critical, and of dying when critical, depend on the age band, and mixing is
+described by an age-by-age contact matrix.
+
+The contact model computes the infection pressure on each age group as a matrix-vector product of
+the contact matrix and the infectious fraction of each age group, so the age structure does not add
+per-person work to a day:
+
+    table = state_tables.compile_health_states(ages.add_age_branches(covid_state.HEALTH_STATES),
+                                               age_groups=ages.AGE_GROUPS)
+    model = array_population.create_model(table, population, ages.create_infections(),
+                                           age_groups=ages.assign_age_groups(population))
+"""
+import copy
+import numpy as np
+import simulate as s
+
+# the age bands of the Oregon weekly reports
+AGE_GROUPS = ['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
+
+# the fraction of the Oregon population in each age band (2019 census estimates)
+OREGON_AGE_DISTRIBUTION = [0.23, 0.13, 0.14, 0.12, 0.12, 0.13, 0.09, 0.04]
+
+# The age specific branches of the health states, the 'next state by age' that add_age_branches()
+# adds to a health state graph. Symptomatic people become severe or critical, and critical people
+# die, more often as they get older.
+DEFAULT_AGE_BRANCHES = {
+    'presymptomatic': {
+        '0-19': [(0.95, 'mild'), (0.99, 'severe'), (1.0, 'critical')],
+        '20-29': [(0.85, 'mild'), (0.96, 'severe'), (1.0, 'critical')],
+        '30-39': [(0.78, 'mild'), (0.93, 'severe'), (1.0, 'critical')],
+        '40-49': [(0.65, 'mild'), (0.88, 'severe'), (1.0, 'critical')],
+        '50-59': [(0.50, 'mild'), (0.80, 'severe'), (1.0, 'critical')],
+        '60-69': [(0.35, 'mild'), (0.70, 'severe'), (1.0, 'critical')],
+        '70-79': [(0.25, 'mild'), (0.60, 'severe'), (1.0, 'critical')],
+        '80+': [(0.20, 'mild'), (0.55, 'severe'), (1.0, 'critical')]
+    },
+    'critical': {
+        '0-19': [(0.98, 'immune'), (1.0, 'dead')],
+        '20-29': [(0.96, 'immune'), (1.0, 'dead')],
+        '30-39': [(0.93, 'immune'), (1.0, 'dead')],
+        '40-49': [(0.90, 'immune'), (1.0, 'dead')],
+        '50-59': [(0.85, 'immune'), (1.0, 'dead')],
+        '60-69': [(0.75, 'immune'), (1.0, 'dead')],
+        '70-79': [(0.60, 'immune'), (1.0, 'dead')],
+        '80+': [(0.45, 'immune'), (1.0, 'dead')]
+    }
+}
+
+# The mean daily contacts a person in the age group of the row has with people in the age group of
+# the column. Only the shape matters, the contacts are scaled so that the mean daily contacts of the
+# population are the daily contacts of the current phase.
+DEFAULT_CONTACT_MATRIX = [
+    # 0-19  20-29 30-39 40-49 50-59 60-69 70-79 80+
+    [8.0, 1.2, 2.2, 2.0, 1.0, 0.6, 0.3, 0.1],  # 0-19
+    [1.6, 4.0, 2.0, 1.6, 1.4, 0.6, 0.3, 0.1],  # 20-29
+    [2.6, 2.0, 3.4, 2.2, 1.6, 0.8, 0.3, 0.1],  # 30-39
+    [2.4, 1.6, 2.2, 3.2, 2.0, 0.9, 0.4, 0.2],  # 40-49
+    [1.4, 1.6, 1.8, 2.2, 2.8, 1.4, 0.6, 0.2],  # 50-59
+    [0.8, 0.8, 1.0, 1.2, 1.6, 2.2, 1.0, 0.4],  # 60-69
+    [0.5, 0.4, 0.5, 0.6, 0.8, 1.2, 1.6, 0.6],  # 70-79
+    [0.3, 0.2, 0.3, 0.4, 0.4, 0.6, 0.8, 1.0]   # 80+
+]
+
+
+def assign_age_groups(population, distribution=None, seed=None):
+    """
+    Randomly assign an age group to everyone in a population.
+
+    :param population: (int, required) The number of people.
+    :param distribution: ([float], optional, default=None) The fraction of the population in each
+    age group, None for OREGON_AGE_DISTRIBUTION.
+    :param seed: (int, optional, default=None) The seed for the assignment.
+    :return: (numpy.ndarray of int) The index of the age group of each person.
+    """
+    if distribution is None:
+        distribution = OREGON_AGE_DISTRIBUTION
+    distribution = np.asarray(distribution, dtype=float)
+    return np.random.default_rng(seed).choice(len(distribution), population, p=distribution / distribution.sum())
+
+
+def add_age_branches(health_states, branches=None):
+    """
+    Add age specific branches to a health state graph.
+
+    :param health_states: (dict, required) The health states, they are not changed.
+    :param branches: (dict, optional, default=None) The 'next state by age' of health states,
+    keyed by health state name, None for DEFAULT_AGE_BRANCHES.
+    :return: (dict) A copy of the health states with the age specific branches.
+    """
+    if branches is None:
+        branches = DEFAULT_AGE_BRANCHES
+    aged_states = copy.deepcopy(health_states)
+    for name, state_branches in branches.items():
+        aged_states[name]['next state by age'] = state_branches
+    return aged_states
+
+
+def create_infections(contact_matrix=None):
+    """
+    Create the age-mixing contact model for array_population.create_model(). Each day the force of
+    infection on an age group is the transmission probability x the contact matrix x the infectious
+    fraction (weighted by activity level) of each age group, and a person who can be infected is
+    infected with probability 1 - exp(-force x activity level).
+
+    :param contact_matrix: ([[float]], optional, default=None) The age group contact matrix, None
+    for DEFAULT_CONTACT_MATRIX.
+    :return: (function) The contact model.
+    """
+    matrix = np.asarray(DEFAULT_CONTACT_MATRIX if contact_matrix is None else contact_matrix, dtype=float)
+    row_contacts = matrix.sum(axis=1)
+
+    def infections(sim_state, model):
+        table = model['table']
+        people = model['people']
+        state = people['state']
+        age_group = people['age group']
+        # people in the hospital or dead are not in the population, and make no contacts
+        present = ~table['hospitalize'][state] & (state != table['dead state'])
+        present_count = np.bincount(age_group[present], minlength=len(matrix))
+        infectious = np.flatnonzero(table['infectious'][state] & present)
+        infectious_activity = np.bincount(age_group[infectious], weights=table['activity level'][state[infectious]],
+                                          minlength=len(matrix))
+        contacts_scale = sim_state[s.CURRENT_DAILY_CONTACTS] * present_count.sum() / \
+            max(float(present_count @ row_contacts), 1.0e-12)
+        force = sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] * contacts_scale * \
+            (matrix @ (infectious_activity / np.maximum(present_count, 1)))
+        susceptible = np.flatnonzero(table['can be infected'][state])
+        probability = -np.expm1(-force[age_group[susceptible]] * table['activity level'][state[susceptible]])
+        return susceptible[np.random.random(len(susceptible)) < probability]
+
+    return infections
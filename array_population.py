@@ -0,0 +1,126 @@
+"""
+A population model (see simulate.create_initial_state()) that keeps the population in the arrays
+of state_tables rather than as a person dictionary for each person, so a day of the health of the
+whole population is a few vectorized steps. Who infects whom is up to a contact model - a function
+that returns the people infected by their contacts today, i.e. over the edges of a contact network
+(see network.py).
+
+The statistics for the day are counted as covid_state.advance_health_state counts them for a
+person, and people in a state that requires hospitalization are out of the population (they make
+no contacts) until they recover, as they are moved from PEOPLE to HOSPITALIZED_PEOPLE there.
+"""
+import numpy as np
+import simulate as s
+import state_tables
+
+
+def create_model(table, population, infections, age_groups=None):
+    """
+    Create an array population model.
+
+    :param table: (dict, required) The compiled health states, see state_tables.compile_health_states().
+    :param population: (int, required) The size of the population, the same as the simulation population.
+    :param infections: (function, required) The contact model, called as infections(sim_state, model)
+    every day after the health of the population has been advanced. It returns the indices of the
+    people who can be infected that were infected by their contacts that day.
+    :param age_groups: (numpy.ndarray of int, optional, default=None) The age group of each person
+    (an index into the age groups of the table), None for no age structure.
+    :return: (dict) The population model.
+    """
+    return {
+        'table': table,
+        'population': population,
+        'age groups': age_groups,
+        'people': None,
+        'testing probability': None,
+        'infections': infections,
+        'initialize': initialize,
+        'evaluate day': evaluate_day
+    }
+
+
+def initialize(sim_state):
+    """
+    Create the healthy population of the model and infect the initial infection.
+
+    :param sim_state: (dict, required) The simulation state.
+    :return: None
+    """
+    model = sim_state[s.POPULATION_MODEL]
+    if model['population'] != sim_state[s.POPULATION]:
+        raise ValueError(f'the population model is for a population of {model["population"]}, '
+                         f'the simulation population is {sim_state[s.POPULATION]}')
+    table = model['table']
+    model['testing probability'] = None
+    people = model['people'] = state_tables.create_people(table, model['population'], model['age groups'])
+    state_tables.set_infected(
+        table, people, np.random.choice(model['population'],
+                                        min(sim_state[s.INITIAL_INFECTION], model['population']), replace=False))
+
+
+def evaluate_day(sim_state, day):
+    """
+    Evaluate the health and the contacts of the population for a day.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param day: (int, required) The day of the simulation.
+    :return: None
+    """
+    model = sim_state[s.POPULATION_MODEL]
+    table = model['table']
+    people = model['people']
+    # the testing probabilities change with the phase
+    if model['testing probability'] != sim_state[s.CURRENT_TESTING_PROBABILITY]:
+        state_tables.update_testing(table, sim_state[s.HEALTH_STATES])
+        model['testing probability'] = sim_state[s.CURRENT_TESTING_PROBABILITY]
+    count_transitions(sim_state, model, *state_tables.advance_day(
+        table, people, np.flatnonzero(people['state length'] >= 0)))
+    count_transitions(sim_state, model, *state_tables.transition(
+        table, people, model['infections'](sim_state, model)))
+
+
+def count_transitions(sim_state, model, moved, old_states, new_states):
+    """
+    Count the transitions of a day in the daily statistics, and test the people who moved to a state
+    that is tested.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param model: (dict, required) The population model.
+    :param moved: (numpy.ndarray of int, required) The people who moved, see state_tables.transition().
+    :param old_states: (numpy.ndarray of int, required) The states they moved from.
+    :param new_states: (numpy.ndarray of int, required) The states they moved to.
+    :return: None
+    """
+    if len(moved) == 0:
+        return
+    table = model['table']
+    tested = model['people']['tested']
+    was_hospitalized = table['hospitalize'][old_states]
+    was_icu = table['icu'][old_states]
+    sim_state[s.DAILY_CASES] += int(np.count_nonzero(new_states == table['infected state']))
+
+    died = new_states == table['dead state']
+    sim_state[s.DAILY_DEATHS] += int(np.count_nonzero(died))
+    sim_state[s.DAILY_HOSPITALIZATIONS] -= int(np.count_nonzero(died & was_hospitalized))
+    sim_state[s.DAILY_ICU] -= int(np.count_nonzero(died & was_icu))
+    sim_state[s.DAILY_CONFIRMED_DEATHS] += int(np.count_nonzero(died & tested[moved]))
+
+    recovered = new_states == table['recovered state']
+    discharged = recovered & was_hospitalized
+    sim_state[s.DAILY_HOSPITALIZATIONS] -= int(np.count_nonzero(discharged))
+    sim_state[s.DAILY_POPULATION] += int(np.count_nonzero(discharged))
+    sim_state[s.DAILY_ICU] -= int(np.count_nonzero(discharged & was_icu))
+    sim_state[s.DAILY_CONFIRMED_RECOVERIES] += int(np.count_nonzero(recovered & tested[moved]))
+    sim_state[s.DAILY_RECOVERIES] += int(np.count_nonzero(recovered))
+
+    alive = ~died
+    testing = table['testing'][new_states]
+    newly_tested = alive & table['infectious'][new_states] & (testing > 0.0) & \
+        (np.random.random(len(moved)) < testing)
+    tested[moved[newly_tested]] = True
+    sim_state[s.DAILY_CONFIRMED_CASES] += int(np.count_nonzero(newly_tested))
+
+    admitted = alive & table['hospitalize'][new_states]
+    sim_state[s.DAILY_POPULATION] -= int(np.count_nonzero(admitted))
+    sim_state[s.DAILY_HOSPITALIZATIONS] += int(np.count_nonzero(admitted))
+    sim_state[s.DAILY_ICU] += int(np.count_nonzero(alive & table['icu'][new_states]))
@@ -0,0 +1,313 @@
+"""
+Calibrate the phase parameters ('daily contacts', 'transmission probability', and 'testing
+probability') against the Oregon observations. Instead of hand tuning the phases file until the
+curves look like the Oregon data, the parameters to vary are given as ranges, e.g.:
+
+    python calibrate.py -ph ./data/expl3/covid_phases.json
+        -v "normal:transmission probability:0.015:0.035"
+        -v "lock down:daily contacts:6:14" -o ./data/calibrated_phases.json
+
+Every parameter point is run for a number of stochastic replicates (with the same seeds for every
+point) across a process pool, and the mean simulated cumulative confirmed cases and confirmed deaths
+are scored against the observed series from oregon_data (scaled to the simulated population). The
+search is a Latin hypercube sample of the ranges, refined for some rounds around the best point.
+The score of every point that has been evaluated is kept in a cache file, so points that have
+already been evaluated (in this or an earlier calibration) are not run again.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import simulate as s
+import scenario
+import covid_state
+import oregon_data
+
+PARAMETERS = ('daily contacts', 'transmission probability', 'testing probability')
+SCORED_SERIES = (s.CUMULATIVE_CONFIRMED_CASES_SERIES, s.CUMULATIVE_CONFIRMED_DEATHS_SERIES)
+DEFAULT_CACHE = './data/calibration_cache.jsonl'
+
+
+def read_observed(population, file_name=oregon_data.OREGON_CSV):
+    """
+    Read the observed cumulative confirmed cases and deaths, scaled to the simulated population,
+    with day 0 as the first day of the observations.
+
+    :param population: (int, required) The simulated population.
+    :param file_name: (str, optional, default=oregon_data.OREGON_CSV) The Oregon .csv file.
+    :return: (dict) The observed series (numpy arrays, NaN where there was no report) keyed by
+    the simulation series keys.
+    """
+    daily = oregon_data.read_daily_updates(file_name)
+    daily = daily.reindex(np.arange(daily.index[0], daily.index[-1] + np.timedelta64(1, 'D'),
+                                    dtype='datetime64[D]'))
+    scale = population / oregon_data.OREGON_POPULATION
+    return {
+        s.CUMULATIVE_CONFIRMED_CASES_SERIES: daily['positive'].to_numpy() * scale,
+        s.CUMULATIVE_CONFIRMED_DEATHS_SERIES: daily['cumulative deaths'].to_numpy() * scale
+    }
+
+
+def distance(simulated, observed, last_day=None, deaths_weight=1.0):
+    """
+    The distance between simulated and observed series - the sum, over the days with observations,
+    of the squared difference of log(1 + count), for the cumulative confirmed cases and (weighted)
+    cumulative confirmed deaths. This never decreases as days are added, so the distance of a
+    partial run is a lower bound on the distance of the complete run.
+
+    :param simulated: (dict, required) The simulated series keyed by the series keys.
+    :param observed: (dict, required) The observed series, see read_observed().
+    :param last_day: (int, optional, default=None) The last day included, None for all of the days
+    that are in both the simulated and observed series.
+    :param deaths_weight: (float, optional, default=1.0) The weight of the deaths.
+    :return: (float) The distance.
+    """
+    total = 0.0
+    for series_key, weight in zip(SCORED_SERIES, (1.0, deaths_weight)):
+        days = min(len(simulated[series_key]), len(observed[series_key]))
+        if last_day is not None:
+            days = min(days, last_day + 1)
+        simulated_data = np.asarray(simulated[series_key][:days], dtype=float)
+        observed_data = observed[series_key][:days]
+        reported = ~np.isnan(observed_data)
+        total += weight * np.sum((np.log1p(simulated_data[reported]) - np.log1p(observed_data[reported])) ** 2)
+    return total
+
+
+def parse_parameter(description, phases_config):
+    """
+    Parse a parameter range description "phase:parameter:low:high".
+
+    :param description: (str, required) The description.
+    :param phases_config: (dict, required) The phases description the parameter is in.
+    :return: ((str, str, float, float)) The phase, parameter, low, and high.
+    """
+    fields = description.split(':')
+    if len(fields) != 4:
+        raise ValueError(f'expected "phase:parameter:low:high", not "{description}"')
+    phase, parameter, low, high = fields[0].strip(), fields[1].strip(), float(fields[2]), float(fields[3])
+    if phase not in phases_config['phases']:
+        raise ValueError(f'unknown phase: "{phase}"')
+    if parameter not in PARAMETERS:
+        raise ValueError(f'parameter must be one of {PARAMETERS}, not "{parameter}"')
+    if high < low:
+        raise ValueError(f'the range of {phase}:{parameter} is empty')
+    return phase, parameter, low, high
+
+
+def apply_point(phases_config, parameters, point):
+    """
+    Make the phases description for a parameter point.
+
+    :param phases_config: (dict, required) The base phases description.
+    :param parameters: ([(str, str, float, float)], required) The parameters.
+    :param point: ([float], required) The value of each parameter.
+    :return: (dict) A copy of the phases description with the parameter values set.
+    """
+    point_config = copy.deepcopy(phases_config)
+    for (phase, parameter, _, _), value in zip(parameters, point):
+        point_config['phases'][phase][parameter] = int(round(value)) if parameter == 'daily contacts' \
+            else float(value)
+    return point_config
+
+
+def scenario_key(point_config, event_list, population, simulation_days, initial_infection, seeds):
+    """
+    The key of a calibration point in the cache - the hash of everything that determines the result,
+    including the version of the simulation engine and the health state graph (see
+    result_cache.result_key()).
+    """
+    description = json.dumps([s.ENGINE_VERSION, covid_state.health_graph_key(), point_config, event_list,
+                              population, simulation_days, initial_infection, seeds], sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def read_cache(file_name):
+    cache = {}
+    if file_name is not None and os.path.exists(file_name):
+        with open(file_name, "r") as cache_file:
+            for line in cache_file:
+                if line.strip() != '':
+                    entry = json.loads(line)
+                    cache[entry['key']] = entry
+    return cache
+
+
+def _run_replicate(task):
+    """
+    Run one replicate of a point in a worker process, and return the scored series.
+    """
+    point_config, event_list, population, simulation_days, initial_infection, seed = task
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(point_config, event_list, population, simulation_days,
+                                          initial_infection, seed)
+    return {series_key: sim_state[series_key] for series_key in SCORED_SERIES}
+
+
+def sample_points(rng, bounds, center, width_scale, samples):
+    """
+    A Latin hypercube sample of the parameter ranges, scaled around a center point.
+
+    :param rng: (numpy.random.Generator, required) The random generator for the sample.
+    :param bounds: (numpy.ndarray, required) The (low, high) of each parameter.
+    :param center: (numpy.ndarray, required) The center of the sample, None for the whole range.
+    :param width_scale: (float, required) The width of the sample as a fraction of the range.
+    :param samples: (int, required) The number of points.
+    :return: (numpy.ndarray) The points, one row per point.
+    """
+    low, high = bounds[:, 0], bounds[:, 1]
+    width = (high - low) * width_scale
+    if center is None:
+        center = (low + high) / 2.0
+    sample_low = np.clip(center - width / 2.0, low, high - width)
+    strata = np.array([rng.permutation(samples) for _ in range(len(bounds))]).T
+    return sample_low + width * (strata + rng.random((samples, len(bounds)))) / samples
+
+
+def calibrate(phases_config, parameters, observed, event_list=None,
+              population=s.DEFAULT_POPULATION, simulation_days=None,
+              initial_infection=s.DEFAULT_INITIAL_INFECTION,
+              samples=16, rounds=3, shrink=0.5, replicates=4, seed=42,
+              deaths_weight=1.0, workers=None, cache_file=DEFAULT_CACHE):
+    """
+    Search the parameter space for the phases that best fit the observations.
+
+    :param phases_config: (dict, required) The base phases description.
+    :param parameters: ([(str, str, float, float)], required) The (phase, parameter, low, high) to vary.
+    :param observed: (dict, required) The observed series, see read_observed().
+    :param event_list: ([dict], optional, default=None) The event descriptions.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The simulated population.
+    :param simulation_days: (int, optional, default=None) The days to simulate, None for the days observed.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The initial infection.
+    :param samples: (int, optional, default=16) The points in each round.
+    :param rounds: (int, optional, default=3) The rounds of the search.
+    :param shrink: (float, optional, default=0.5) The width of each round relative to the last.
+    :param replicates: (int, optional, default=4) The stochastic replicates of each point.
+    :param seed: (int, optional, default=42) The seed of the search, and the first replicate seed.
+    :param deaths_weight: (float, optional, default=1.0) The weight of the deaths in the distance.
+    :param workers: (int, optional, default=None) The worker processes, None for the number of cores.
+    :param cache_file: (str, optional, default=DEFAULT_CACHE) The cache of evaluated points, None for none.
+    :return: ((dict, float, [dict])) The best phases description, its distance, and all the
+    evaluated points in this calibration sorted by distance.
+    """
+    if simulation_days is None:
+        simulation_days = len(observed[s.CUMULATIVE_CONFIRMED_CASES_SERIES]) - 1
+    rng = np.random.default_rng(seed)
+    seeds = [seed + replicate for replicate in range(replicates)]
+    bounds = np.array([[low, high] for _, _, low, high in parameters])
+    cache = read_cache(cache_file)
+    evaluated = {}
+    best = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for round_index in range(rounds):
+            points = sample_points(rng, bounds, None if best is None else np.array(best['point']),
+                                   shrink ** round_index, samples)
+            # run the replicates of every point that has not been evaluated before
+            pending = {}
+            for point in points:
+                point_config = apply_point(phases_config, parameters, point)
+                key = scenario_key(point_config, event_list, population, simulation_days, initial_infection, seeds)
+                if key in cache:
+                    # the distance is computed again, the observations or the weights may not be
+                    # the ones the point was cached with
+                    entry = cache[key]
+                    entry['distance'] = float(distance(entry['mean series'], observed, deaths_weight=deaths_weight))
+                    evaluated[key] = entry
+                elif key not in pending:
+                    pending[key] = (point, point_config, [executor.submit(
+                        _run_replicate,
+                        (point_config, event_list, population, simulation_days, initial_infection, replicate_seed))
+                        for replicate_seed in seeds])
+            for key, (point, point_config, futures) in pending.items():
+                runs = [future.result() for future in futures]
+                mean_series = {series_key: np.mean([run[series_key] for run in runs], axis=0).tolist()
+                               for series_key in SCORED_SERIES}
+                entry = {
+                    'key': key,
+                    'point': [float(value) for value in point],
+                    'distance': float(distance(mean_series, observed, deaths_weight=deaths_weight)),
+                    'phases': point_config,
+                    'mean series': mean_series
+                }
+                cache[key] = evaluated[key] = entry
+                if cache_file is not None:
+                    with open(cache_file, "a") as cache_out:
+                        cache_out.write(json.dumps(entry) + '\n')
+            best = min(evaluated.values(), key=lambda evaluated_entry: evaluated_entry['distance'])
+            print(f'round {round_index}: {len(points)} points, {len(pending)} run, '
+                  f'best distance {best["distance"]:.4f} at {best["point"]}')
+
+    ranked = sorted(evaluated.values(), key=lambda evaluated_entry: evaluated_entry['distance'])
+    return best['phases'], best['distance'], ranked
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Calibrate the phase parameters against the Oregon observations.')
+    parser.add_argument(
+        '-ph', '--phases', dest='phases', type=str, required=True,
+        help='The JSON file containing the simulation phases description to be calibrated.')
+    parser.add_argument(
+        '-v', '--vary', dest='vary', type=str, action='append', required=True,
+        help='A parameter to vary, "phase:parameter:low:high", may be repeated.')
+    parser.add_argument(
+        '-e', '--events', dest='events', type=str, default=None,
+        help='The JSON files containing the events descriptions, comma separated.')
+    parser.add_argument(
+        '-o', '--output', dest='output', type=str, default=None,
+        help='The .json file to which the best fit phases will be written.')
+    parser.add_argument(
+        '-p', '--population', dest='population', type=int, default=s.DEFAULT_POPULATION,
+        help='The population for the simulation.')
+    parser.add_argument(
+        '-d', '--days', dest='sim_days', type=int, default=None,
+        help='The length of the simulation in days, default is the days of observations.')
+    parser.add_argument(
+        '-i', '--infection', dest='infection', type=int, default=s.DEFAULT_INITIAL_INFECTION,
+        help='The default infection (not tested).')
+    parser.add_argument(
+        '-n', '--samples', dest='samples', type=int, default=16,
+        help='The number of parameter points in each round of the search.')
+    parser.add_argument(
+        '--rounds', dest='rounds', type=int, default=3,
+        help='The number of rounds of the search, each round is around the best point so far.')
+    parser.add_argument(
+        '-r', '--replicates', dest='replicates', type=int, default=4,
+        help='The number of stochastic replicates of each parameter point.')
+    parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='The number of worker processes, default is the number of cores.')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=42,
+        help='The seed for the search and the replicates.')
+    parser.add_argument(
+        '--deaths-weight', dest='deaths_weight', type=float, default=1.0,
+        help='The weight of the deaths relative to the cases in the distance.')
+    parser.add_argument(
+        '-c', '--cache', dest='cache', type=str, default=DEFAULT_CACHE,
+        help='The file of evaluated points that are reused.')
+    args = parser.parse_args()
+
+    base_phases = scenario.read_phases(args.phases)
+    best_phases, best_distance, ranked_points = calibrate(
+        base_phases, [parse_parameter(description, base_phases) for description in args.vary],
+        read_observed(args.population),
+        event_list=None if args.events is None else
+        scenario.read_events([file_name.strip() for file_name in args.events.split(',')]),
+        population=args.population, simulation_days=args.sim_days, initial_infection=args.infection,
+        samples=args.samples, rounds=args.rounds, replicates=args.replicates, seed=args.seed,
+        deaths_weight=args.deaths_weight, workers=args.workers, cache_file=args.cache)
+
+    print(f'best distance: {best_distance:.4f}')
+    for description, value in zip(args.vary, ranked_points[0]['point']):
+        print(f'  {description.rsplit(":", 2)[0]}: {value:.4f}')
+    if args.output is not None:
+        with open(args.output, "w") as fw:
+            json.dump(best_phases, fw, indent=2)
+    else:
+        print(json.dumps(best_phases, indent=2))
@@ -0,0 +1,5 @@
+# The modules of the simulation are at the top of the repository, this makes them importable by the tests.
+import os
+
+# The tests do not read or write the result cache of the seeded runs, unless they set one.
+os.environ['SIMULATION_RESULT_CACHE'] = 'off'
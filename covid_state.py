@@ -1,7 +1,15 @@
+import hashlib
+import json
 import math
+import os
+import pickle
 import random
 import numpy as np
 import simulate as s
+import state_tables
+import crn
+import events
+from person import NO_BED, WAITING_FOR_HOSPITAL_BED, WAITING_FOR_ICU_BED, HOSPITAL_BED, ICU_BED
 
 HEALTH_STATES = {
     'well': {
@@ -70,7 +78,9 @@ HEALTH_STATES = {
         'hospitalize': True,
         'icu': False,
         'activity level': 0.05,
-        'next state': [(1.0, 'immune')]
+        'next state': [(1.0, 'immune')],
+        'next state without care': [(0.85, 'immune'),
+                                    (1.0, 'dead')]
     },
     'critical': {
         'name': 'critical',
@@ -82,7 +92,9 @@ HEALTH_STATES = {
         'icu': True,
         'activity level': 0.05,
         'next state': [(0.8, 'immune'),
-                       (1.0, 'dead')]
+                       (1.0, 'dead')],
+        'next state without care': [(0.2, 'immune'),
+                                    (1.0, 'dead')]
     },
     'immune': {
         'name': 'immune',
@@ -103,13 +115,189 @@ HEALTH_STATES = {
 }
 DEFAULT_HEALTH_STATE = HEALTH_STATES['well']
 
+# The quantities derived from the health state graph (the mean infectious days and the testing
+# split for a testing probability) are the same for every run of a sweep, so they are computed
+# once and kept here, keyed by the graph key (see health_graph_key()). The graph key is computed
+# when it is first needed, call invalidate_derived() after the health states are changed.
+_DERIVED = {}
+_GRAPH_KEY = None
 
-def get_mean_infectious_days():
+
+def health_graph_key():
     """
+    The key of the current health state graph - everything in the health states except the
+    testing probabilities, which are derived from the graph and change with the phase.
 
+    :return: (str) The key.
+    """
+    global _GRAPH_KEY
+    if _GRAPH_KEY is None:
+        _GRAPH_KEY = json.dumps({name: {key: value for key, value in health_state.items() if key != 'testing'}
+                                 for name, health_state in HEALTH_STATES.items()}, sort_keys=True)
+    return _GRAPH_KEY
 
-    :return:
+
+def invalidate_derived():
+    """
+    Forget the derived quantities of the health state graph, this must be called when the health
+    states are changed.
+
+    :return: None
     """
+    global _GRAPH_KEY
+    _GRAPH_KEY = None
+    _DERIVED.clear()
+
+
+# The states that the model refers to by name, and the number of next states the model expects of
+# the ones it looks into (the testing split, see set_testing_for_phase()).
+REQUIRED_STATES = {
+    'well': None, 'infected': 2, 'presymptomatic': 3, 'mild': None, 'severe': None, 'critical': None,
+    'immune': None, 'dead': None
+}
+# Change this when the form of the compiled health states changes, so old cache files are not used.
+_COMPILED_VERSION = 1
+# The file the current health states were loaded from, None for the built in health states.
+HEALTH_STATES_FILE = None
+
+
+def validate_health_states(health_states):
+    """
+    Validate a health state graph.
+
+    :param health_states: (dict, required) The health states, keyed by state name.
+    :return: None
+    :raises ValueError: If the graph is not a valid health state graph for this model.
+    """
+    if not isinstance(health_states, dict):
+        raise ValueError('the health states must be a dictionary keyed by state name')
+    for name, next_count in REQUIRED_STATES.items():
+        if name not in health_states:
+            raise ValueError(f'the health state "{name}" is missing')
+        if next_count is not None and len(health_states[name].get('next state', ())) != next_count:
+            raise ValueError(f'the health state "{name}" must have {next_count} next states')
+    for name, health_state in health_states.items():
+        if not isinstance(health_state, dict):
+            raise ValueError(f'the health state "{name}" must be a dictionary')
+        if health_state.get('name', name) != name:
+            raise ValueError(f'the health state "{name}" has the name "{health_state["name"]}"')
+        for key in ('can be infected', 'infectious', 'hospitalize', 'icu'):
+            if not isinstance(health_state.get(key, False), bool):
+                raise ValueError(f'"{key}" of the health state "{name}" must be true or false')
+        days = health_state.get('days at state')
+        if not isinstance(days, (int, float)) or (days != -1 and days <= 0):
+            raise ValueError(f'"days at state" of the health state "{name}" must be -1 or more than 0')
+        if health_state.get('activity level', 0.0) < 0.0:
+            raise ValueError(f'"activity level" of the health state "{name}" must not be negative')
+        if days != -1 and len(health_state.get('next state', ())) == 0:
+            raise ValueError(f'the health state "{name}" progresses, but has no "next state"')
+        # the 'next state without care' is the next state of a person who needed a hospital (or
+        # ICU) bed and did not get one
+        for key in ('next state', 'next state without care'):
+            _validate_next_states(health_states, name, key, health_state.get(key, ()))
+
+
+def _validate_next_states(health_states, name, key, next_states):
+    """
+    Validate the next states of a health state.
+
+    :param health_states: (dict, required) The health states, keyed by state name.
+    :param name: (str, required) The name of the health state.
+    :param key: (str, required) The key of the next states, i.e. 'next state'.
+    :param next_states: (list, required) The next states.
+    :return: None
+    :raises ValueError: If the next states are not valid.
+    """
+    last_probability = 0.0
+    for next_state in next_states:
+        if len(next_state) != 2 or next_state[1] not in health_states:
+            raise ValueError(f'"{key}" {next_state} of the health state "{name}" must be '
+                             f'[cumulative probability, state name]')
+        if not last_probability <= next_state[0] <= 1.0:
+            raise ValueError(f'the "{key}" cumulative probabilities of the health state "{name}" '
+                             f'must increase to 1.0')
+        last_probability = next_state[0]
+    if len(next_states) > 0 and last_probability != 1.0:
+        raise ValueError(f'the last "{key}" of the health state "{name}" must have a cumulative '
+                         f'probability of 1.0')
+
+
+def set_health_states(health_states, file_name=None):
+    """
+    Replace the health states of the model.
+
+    :param health_states: (dict, required) The health states, see validate_health_states().
+    :param file_name: (str, optional, default=None) The file the health states were read from.
+    :return: None
+    """
+    global DEFAULT_HEALTH_STATE, HEALTH_STATES_FILE
+    # the dictionary is referenced by simulation states, so it is changed rather than replaced
+    HEALTH_STATES.clear()
+    HEALTH_STATES.update(health_states)
+    for name, health_state in HEALTH_STATES.items():
+        health_state.setdefault('name', name)
+    DEFAULT_HEALTH_STATE = HEALTH_STATES['well']
+    HEALTH_STATES_FILE = file_name
+    invalidate_derived()
+
+
+def _compiled_cache_file_name(file_name, file_hash):
+    directory, base_name = os.path.split(file_name)
+    return os.path.join(directory, f'.{os.path.splitext(base_name)[0]}.{file_hash[:16]}.pkl')
+
+
+def load_health_states(file_name):
+    """
+    Load the health states of the model from a JSON file, and compile them into the array
+    transition tables (see state_tables.compile_health_states()). The validated and compiled
+    health states are cached in a file next to the JSON file, keyed by the hash of the JSON file,
+    so the next time they are loaded (i.e. by the workers of a sweep) the JSON is not parsed or
+    validated again.
+
+    :param file_name: (str, required) The JSON health states file.
+    :return: (dict) The compiled table of the health states.
+    """
+    with open(file_name, 'rb') as states_file:
+        contents = states_file.read()
+    file_hash = hashlib.sha256(contents + str(_COMPILED_VERSION).encode()).hexdigest()
+    cache_file_name = _compiled_cache_file_name(file_name, file_hash)
+    compiled = None
+    if os.path.exists(cache_file_name):
+        try:
+            with open(cache_file_name, 'rb') as cache_file:
+                compiled = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            compiled = None
+    if compiled is None:
+        health_states = json.loads(contents)
+        validate_health_states(health_states)
+        compiled = {
+            'health states': health_states,
+            'table': state_tables.compile_health_states(health_states)
+        }
+        # written to a temporary file and renamed, so a worker never reads a partly written cache
+        temporary_file_name = f'{cache_file_name}.{os.getpid()}'
+        with open(temporary_file_name, 'wb') as cache_file:
+            pickle.dump(compiled, cache_file)
+        os.replace(temporary_file_name, cache_file_name)
+    set_health_states(compiled['health states'], file_name)
+    return compiled['table']
+
+
+def get_mean_infectious_days():
+    """
+    The mean number of days a person who is infected is out infecting other people, this is
+    computed once for a health state graph.
+
+    :return: (float) The mean infectious days.
+    """
+    key = (health_graph_key(), 'mean infectious days')
+    if key not in _DERIVED:
+        _DERIVED[key] = _compute_mean_infectious_days()
+    return _DERIVED[key]
+
+
+def _compute_mean_infectious_days():
     # First question - why do we want this? Because the infectious days is part of the Ro
     # calculation: Ro = contacts x transmission probability x infectious days
     #
@@ -163,11 +351,12 @@ def set_default_health_state(person, local):
     :param local
     :return:
     """
-    person['state'] = DEFAULT_HEALTH_STATE
-    person['tested'] = False
-    person['days at state'] = 1
-    person['state length'] = -1
-    person['local'] = local
+    person.state = DEFAULT_HEALTH_STATE
+    person.tested = False
+    person.days_at_state = 1
+    person.state_length = -1
+    person.local = local
+    person.bed = NO_BED
     return
 
 
@@ -177,11 +366,11 @@ def set_initial_infected_state(person):
     :param person:
     :return:
     """
-    person['state'] = HEALTH_STATES['infected']
-    person['tested'] = False
+    person.state = HEALTH_STATES['infected']
+    person.tested = False
     # set the state so that the person will immediately become infectious
-    person['days at state'] = 1
-    person['state length'] = 0
+    person.days_at_state = 1
+    person.state_length = 0
     return
 
 
@@ -192,9 +381,9 @@ def evaluate_health_for_day(sim_state, person):
     :param person:
     :return:
     """
-    old_health_state = person['state']
-    person['days at state'] += 1
-    if 0 <= person['state length'] < person['days at state']:
+    old_health_state = person.state
+    person.days_at_state += 1
+    if 0 <= person.state_length < person.days_at_state:
         # The person is in a state that progresses after some number of days
         # and that number of days was reached - move to the next state and
         # reset this to the first day at that new state.
@@ -205,9 +394,28 @@ def evaluate_health_for_day(sim_state, person):
 
 def set_testing_for_phase(testing_probability):
     """
+    Set the testing probabilities of the mild, severe, and critical states for the testing
+    probability of a phase.
 
-    :param testing_probability:
-    :return:
+    :param testing_probability: (float, required) The testing probability of the phase.
+    :return: None
+    """
+    key = (health_graph_key(), 'testing', testing_probability)
+    if key not in _DERIVED:
+        _DERIVED[key] = _compute_testing_split(testing_probability)
+    for name, testing in zip(('critical', 'severe', 'mild'), _DERIVED[key]):
+        if testing is not None:
+            HEALTH_STATES[name]['testing'] = testing
+
+
+def _compute_testing_split(testing_probability):
+    """
+    Split the testing probability of a phase into the testing probabilities of the critical,
+    severe, and mild states - the most sick are tested first.
+
+    :param testing_probability: (float, required) The testing probability of the phase.
+    :return: ((float, float, float)) The critical, severe, and mild testing probabilities, None for
+    a state whose testing probability is left as it is.
     """
     symptomatic_probability = HEALTH_STATES['infected']['next state'][1][0] - \
                               HEALTH_STATES['infected']['next state'][0][0]
@@ -220,24 +428,17 @@ def set_testing_for_phase(testing_probability):
                             HEALTH_STATES['presymptomatic']['next state'][1][0]) * \
                            symptomatic_probability
     if critical_probability > testing_probability:
-        HEALTH_STATES['critical']['testing'] = testing_probability / critical_probability
-        HEALTH_STATES['severe']['testing'] = 0.0
-        HEALTH_STATES['mild']['testing'] = 0.0
-        return
+        return testing_probability / critical_probability, 0.0, 0.0
 
     testing_probability -= critical_probability
-    HEALTH_STATES['critical']['testing'] = 1.0
     if severe_possibility > testing_probability:
-        HEALTH_STATES['severe']['testing'] = testing_probability / severe_possibility
-        HEALTH_STATES['mild']['testing'] = 0.0
-        return
+        return 1.0, testing_probability / severe_possibility, 0.0
 
     testing_probability -= severe_possibility
-    HEALTH_STATES['severe']['testing'] = 1.0
     if mild_probability > testing_probability:
-        HEALTH_STATES['mild']['testing'] = testing_probability / mild_probability
+        return 1.0, 1.0, testing_probability / mild_probability
 
-    return
+    return 1.0, 1.0, None
 
 
 def advance_health_state(sim_state, person, old_health_state):
@@ -249,67 +450,77 @@ def advance_health_state(sim_state, person, old_health_state):
     :return:
     """
     next_states = old_health_state['next state']
-    state_probability = random.random()
+    if person.bed == WAITING_FOR_HOSPITAL_BED or person.bed == WAITING_FOR_ICU_BED:
+        # this person needed a bed, and never got one
+        next_states = old_health_state.get('next state without care', next_states)
+    streams = sim_state[s.RANDOM_STREAMS]
+    state_probability = random.random() if streams is None else \
+        streams.uniform(person.id, crn.TRANSITION, person.state_id)
     for next_state in next_states:
         # there may be multiple next states with different probabilities
         # of advancement
         if state_probability <= next_state[0]:
             # Move to the next state
-            person['state'] = health_state = HEALTH_STATES[next_state[1]]
-            person['days at state'] = 1
+            person.state = health_state = HEALTH_STATES[next_state[1]]
+            person.days_at_state = 1
             mean = health_state['days at state']
             std_dev = health_state.get('standard_deviation', None)
             if mean == -1:
-                person['state length'] = -1
+                person.state_length = -1
             elif std_dev is None:
-                person['state length'] = mean
-            else:
-                person['state length'] = \
+                person.state_length = mean
+            elif streams is None:
+                person.state_length = \
                     int(np.random.lognormal(np.log(mean), np.log(math.sqrt(2.0))))
+            else:
+                person.state_length = int(streams.lognormal(
+                    person.id, crn.STATE_LENGTH, person.state_id, np.log(mean), np.log(math.sqrt(2.0))))
 
-            if person['local']:
+            if person.local:
+                if old_health_state.get('hospitalize', False):
+                    _leave_bed(sim_state, person)
                 if health_state['name'] == 'infected':
                     sim_state[s.DAILY_CASES] += 1
                 elif health_state['name'] == 'dead':
                     # this person has died
-                    sim_state[s.HOSPITALIZED_PEOPLE].remove(person)
+                    if sim_state[s.HOSPITALIZED_PEOPLE].pop(person.id, None) is None:
+                        # died without going into the hospital
+                        s.remove_from_people(sim_state, person)
+                        sim_state[s.DAILY_POPULATION] -= 1
+                        events.leave_rosters(sim_state, person)
                     sim_state[s.DAILY_DEATHS] += 1
-                    sim_state[s.DAILY_HOSPITALIZATIONS] -= 1
-                    sim_state[s.DAILY_ICU] -= 1
-                    if person['tested']:
+                    if person.tested:
                         sim_state[s.DAILY_CONFIRMED_DEATHS] += 1
                     return
                 elif health_state['name'] == 'immune':
                     # This is someone who has recovered
                     if old_health_state['hospitalize']:
-                        sim_state[s.DAILY_HOSPITALIZATIONS] -= 1
-                        sim_state[s.PEOPLE].append(person)
+                        s.add_to_people(sim_state, person)
                         sim_state[s.DAILY_POPULATION] += 1
-                        sim_state[s.HOSPITALIZED_PEOPLE].remove(person)
-                        if old_health_state['icu']:
-                            sim_state[s.DAILY_ICU] -= 1
-                    if person['tested']:
+                        events.join_rosters(sim_state, person)
+                        del sim_state[s.HOSPITALIZED_PEOPLE][person.id]
+                    if person.tested:
                         sim_state[s.DAILY_CONFIRMED_RECOVERIES] += 1
                     sim_state[s.DAILY_RECOVERIES] += 1
 
                 testing = health_state.get('testing', 0.0)
-                if testing > 0.0 and health_state['infectious'] and random.random() < testing:
-                    person['tested'] = True
+                if testing > 0.0 and health_state['infectious'] and \
+                        (random.random() if streams is None else
+                         streams.uniform(person.id, crn.TESTING, person.state_id)) < testing:
+                    person.tested = True
                     sim_state[s.DAILY_CONFIRMED_CASES] += 1
 
                 if health_state['hospitalize']:
-                    # this person has moved into a state requiring hospitalization
-                    sim_state[s.PEOPLE].remove(person)
-                    sim_state[s.DAILY_POPULATION] -= 1
-                    sim_state[s.HOSPITALIZED_PEOPLE].append(person)
-                    sim_state[s.DAILY_HOSPITALIZATIONS] += 1
-
-                if health_state['icu']:
-                    # this is a person who has moved into a state requiring
-                    # a ventilator (an ICU bed)
-                    sim_state[s.DAILY_ICU] += 1
-
-            if 0 <= person['state length'] < person['days at state']:
+                    # this person has moved into a state requiring hospitalization, and a
+                    # ventilator (an ICU bed) if it is an 'icu' state
+                    if not old_health_state.get('hospitalize', False):
+                        s.remove_from_people(sim_state, person)
+                        sim_state[s.DAILY_POPULATION] -= 1
+                        sim_state[s.HOSPITALIZED_PEOPLE][person.id] = person
+                        events.leave_rosters(sim_state, person)
+                    _take_bed(sim_state, person, health_state['icu'])
+
+            if 0 <= person.state_length < person.days_at_state:
                 # This can happen because some states can be less than a day in length
                 return advance_health_state(sim_state, person, health_state)
 
@@ -317,6 +528,89 @@ def advance_health_state(sim_state, person, old_health_state):
     return
 
 
+# The beds of the hospital and the ICU - the simulation state keys of the capacity, the beds that
+# are occupied, the queue, and the count of the people who are waiting, and the bed of a person
+# who is in a bed and who is waiting for one.
+_BEDS = {
+    False: (s.HOSPITAL_BEDS, s.OCCUPIED_HOSPITAL_BEDS, s.HOSPITAL_QUEUE, s.WAITING_FOR_HOSPITAL,
+            HOSPITAL_BED, WAITING_FOR_HOSPITAL_BED),
+    True: (s.ICU_BEDS, s.OCCUPIED_ICU_BEDS, s.ICU_QUEUE, s.WAITING_FOR_ICU, ICU_BED, WAITING_FOR_ICU_BED)
+}
+
+
+def _take_bed(sim_state, person, icu):
+    """
+    Put a person who has moved into a state requiring hospitalization in a bed, or at the end of the
+    queue for one if all of the beds are occupied.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :param icu: (bool, required) Does the person need an ICU bed.
+    :return: None
+    """
+    capacity, occupied, queue, waiting, _, waiting_bed = _BEDS[icu]
+    if sim_state[capacity] is None or sim_state[occupied] < sim_state[capacity]:
+        _admit(sim_state, person, icu)
+    else:
+        person.bed = waiting_bed
+        sim_state[queue].append(person)
+        sim_state[waiting] += 1
+
+
+def _admit(sim_state, person, icu):
+    # put a person in a bed that is free
+    sim_state[_BEDS[icu][1]] += 1
+    person.bed = _BEDS[icu][4]
+    sim_state[s.DAILY_HOSPITALIZATIONS] += 1
+    if icu:
+        sim_state[s.DAILY_ICU] += 1
+
+
+def _leave_bed(sim_state, person):
+    """
+    A person leaves a state requiring hospitalization - the bed they were in goes to the first
+    person in the queue for it, or if they were waiting they are no longer waiting. The people who
+    stop waiting are left in the queue and skipped when they come to the front of it, so nothing
+    ever looks through a queue.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    bed = person.bed
+    person.bed = NO_BED
+    if bed == WAITING_FOR_HOSPITAL_BED or bed == WAITING_FOR_ICU_BED:
+        sim_state[_BEDS[bed == WAITING_FOR_ICU_BED][3]] -= 1
+        return
+    if bed == NO_BED:
+        return
+    icu = bed == ICU_BED
+    _, occupied, queue_key, waiting, _, waiting_bed = _BEDS[icu]
+    sim_state[occupied] -= 1
+    sim_state[s.DAILY_HOSPITALIZATIONS] -= 1
+    if icu:
+        sim_state[s.DAILY_ICU] -= 1
+    queue = sim_state[queue_key]
+    while queue:
+        next_person = queue.popleft()
+        if next_person.bed == waiting_bed:
+            sim_state[waiting] -= 1
+            _admit(sim_state, next_person, icu)
+            return
+
+
+def infect_person(sim_state, person):
+    """
+    Infect a person who can be infected - this is the infection that would happen in
+    evaluate_contacts, for infections that were computed somewhere else (i.e. an event).
+
+    :param sim_state: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person being infected.
+    :return: None
+    """
+    advance_health_state(sim_state, person, person.state)
+
+
 def evaluate_contacts(sim_state, person, population):
     """
 
@@ -325,15 +619,18 @@ def evaluate_contacts(sim_state, person, population):
     :param population:
     :return:
     """
+    if sim_state[s.RANDOM_STREAMS] is not None:
+        _evaluate_common_contacts(sim_state, person)
+        return
     # can this person infect, or be infected - if so, daily contacts
     # must be traced to see if there is an infection event
     population_ct = len(population)
-    p_state = person['state']
+    p_state = person.state
     if p_state['can be infected']:
         # look for contacts with infectious individuals
         for _ in range(int((sim_state[s.CURRENT_DAILY_CONTACTS] * p_state['activity level']) / 2)):
             contact = population[random.randint(0, population_ct - 1)]
-            if contact['state']['infectious']:
+            if contact.state['infectious']:
                 # Oh, this the contact between a healthy person who
                 # can be infected and a 'contagious' person.
                 if random.random() < sim_state[s.CURRENT_TRANSMISSION_PROBABILITY]:
@@ -347,10 +644,44 @@ def evaluate_contacts(sim_state, person, population):
         # look for contacts with people who could be infected.
         for _ in range(int((sim_state[s.CURRENT_DAILY_CONTACTS] * p_state['activity level']) / 2)):
             contact = population[random.randint(0, population_ct - 1)]
-            if contact['state']['can be infected']:
+            if contact.state['can be infected']:
                 # Oh, this the contact between 'contagious' person
                 # and a healthy person who can be infected.
                 if random.random() < sim_state[s.CURRENT_TRANSMISSION_PROBABILITY]:
                     # Bummer, this is an infection contact
-                    advance_health_state(sim_state, contact, contact['state'])
+                    advance_health_state(sim_state, contact, contact.state)
     return
+
+
+def _evaluate_common_contacts(sim_state, person):
+    """
+    The daily contacts of evaluate_contacts() drawn from the common random number streams. The
+    contacts are drawn from everyone by person id, rather than from the people who are not in the
+    hospital (the order of those changes as people come and go from the hospital), so a person
+    has the same contacts on the same day in every scenario - a contact with someone who is in
+    the hospital is no contact.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    streams = sim_state[s.RANDOM_STREAMS]
+    everyone = sim_state[s.EVERYONE]
+    everyone_ct = len(everyone)
+    p_state = person.state
+    transmission_probability = sim_state[s.CURRENT_TRANSMISSION_PROBABILITY]
+    if p_state['can be infected']:
+        for contact_index in range(int((sim_state[s.CURRENT_DAILY_CONTACTS] * p_state['activity level']) / 2)):
+            contact_state = everyone[streams.randrange(person.id, crn.CONTACT, contact_index, everyone_ct)].state
+            if contact_state['infectious'] and not contact_state['hospitalize'] and \
+                    streams.uniform(person.id, crn.TRANSMISSION, contact_index) < transmission_probability:
+                advance_health_state(sim_state, person, p_state)
+                break
+
+    elif p_state['infectious']:
+        for contact_index in range(int((sim_state[s.CURRENT_DAILY_CONTACTS] * p_state['activity level']) / 2)):
+            contact = everyone[streams.randrange(person.id, crn.CONTACT, contact_index, everyone_ct)]
+            contact_state = contact.state
+            if contact_state['can be infected'] and \
+                    streams.uniform(person.id, crn.TRANSMISSION, contact_index) < transmission_probability:
+                advance_health_state(sim_state, contact, contact_state)
@@ -0,0 +1,127 @@
+"""
+Common random numbers for comparing scenarios. With the random module every draw depends on all of
+the draws before it, so as soon as two scenarios differ (a lock down on a different day) every
+draw after that is different, and the difference between the curves of the scenarios is mostly
+sampling noise. The streams here are counter based - a draw is the hash of the seed, the person,
+the day, the purpose of the draw (a contact, a transmission, a transition, ...), and a counter -
+so the same person on the same day gets the same draw for the same purpose in every scenario that
+is run with the same seed, whatever else is different, and the difference between paired runs is
+mostly the difference between the scenarios.
+
+The hash is splitmix64. A draw costs more than random.random(), so the streams are only used by a
+simulation that is given them (see simulate.create_initial_state()).
+"""
+import math
+import statistics
+import numpy as np
+
+# the purposes of the draws
+INITIAL_INFECTION = 1
+CONTACT = 2
+TRANSMISSION = 3
+TRANSITION = 4
+STATE_LENGTH = 5
+TESTING = 6
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+_GOLDEN = 0x9E3779B97F4A7C15
+_NORMAL = statistics.NormalDist()
+
+
+def _mix(z):
+    # the splitmix64 finalizer
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+def uniform(seed, key, day, purpose, counter=0):
+    """
+    A uniform draw from the streams.
+
+    :param seed: (int, required) The seed of the streams.
+    :param key: (int, required) The key of the draw, i.e. the person id.
+    :param day: (int, required) The day of the simulation.
+    :param purpose: (int, required) The purpose of the draw, i.e. CONTACT.
+    :param counter: (int, optional, default=0) The counter, for draws of the same purpose by the
+    same person on the same day (i.e. the contacts of the day).
+    :return: (float) The draw, in [0, 1).
+    """
+    z = _mix((seed + _GOLDEN) & _MASK)
+    z = _mix((z ^ key) + _GOLDEN & _MASK)
+    z = _mix((z ^ day) + _GOLDEN & _MASK)
+    z = _mix((z ^ ((purpose << 32) | counter)) + _GOLDEN & _MASK)
+    return (z >> 11) * (1.0 / 9007199254740992.0)
+
+
+def uniforms(seed, keys, day, purpose, counter=0):
+    """
+    Uniform draws from the streams for many keys at once, the same draws as uniform().
+
+    :param seed: (int, required) The seed of the streams.
+    :param keys: (numpy.ndarray of int, required) The keys of the draws, i.e. the person ids.
+    :param day: (int, required) The day of the simulation.
+    :param purpose: (int, required) The purpose of the draws.
+    :param counter: (int, optional, default=0) The counter.
+    :return: (numpy.ndarray of float) The draws, in [0, 1).
+    """
+    with np.errstate(over='ignore'):
+        golden = np.uint64(_GOLDEN)
+        z = np.full(len(keys), _mix((seed + _GOLDEN) & _MASK), dtype=np.uint64)
+        for value in (np.asarray(keys).astype(np.uint64), np.uint64(day), np.uint64((purpose << 32) | counter)):
+            z = (z ^ value) + golden
+            z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(float) * (1.0 / 9007199254740992.0)
+
+
+class RandomStreams:
+    """
+    The common random number streams of a simulation. The simulation sets the day as it runs.
+    """
+
+    def __init__(self, seed):
+        """
+        :param seed: (int, required) The seed, the runs of scenarios with the same seed are paired.
+        """
+        self.seed = seed & _MASK
+        self.day = 0
+
+    def uniform(self, key, purpose, counter=0):
+        """
+        A uniform draw for today.
+
+        :param key: (int, required) The key of the draw, i.e. the person id.
+        :param purpose: (int, required) The purpose of the draw.
+        :param counter: (int, optional, default=0) The counter.
+        :return: (float) The draw, in [0, 1).
+        """
+        return uniform(self.seed, key, self.day, purpose, counter)
+
+    def randrange(self, key, purpose, counter, stop):
+        """
+        An integer draw for today.
+
+        :param key: (int, required) The key of the draw.
+        :param purpose: (int, required) The purpose of the draw.
+        :param counter: (int, required) The counter.
+        :param stop: (int, required) The draw is in [0, stop).
+        :return: (int) The draw.
+        """
+        return int(uniform(self.seed, key, self.day, purpose, counter) * stop)
+
+    def lognormal(self, key, purpose, counter, mean, sigma):
+        """
+        A lognormal draw for today, as numpy.random.lognormal(mean, sigma).
+
+        :param key: (int, required) The key of the draw.
+        :param purpose: (int, required) The purpose of the draw.
+        :param counter: (int, required) The counter.
+        :param mean: (float, required) The mean of the underlying normal distribution.
+        :param sigma: (float, required) The standard deviation of the underlying normal distribution.
+        :return: (float) The draw.
+        """
+        # the draw is never exactly 0.0 or 1.0 here
+        draw = (uniform(self.seed, key, self.day, purpose, counter) * 9007199254740990.0 + 1.0) / 9007199254740992.0
+        return math.exp(mean + sigma * _NORMAL.inv_cdf(draw))
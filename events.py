@@ -1,8 +1,16 @@
 import json
 import random
+import numpy as np
 import simulate as s
+import state_tables
 
 EVENTS = []
+EVENT_SCHEDULE = {}
+"""
+The day indexed schedule of the EVENTS - the key is the simulation day, the value is the
+list of indices (into EVENTS and COMPILED_EVENTS) of the events that happen on that day.
+"""
+COMPILED_EVENTS = []
 
 
 # day - the day of the simulation for the event
@@ -22,89 +30,397 @@ EVENTS = []
 # casual contacts - # of people casually contacted (brief passing conversation)
 
 def read_from_file(*file_names):
-    global EVENTS
     events = []
     for file_name in file_names:
         with open(file_name, "r") as data_file:
             events.append(json.load(data_file))
+    set_events(events)
+
+
+def set_events(events):
+    """
+    Set the events for the simulation and compile their schedule.
+
+    :param events: ([dict], required) The event descriptions.
+    :return: None
+    """
+    global EVENTS
     EVENTS = events
+    compile_schedule()
+
+
+def compile_schedule():
+    """
+    Compile the EVENTS into the day indexed EVENT_SCHEDULE. Everything about an event that
+    does not change from day to day (the days it happens, and the multipliers applied to the
+    transmission probability for full duration and casual contacts) is computed here once, so
+    the daily evaluation only touches the events that actually happen on that day.
+
+    :return: None
+    """
+    global EVENT_SCHEDULE
+    global COMPILED_EVENTS
+    EVENT_SCHEDULE, COMPILED_EVENTS = schedule_events(EVENTS)
+
+
+def schedule_events(events):
+    """
+    Compile events into a day indexed schedule, see compile_schedule(). Nothing is kept in the
+    module, so simulations with different events can be compiled (and run) side by side.
+
+    :param events: ([dict], required) The event descriptions.
+    :return: ((dict, [dict])) The schedule (see EVENT_SCHEDULE), and the compiled events.
+    """
+    schedule = {}
+    compiled_events = []
+    for event_id, event in enumerate(events):
+        days = set()
+        if 'day' in event:
+            days.add(event['day'])
+        if 'start day' in event and 'end day' in event:
+            days.update(range(event['start day'], event['end day'] + 1))
+        for day in days:
+            schedule.setdefault(day, []).append(event_id)
+
+        # What is the probability of infection for the event?
+        # full duration contacts - use 3 x normal transmission possibility CURRENT_TRANSMISSION_PROBABILITY
+        #    * number of hours * .5 for masked * (1.5 if inside, 1.0 otherwise)
+        # casual contacts are at the CURRENT_TRANSMISSION_PROBABILITY
+        full_duration_factor = 3.0 * event['duration']
+        if event['masked']:
+            full_duration_factor *= 0.5
+        if event['site'] == 'inside':
+            full_duration_factor *= 1.5
+        casual_factor = 3.0
+        if event['site'] == 'inside':
+            casual_factor *= 1.5
+
+        compiled_events.append({
+            'event': event,
+            'last day': max(days) if days else -1,
+            'full duration factor': full_duration_factor,
+            'casual factor': casual_factor
+        })
+    return schedule, compiled_events
 
 
 def evaluate_events(sim_state, day):
-    for event in EVENTS:
-        if event.get('day', -1) == day or \
-                (event.get('start day', -1) <= day <= event.get('end day', -1)):
-            # OK, this event happens or starts today
-            print(f'{event["description"]} on day {day}')
-            # What is the probability of infection for the event?
-            # full duration contacts - use 3 x normal transmission possibility CURRENT_TRANSMISSION_PROBABILITY
-            #    * number of hours * .5 for masked * (1.5 if inside, 1.0 otherwise)
-            # casual contacts are at the CURRENT_TRANSMISSION_PROBABILITY
-            full_duration_probability = \
-                3.0 * (sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] if
-                       event['distanced'] else sim_state[s.NORMAL_TRANSMISSION_PROBABILITY]) * \
-                event['duration']
-            if event['masked']:
-                full_duration_probability *= 0.5
-            if event['site'] == 'inside':
-                full_duration_probability *= 1.5
-
-            casual_probability = 3.0 * (sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] if
-                                        event['distanced'] else sim_state[s.NORMAL_TRANSMISSION_PROBABILITY])
-            if event['site'] == 'inside':
-                casual_probability *= 1.5
-
-            # create the event population - take a random sample
-            event_people = event.get('people', None)
-            if event_people is None:
-                event_people = event['people'] = []
-                for _ in range(event['participants'] - event['visiting participants']):
-                    event_people.append(sim_state[s.PEOPLE][random.randint(0, sim_state[s.DAILY_POPULATION] - 1)])
-
-                for person_id in range(event['participants'] - event['visiting participants']):
-                    person = {'id': -(person_id + 1)}
-                    sim_state[s.SET_DEFAULT_HEALTH](person, False)
-                    if random.random() < event['infected visiting']:
-                        sim_state[s.SET_INFECTED](person)
-                        sim_state[s.DAILY_HEALTH_EVALUATION](sim_state, person)
-
-                    event_people.append(person)
-            else:
-                # the local population has already been updated, update the visiting population
-                for person in event_people:
-                    if person['local']:
-                        state = person['state']
-                        if state['name'] == 'dead' or state['hospitalize']:
-                            # this person is out of the pool, replace them
-                            event_people.remove(person)
-                            event_people.append(
-                                sim_state[s.PEOPLE][random.randint(0, sim_state[s.DAILY_POPULATION] - 1)])
-                    else:
-                        sim_state[s.DAILY_HEALTH_EVALUATION](sim_state, person)
-
-            phase_daily_contacts = sim_state[s.CURRENT_DAILY_CONTACTS]
-            phase_transmission_probability = sim_state[s.CURRENT_TRANSMISSION_PROBABILITY]
-            # now do the full duration contacts
-            sim_state[s.CURRENT_DAILY_CONTACTS] = event['full duration contacts']
-            sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] = full_duration_probability
-            for person in event_people:
-                # can this person infect, or be infected - if so, daily contacts
-                # must be traced to see if there is an infection event
-                sim_state[s.DAILY_EVALUATE_CONTACTS](sim_state, person, event_people)
-
-            # now do the casual contacts
-            sim_state[s.CURRENT_DAILY_CONTACTS] = event['casual contacts']
-            sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] = casual_probability
-            for person in event_people:
-                # can this person infect, or be infected - if so, daily contacts
-                # must be traced to see if there is an infection event
-                sim_state[s.DAILY_EVALUATE_CONTACTS](sim_state, person, event_people)
-
-            # and reset the phase parameters
-            sim_state[s.CURRENT_DAILY_CONTACTS] = phase_daily_contacts
-            sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] = phase_transmission_probability
-
-            if event.get('end day', -1) == day:
-                del event['people']
+    if sim_state[s.EVENT_SCHEDULE] is None:
+        # the schedule of the events of this simulation
+        sim_state[s.EVENT_SCHEDULE], sim_state[s.COMPILED_EVENTS] = schedule_events(sim_state[s.EVENTS])
+    pool = sim_state[s.VISITOR_POOL]
+    if pool is None:
+        pool = sim_state[s.VISITOR_POOL] = create_visitor_pool(sim_state[s.HEALTH_STATES])
+    else:
+        # the local population has already been updated, update the visiting population
+        advance_visitor_pool(pool)
+
+    for event_id in sim_state[s.EVENT_SCHEDULE].get(day, ()):
+        # OK, this event happens or starts today
+        compiled_event = sim_state[s.COMPILED_EVENTS][event_id]
+        event = compiled_event['event']
+        print(f'{event["description"]} on day {day}')
+        transmission_probability = sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] if \
+            event['distanced'] else sim_state[s.NORMAL_TRANSMISSION_PROBABILITY]
+        full_duration_probability = compiled_event['full duration factor'] * transmission_probability
+        casual_probability = compiled_event['casual factor'] * transmission_probability
+
+        # the event population - the local people come from the roster, which is sampled
+        # when the event starts and maintained for the days of a multi-day event (see leave_rosters())
+        roster = sim_state[s.EVENT_ROSTERS].get(event_id, None)
+        if roster is None:
+            roster = sim_state[s.EVENT_ROSTERS][event_id] = create_roster(
+                sim_state, event['participants'] - event['visiting participants'])
+            roster['visitors'] = draw_visitors(pool, event['visiting participants'], event['infected visiting'])
+        everyone = sim_state[s.EVERYONE]
+        event_people = [everyone[person_id] for person_id in roster['local']]
+        visitors = roster['visitors']
+
+        # now do the full duration and casual contacts in one pass over the event population,
+        # the local people followed by the visitors
+        event_states = [person.state for person in event_people]
+        visitor_states = pool['people']['state'][visitors]
+        table = pool['table']
+        infectious = np.concatenate((
+            np.fromiter((state['infectious'] for state in event_states), bool, len(event_states)),
+            table['infectious'][visitor_states]))
+        can_be_infected = np.concatenate((
+            np.fromiter((state['can be infected'] for state in event_states), bool, len(event_states)),
+            table['can be infected'][visitor_states]))
+        activity = np.concatenate((
+            np.fromiter((state.get('activity level', 0.0) for state in event_states), float, len(event_states)),
+            table['activity level'][visitor_states]))
+        infected = mix_event(infectious, can_be_infected, activity,
+                             [(event['full duration contacts'], full_duration_probability),
+                              (event['casual contacts'], casual_probability)])
+        local_ct = len(event_people)
+        for index in infected[infected < local_ct]:
+            sim_state[s.INFECT_PERSON](sim_state, event_people[index])
+        state_tables.transition(table, pool['people'], visitors[infected[infected >= local_ct] - local_ct])
+
+        if compiled_event['last day'] == day:
+            return_visitors(pool, roster['visitors'])
+            del sim_state[s.EVENT_ROSTERS][event_id]
 
     return
+
+
+def create_roster(sim_state, local_participants):
+    """
+    Create the roster for an event. The local participants are sampled, without replacement, from
+    PEOPLE (the local people who are not in the hospital), and are kept as an array of person ids
+    (indices into EVERYONE) along with the position of each id in the array for constant time
+    membership tests and replacements. There are never more local participants than PEOPLE.
+
+    When more than half of PEOPLE are at the event the roster also keeps the people who are not
+    (see _outside_roster()), so that someone who is not at the event is drawn in constant time
+    however full the event is.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param local_participants: (int, required) The number of local people at the event.
+    :return: (dict) The roster, with the 'local' person ids, the 'positions' of those ids in
+    'local', the people 'outside' of the event (None when most of PEOPLE are not at the event),
+    and the 'visitors' slots in the visitor pool (none until they are drawn).
+    """
+    people = sim_state[s.PEOPLE]
+    count = min(local_participants, len(people))
+    outside = None
+    if 2 * count > len(people):
+        # most of the people are at the event, a permutation is cheaper than throwing out repeats
+        # and the rest of it is the people who are not at the event
+        person_ids = np.fromiter((people[index].id for index in np.random.permutation(len(people))),
+                                 int, len(people))
+        local = person_ids[:count]
+        outside_ids = person_ids[count:].tolist()
+        outside = {'ids': outside_ids, 'positions': {person_id: index for index, person_id in enumerate(outside_ids)}}
+    else:
+        # Draw all of the people we still need in bulk, then throw out the repeats. With at least
+        # half of the people not at the event this takes a few draws.
+        local = np.empty(count, dtype=int)
+        drawn = set()
+        filled = 0
+        while filled < count:
+            for index in np.random.randint(0, len(people), count - filled):
+                person_id = people[index].id
+                if person_id not in drawn:
+                    drawn.add(person_id)
+                    local[filled] = person_id
+                    filled += 1
+    return {
+        'local': local,
+        'positions': {int(person_id): index for index, person_id in enumerate(local)},
+        'outside': outside,
+        'visitors': np.empty(0, dtype=int)
+    }
+
+
+def _outside_roster(people, positions):
+    """
+    The people of PEOPLE who are not at an event, as a list of person ids with the position of each
+    id in the list, so one of them is drawn, taken out (the last id is moved into its place), or
+    added in constant time.
+
+    :param people: ([person.Person], required) PEOPLE.
+    :param positions: (dict, required) The positions of the local participants of the roster.
+    :return: (dict) The 'ids' and their 'positions'.
+    """
+    outside_ids = [person.id for person in people if person.id not in positions]
+    return {'ids': outside_ids, 'positions': {person_id: index for index, person_id in enumerate(outside_ids)}}
+
+
+def _take_outside(outside, person_id):
+    # take a person out of the people who are not at an event
+    index = outside['positions'].pop(person_id)
+    last_id = outside['ids'].pop()
+    if last_id != person_id:
+        outside['ids'][index] = last_id
+        outside['positions'][last_id] = index
+
+
+def leave_rosters(sim_state, person):
+    """
+    A local person has left PEOPLE (gone into the hospital or died), replace them in the rosters of
+    the events they are at with someone who is in PEOPLE and not at the event, or if everyone in
+    PEOPLE is already at the event drop them and the roster gets smaller. This is called when the
+    person leaves, so a roster is never looked through.
+
+    While at least half of PEOPLE are not at the event the replacement is drawn from PEOPLE, and a
+    draw of someone who is at the event is thrown out, which takes at most 2 draws on average. Once
+    half or more of PEOPLE are at the event (as PEOPLE gets smaller) the people who are not at the
+    event are found, once, and kept with the roster (see _outside_roster()), and the replacement is
+    drawn from them.
+
+    :param sim_state: (dict, required) The simulation state, the person is no longer in PEOPLE.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    people = sim_state[s.PEOPLE]
+    for roster in sim_state[s.EVENT_ROSTERS].values():
+        positions = roster['positions']
+        outside = roster['outside']
+        index = positions.pop(person.id, None)
+        if index is None:
+            if outside is not None:
+                _take_outside(outside, person.id)
+            continue
+        local = roster['local']
+        if outside is None and 2 * len(positions) >= len(people):
+            outside = roster['outside'] = _outside_roster(people, positions)
+        if outside is None:
+            while True:
+                replacement_id = people[random.randint(0, len(people) - 1)].id
+                if replacement_id not in positions:
+                    break
+        elif outside['ids']:
+            replacement_id = outside['ids'][random.randint(0, len(outside['ids']) - 1)]
+            _take_outside(outside, replacement_id)
+        else:
+            # everyone in PEOPLE is at the event
+            last = len(local) - 1
+            if index != last:
+                local[index] = local[last]
+                positions[int(local[index])] = index
+            roster['local'] = local[:last]
+            continue
+        local[index] = replacement_id
+        positions[replacement_id] = index
+
+
+def join_rosters(sim_state, person):
+    """
+    A local person has come back to PEOPLE (from the hospital), they are not at any of the events
+    that are going on, so they are one of the people who could replace someone at them.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    for roster in sim_state[s.EVENT_ROSTERS].values():
+        outside = roster['outside']
+        if outside is not None:
+            outside['positions'][person.id] = len(outside['ids'])
+            outside['ids'].append(person.id)
+
+
+def create_visitor_pool(health_states, capacity=1024):
+    """
+    Create the pool of visitors that is shared by all of the events in a simulation. Visitors are
+    kept in arrays (see state_tables) rather than as person dictionaries. Events draw the slots
+    for their visitors from the pool when they start and return them when they end, so the pool
+    only grows to the largest number of visitors at events on the same day.
+
+    :param health_states: (dict, required) The health states of the simulation.
+    :param capacity: (int, optional, default=1024) The initial number of slots in the pool.
+    :return: (dict) The visitor pool.
+    """
+    table = state_tables.compile_health_states(health_states)
+    return {
+        'table': table,
+        'people': state_tables.create_people(table, capacity),
+        'drawn': np.zeros(capacity, dtype=bool),
+        'free': list(range(capacity - 1, -1, -1))
+    }
+
+
+def draw_visitors(pool, count, infected_fraction):
+    """
+    Draw visitors from the pool, growing the pool if there are not enough free slots.
+
+    :param pool: (dict, required) The visitor pool.
+    :param count: (int, required) The number of visitors.
+    :param infected_fraction: (float, required) The fraction of the visitors who are infected.
+    :return: (numpy.ndarray of int) The pool slots of the visitors.
+    """
+    free = pool['free']
+    if len(free) < count:
+        people = pool['people']
+        capacity = len(pool['drawn'])
+        new_capacity = max(2 * capacity, capacity + count - len(free))
+        grown = state_tables.create_people(pool['table'], new_capacity)
+        for key, values in people.items():
+            grown[key][:capacity] = values
+        pool['people'] = grown
+        pool['drawn'] = np.concatenate((pool['drawn'], np.zeros(new_capacity - capacity, dtype=bool)))
+        free[:0] = range(new_capacity - 1, capacity - 1, -1)
+    slots = np.array(free[len(free) - count:], dtype=int)
+    del free[len(free) - count:]
+    pool['drawn'][slots] = True
+
+    table = pool['table']
+    people = pool['people']
+    state_tables.set_default(table, people, slots)
+    infected = slots[np.random.random(count) < infected_fraction]
+    state_tables.set_infected(table, people, infected)
+    state_tables.advance_day(table, people, infected)
+    return slots
+
+
+def return_visitors(pool, slots):
+    """
+    Return the visitors of an event that has ended to the pool.
+
+    :param pool: (dict, required) The visitor pool.
+    :param slots: (numpy.ndarray of int, required) The pool slots of the visitors.
+    :return: None
+    """
+    pool['drawn'][slots] = False
+    pool['free'].extend(slots.tolist())
+
+
+def advance_visitor_pool(pool):
+    """
+    Advance the health of every visitor who is at an event by a day, in one vectorized step.
+
+    :param pool: (dict, required) The visitor pool.
+    :return: None
+    """
+    state_tables.advance_day(pool['table'], pool['people'], np.flatnonzero(pool['drawn']))
+
+
+def mix_event(infectious, can_be_infected, activity, tiers):
+    """
+    The event mixing kernel. Computes who is infected at an event for all of the contact tiers
+    (i.e. full duration and casual contacts) in one vectorized pass over the event population.
+    This is the same mixing as the simulation daily contacts: every person makes
+    int(contacts x activity level / 2) random contacts in the event population, a person
+    who can be infected is infected by a contact with an infectious person with the tier
+    transmission probability, and an infectious person infects the people they contact who
+    can be infected with the tier transmission probability. Nothing in the simulation state
+    is read or changed, so events on the same day can be mixed independently.
+
+    :param infectious: (numpy.ndarray of bool, required) True for the people in the event
+    population who are infectious.
+    :param can_be_infected: (numpy.ndarray of bool, required) True for the people in the event
+    population who can be infected.
+    :param activity: (numpy.ndarray of float, required) The activity level of the people in
+    the event population.
+    :param tiers: ([(int, float),...], required) The (contacts, transmission probability) for
+    each tier of contacts at the event.
+    :return: (numpy.ndarray of int) The indices, in the event population, of the people who
+    were infected at the event.
+    """
+    population_ct = len(infectious)
+    susceptible = np.flatnonzero(can_be_infected)
+    infectors = np.flatnonzero(infectious)
+    if population_ct == 0 or len(susceptible) == 0 or len(infectors) == 0:
+        return np.empty(0, dtype=int)
+    infectious_fraction = len(infectors) / population_ct
+    susceptible_fraction = len(susceptible) / population_ct
+
+    escape = np.ones(len(susceptible))
+    infecting_contacts = 0
+    for contacts, probability in tiers:
+        probability = min(probability, 1.0)
+        # people who can be infected - the chance of escaping infection over all of their
+        # contacts in this tier.
+        escape *= np.power(1.0 - infectious_fraction * probability,
+                           (contacts * activity[susceptible] / 2).astype(int))
+        # infectious people - the number of their contacts in this tier that are infections.
+        infecting_contacts += np.random.binomial(
+            (contacts * activity[infectors] / 2).astype(int),
+            susceptible_fraction * probability).sum()
+
+    infected = susceptible[np.random.random(len(susceptible)) >= escape]
+    if infecting_contacts > 0:
+        infected = np.union1d(infected, susceptible[np.random.randint(0, len(susceptible), infecting_contacts)])
+    return infected
@@ -1,41 +1,35 @@
 import argparse
 import json
-import random
+import os
 import time
-import matplotlib.pyplot as plt
-import numpy as np
 import simulate as s
-import phases
-import covid_state as state
-import events
+import scenario
+import state_tables
+import array_population
+import network
+import ages
+import spatial
+import covid_state
+import replicates
 
 
-def run_simulation(args):
+def run_simulation(args, seed):
     # Setup the phases - there is a default no-phases implementation which
     # can be overridden by loading phases from a file
-    if args.phases is not None:
-        phases.read_from_file(args.phases)
     # Setup the events - there is a default no-events implementation and
     # events can be loaded by event files
-    if args.events is not None:
-        events.read_from_file(*[file_name.strip() for file_name in args.events.split(',')])
-    # Create the simulation state and initialize it to the initial state
-    sim_state = s.create_initial_state(
-        state.HEALTH_STATES, state.set_default_health_state,
-        state.set_initial_infected_state, state.evaluate_health_for_day,
-        state.evaluate_contacts, state.set_testing_for_phase,
-        phases.SIMULATION_PHASES, phases.daily_phase_evaluation,
-        events=events.EVENTS, daily_event_evaluation=events.evaluate_events,
+    # Create the simulation state, initialize it to the initial state, and run it (or read the
+    # result of the same run from the result cache)
+    start = time.time()
+    sim_state = scenario.run_scenario(
+        phases_config=None if args.phases is None else scenario.read_phases(args.phases),
+        event_list=None if args.events is None else
+        scenario.read_events([file_name.strip() for file_name in args.events.split(',')]),
         population=args.population, simulation_days=args.sim_days,
-        initial_infection=args.infection
+        initial_infection=args.infection, seed=seed, population_model=population_model,
+        health_states_file=args.states, common_random_numbers=args.crn_seed is not None,
+        hospital_beds=args.hospital_beds, icu_beds=args.icu_beds
     )
-    sim_state[s.CURRENT_CONTAGIOUS_DAYS] = state.get_mean_infectious_days()
-    phases.set_initial_phase(sim_state)
-    state.set_testing_for_phase(sim_state[s.CURRENT_TESTING_PROBABILITY])
-
-    # Everything is setup, get the start time for the simulation
-    start = time.time()
-    s.run_simulation(sim_state)
 
     # print the results of the simulation
     phase_desc = ''
@@ -46,7 +40,7 @@ def run_simulation(args):
     print(f'    Initial Infection:         {sim_state[s.INITIAL_INFECTION]:16,}')
     # print(f'    Days Contagious:           {HEALTH_STATES["contagious"]["days at state"]:16,}')
     print(f'    Phases:')
-    for key, value in phases.SIMULATION_PHASES.items():
+    for key, value in sim_state[s.PHASES].items():
         if 'start day' in value:
             print(f'      {key}:')
             print(f'        start day:               {value["start day"]:14,}')
@@ -77,6 +71,10 @@ def run_simulation(args):
     print(f'      On Day:                        {sim_state[s.MAX_ACTIVE_ICU]:16,}')
     print(f'      Number of ICU Beds:            '
           f'{sim_state[s.ACTIVE_ICU_CASES_SERIES][sim_state[s.MAX_ACTIVE_ICU]]:16,}')
+    if sim_state[s.HOSPITAL_BEDS] is not None or sim_state[s.ICU_BEDS] is not None:
+        print(f'    Maximum Waiting for Beds:')
+        print(f'      Hospital Beds:                 {max(sim_state[s.WAITING_FOR_HOSPITAL_SERIES]):16,}')
+        print(f'      ICU Beds:                      {max(sim_state[s.WAITING_FOR_ICU_SERIES]):16,}')
     print(f'  Cumulative:')
     print(
         f'    Cumulative Cases:                {sim_state[s.CUMULATIVE_CASES_SERIES][sim_state[s.SIMULATION_DAYS]]:16,}'
@@ -152,7 +150,63 @@ parser.add_argument(
 parser.add_argument(
     '-r', '--runs', dest='runs', type=int, default=0,
     help='The number of runs for the set, 1 seeded run is always included')
+parser.add_argument(
+    '-ci', '--ci-tolerance', dest='ci_tolerance', type=float, default=None,
+    help='Run random runs until the 95%% confidence interval of each of the --ci-outputs is within '
+         'this fraction of its mean (replaces --runs), i.e. 0.05 for 5%%.')
+parser.add_argument(
+    '--ci-outputs', dest='ci_outputs', type=str, default=','.join(replicates.DEFAULT_OUTPUTS),
+    help=f'The outputs for --ci-tolerance, comma separated, from: {", ".join(replicates.OUTPUTS.keys())}.')
+parser.add_argument(
+    '--max-runs', dest='max_runs', type=int, default=50,
+    help='The most random runs for --ci-tolerance.')
+parser.add_argument(
+    '--batch', dest='batch', type=int, default=None,
+    help='The random runs run in parallel for --ci-tolerance, default is the number of cores.')
+parser.add_argument(
+    '-n', '--network', dest='network', action='store_true',
+    help='Use a static household/school/workplace contact network rather than random daily contacts.')
+parser.add_argument(
+    '--network-file', dest='network_file', type=str, default=None,
+    help='The .npz file of the contact network, it is generated and written if it does not exist.')
+parser.add_argument(
+    '-a', '--ages', dest='ages', action='store_true',
+    help='Use an age-structured population, with age specific outcomes and mixing by an age contact '
+         'matrix (or the contact network with --network).')
+parser.add_argument(
+    '--grid', dest='grid', type=str, default=None,
+    help='Place the population on a grid of cells, "ROWSxCOLUMNS", with contacts mostly in the cell '
+         'and the neighboring cells.')
+parser.add_argument(
+    '--urban', dest='urban', type=float, default=0.0,
+    help='The fraction of the population in a town at the center of the --grid, the rest is uniform.')
+parser.add_argument(
+    '--density-exponent', dest='density_exponent', type=float, default=0.0,
+    help='Contacts are proportional to the population of the --grid cell to this power.')
+parser.add_argument(
+    '-crn', '--common-random-numbers', dest='crn_seed', type=int, default=None,
+    help='Draw the random numbers of the people from common random number streams with this seed '
+         '(the random runs use the following seeds), so the runs of different scenarios are paired.')
+parser.add_argument(
+    '-hb', '--hospital-beds', dest='hospital_beds', type=int, default=None,
+    help='The hospital beds outside of the ICU, people who need one when they are all occupied wait '
+         'for one, the default is a bed for everyone who needs one.')
+parser.add_argument(
+    '-ib', '--icu-beds', dest='icu_beds', type=int, default=None,
+    help='The ICU beds, the default is a bed for everyone who needs one.')
+parser.add_argument(
+    '-rc', '--result-cache', dest='result_cache', type=str, default=None,
+    help='The directory of the cache of the results of the seeded runs, "off" for no cache, the default '
+         'is the SIMULATION_RESULT_CACHE environment variable, or ./data/result_cache.')
 args = parser.parse_args()
+if (args.network or args.ages or args.grid) and (args.hospital_beds is not None or args.icu_beds is not None):
+    parser.error('--hospital-beds and --icu-beds are not supported with --network, --ages, or --grid')
+if (args.network or args.ages or args.grid) and args.crn_seed is not None:
+    parser.error('--common-random-numbers is not supported with --network, --ages, or --grid')
+if (args.network or args.ages or args.grid) and args.ci_tolerance is not None:
+    parser.error('--ci-tolerance runs are not supported with --network, --ages, or --grid')
+if args.network and args.grid:
+    parser.error('--network and --grid are different contact models, use one of them')
 
 print('---------------------------------------------------------')
 print('---    INFECTIOUS DISEASE SIMULATION CONFIGURATION    ---')
@@ -165,15 +219,60 @@ print(f'health states file:       {args.states}')
 print(f'output file(s) base:      {args.base}')
 print(f'events:                   {args.events}')
 print(f'display graphs:           {args.graphs}')
+if args.crn_seed is not None:
+    print(f'common random numbers:    seed {args.crn_seed}')
+if args.hospital_beds is not None or args.icu_beds is not None:
+    print(f'hospital beds, ICU beds:  {args.hospital_beds}, {args.icu_beds}')
+if args.result_cache is not None:
+    scenario.set_result_cache(None if args.result_cache.lower() == 'off' else args.result_cache)
+print(f'result cache:             '
+      f'{"off" if scenario.RESULT_CACHE is None else scenario.RESULT_CACHE.directory}')
 print(f'random runs:              {args.runs}')
+print(f'contact network:          {args.network_file if args.network and args.network_file else args.network}')
+print(f'age structured:           {args.ages}')
+print(f'spatial grid:             {args.grid}' + ('' if args.grid is None else f', {args.urban} urban'))
+if args.ci_tolerance is not None:
+    print(f'random runs CI tolerance: {args.ci_tolerance} of {args.ci_outputs}, at most {args.max_runs}')
 print('---------------------------------------------------------')
 
+# The health states of the disease, and their compiled array transition tables
+health_states_table = None if args.states is None else covid_state.load_health_states(args.states)
+
+# The contact network, the grid, and the ages are generated once and used for every run
+population_model = None
+if args.network or args.ages or args.grid:
+    if args.grid is not None:
+        grid_rows, grid_columns = (int(size) for size in args.grid.lower().split('x'))
+        infections = spatial.create_infections(
+            spatial.create_grid(args.population, spatial.urban_density((grid_rows, grid_columns), args.urban),
+                                seed=42),
+            density_exponent=args.density_exponent)
+    elif not args.network:
+        infections = ages.create_infections()
+    elif args.network_file is not None and os.path.exists(args.network_file):
+        infections = network.create_infections(network.read_network(args.network_file))
+    else:
+        contact_network = network.generate_network(args.population, seed=42)
+        if args.network_file is not None:
+            network.write_network(contact_network, args.network_file)
+        infections = network.create_infections(contact_network)
+    if args.ages:
+        population_model = array_population.create_model(
+            state_tables.compile_health_states(ages.add_age_branches(covid_state.HEALTH_STATES),
+                                               age_groups=ages.AGE_GROUPS),
+            args.population, infections,
+            # not the seed of the grid or network, so age does not depend on where people are
+            age_groups=ages.assign_age_groups(args.population, seed=43))
+    else:
+        population_model = array_population.create_model(
+            state_tables.compile_health_states(covid_state.HEALTH_STATES) if health_states_table is None
+            else health_states_table, args.population, infections)
+
 # The seeded run
-random.seed(42)
 print('-------------------------------------------------------------------------------')
 print('---   Seeded Run                                                            ---')
 print('-------------------------------------------------------------------------------')
-sim, sub_title = run_simulation(args)
+sim, sub_title = run_simulation(args, 42 if args.crn_seed is None else args.crn_seed)
 if args.base is not None:
     s.write_data(sim, f'{args.base}.json')
 if args.graphs:
@@ -181,11 +280,35 @@ if args.graphs:
 
 # random runs
 
-if args.runs > 0 and args.base is not None:
+def write_run(run_id, data):
+    with open(f'{args.base}_{run_id}.json', "w") as fw:
+        json.dump(data, fw, indent=2)
+
+
+if args.ci_tolerance is not None and args.base is not None:
+    print('-------------------------------------------------------------------------------')
+    print('---   Random Runs to Confidence Interval Tolerance                          ---')
+    print('-------------------------------------------------------------------------------')
+    start = time.time()
+    run_set = replicates.run_replicates(
+        phases_config=None if args.phases is None else scenario.read_phases(args.phases),
+        event_list=None if args.events is None else
+        scenario.read_events([file_name.strip() for file_name in args.events.split(',')]),
+        population=args.population, simulation_days=args.sim_days, initial_infection=args.infection,
+        outputs=[output.strip() for output in args.ci_outputs.split(',')], tolerance=args.ci_tolerance,
+        max_runs=args.max_runs, batch=args.batch,
+        seed=int(time.time()) if args.crn_seed is None else args.crn_seed, run_complete=write_run,
+        health_states_file=args.states, common_random_numbers=args.crn_seed is not None,
+        hospital_beds=args.hospital_beds, icu_beds=args.icu_beds)
+    print(f'{run_set["runs"]} random runs, '
+          f'{"converged" if run_set["converged"] else "did not converge"} in {time.time() - start:.4f}sec')
+    for output, (mean, half_width) in run_set['intervals'].items():
+        print(f'  {output:24s}{mean:16,.2f} +/- {half_width:,.2f}')
+elif args.runs > 0 and args.base is not None:
     for run_id in range(args.runs):
         print('-------------------------------------------------------------------------------')
         print(f'---   Random Run {run_id:2d}                                                         ---')
         print('-------------------------------------------------------------------------------')
-        random.seed(int(time.time()))
-        sim, sub_title = run_simulation(args)
+        run_seed = int(time.time()) if args.crn_seed is None else args.crn_seed + 1 + run_id
+        sim, sub_title = run_simulation(args, run_seed)
         s.write_data(sim, f'{args.base}_{run_id}.json')
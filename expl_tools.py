@@ -1,6 +1,6 @@
 import json
+import os
 import numpy as np
-import matplotlib.pyplot as plt
 import simulate as s
 
 
@@ -23,14 +23,18 @@ def read_run_set(data_directory, base_file, set_size=10):
     :param data_directory: (str, required) The data directory (include the trailing'/'
     :param base_file: (str, required) The base name for the file with no extension.
     :param set_size: (int, optional, default=10) The number of random runs in the set
-    in addition to the seeded run.
+    in addition to the seeded run, None to read all the random runs there are (the
+    size of a run set run to a confidence interval tolerance varies).
     :return: (dict) a dictionary containing the set of runs where the key is the label
     for the run, and the value is the data from the run.
     """
     run_set = {'seeded': read_data_file(f'{data_directory}{base_file}.json')}
-    for run in range(set_size):
+    run = 0
+    while (set_size is None and os.path.exists(f'{data_directory}{base_file}_{run}.json')) or \
+            (set_size is not None and run < set_size):
         run_set[f'run {run}'] = read_data_file(
             f'{data_directory}{base_file}_{run}.json')
+        run += 1
     return run_set
 
 
@@ -46,6 +50,7 @@ def plot_curves(curves, title,
     :param ylabel: (str, optional, default='count') The Y axis label.
     :return: None
     """
+    import matplotlib.pyplot as plt
     plt.clf()
     plt.title(title)
     plt.xlabel(xlabel)
@@ -94,6 +99,7 @@ def plot_run_set_series(run_set, series, title_template, events=None,
     #     tic_spacing - generally, 2 weeks (14 days) is good - but -
     #     if the simulation length gets too long we need to adjust that
     #     to a wider/narrower interval so the presentation makes sense
+    import matplotlib.pyplot as plt
     plt.clf()
     plt.title(title_template.format(series.title()))
     plt.xlabel(xlabel)
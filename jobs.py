@@ -0,0 +1,309 @@
+"""
+An asyncio job manager for batches of scenario runs. Scenarios (the requests of server.py) are
+queued by priority and dispatched to a process pool, and the progress of each run - the day and
+the new values of the main series - is streamed back as the run goes rather than when it ends:
+
+    manager = jobs.JobManager(workers=4)
+    job = await manager.submit({'phases': phases_config, 'population': 100000, 'seed': 1}, priority=1)
+    async for progress in job.progress():
+        print(progress['day'], progress['series'][s.ACTIVE_CASES_SERIES])
+    data = await job.result()
+    ...
+    await manager.close()
+
+There are never more runs in flight than workers, and never more workers than cores. When the
+queue holds max_pending jobs, submit() waits for room, so a burst of submissions is held back
+rather than piling up. A job is cancelled with job.cancel() - a queued job is never run, and a
+running job is stopped at the end of its current day by its daily hook.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import simulate as s
+import scenario
+import server
+
+# the series that are streamed with the progress of a run
+PROGRESS_SERIES = (
+    s.NEW_CASES_SERIES, s.ACTIVE_CASES_SERIES, s.ACTIVE_HOSPITALIZED_CASES_SERIES, s.ACTIVE_ICU_CASES_SERIES,
+    s.CUMULATIVE_CASES_SERIES, s.CUMULATIVE_CONFIRMED_CASES_SERIES, s.CUMULATIVE_DEATHS_SERIES
+)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+def _run_job(job_id, scenario_request, messages, cancelled, progress_interval):
+    # Run a job in a worker process, sending the progress to the manager every progress_interval
+    # days, and stopping the run at the end of the day the job is cancelled. The last message of a
+    # job is (job_id, None, None), so the manager knows it has all of the progress.
+    reported = [0]
+
+    def report_progress(sim_state, day):
+        stop = job_id in cancelled
+        if stop or day - reported[0] >= progress_interval or day == sim_state[s.SIMULATION_DAYS]:
+            messages.put((job_id, day, {key: list(sim_state[key][reported[0] + 1:day + 1])
+                                        for key in PROGRESS_SERIES}))
+            reported[0] = day
+        return stop
+
+    try:
+        return server.run_request(scenario_request, report_progress)
+    finally:
+        messages.put((job_id, None, None))
+
+
+class Job:
+    """
+    A scenario run in a JobManager.
+    """
+
+    def __init__(self, job_id, scenario_request, priority, manager):
+        self.id = job_id
+        self.request = scenario_request
+        self.priority = priority
+        self.state = QUEUED
+        self.day = 0
+        # the streamed series, they grow as the run progresses
+        self.series = {key: [] for key in PROGRESS_SERIES}
+        self._manager = manager
+        self._progress = asyncio.Queue()
+        self._streamed = asyncio.Event()
+        self._result = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        """
+        Cancel the job, a queued job is never run and a running job is stopped at the end of the day.
+
+        :return: None
+        """
+        if self.state in (QUEUED, RUNNING):
+            self._manager.cancel(self)
+
+    def done(self):
+        """
+        :return: (bool) True if the job is done, cancelled, or failed.
+        """
+        return self._result.done()
+
+    async def progress(self):
+        """
+        The progress of the run as it goes, an async iterator that ends when the job ends. There
+        is one stream of progress for a job.
+
+        :return: (async iterator of dict) The 'day', and the new values of each of the PROGRESS_SERIES
+        since the last progress, keyed by series name, in 'series'.
+        """
+        while True:
+            progress = await self._progress.get()
+            if progress is None:
+                return
+            yield progress
+
+    async def result(self):
+        """
+        Wait for the data of the run.
+
+        :return: (dict) The data of the run, see simulate.simulation_data(). For a cancelled job
+        the series end at the day it was stopped, None if it was cancelled before it started.
+        """
+        return await asyncio.shield(self._result)
+
+    def _add_progress(self, day, series):
+        self.day = day
+        for key, values in series.items():
+            self.series[key].extend(values)
+        self._progress.put_nowait({'day': day, 'series': series})
+
+    def _finish(self, state, data=None, error=None):
+        self.state = state
+        if error is not None:
+            self._result.set_exception(error)
+        else:
+            self._result.set_result(data)
+        self._progress.put_nowait(None)
+
+
+class JobManager:
+    """
+    Queue scenario runs by priority and run them on a process pool.
+    """
+
+    def __init__(self, workers=None, max_pending=None, progress_interval=1, health_states_file=None):
+        """
+        Create the manager, it must be created in a running event loop.
+
+        :param workers: (int, optional, default=None) The worker processes, at most the number of
+        cores, None for the number of cores.
+        :param max_pending: (int, optional, default=None) The most jobs that can wait in the queue,
+        None for 4 x the workers.
+        :param progress_interval: (int, optional, default=1) The days between the progress of a run.
+        :param health_states_file: (str, optional, default=None) The JSON health states file, None for
+        the built in health states.
+        """
+        cores = os.cpu_count() or 1
+        self.workers = cores if workers is None else max(1, min(workers, cores))
+        self.progress_interval = progress_interval
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue(4 * self.workers if max_pending is None else max_pending)
+        self._order = itertools.count()
+        self._jobs = {}
+        self._sync = multiprocessing.Manager()
+        self._messages = self._sync.Queue()
+        self._cancelled = self._sync.dict()
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=server.initialize_worker, initargs=(health_states_file,))
+        self._forwarder = threading.Thread(target=self._forward_messages, daemon=True)
+        self._forwarder.start()
+        self._dispatchers = [self._loop.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def submit(self, request, priority=0):
+        """
+        Queue a scenario run, waiting for room in the queue if it is full.
+
+        :param request: (dict, required) The scenario request, see server.parse_request().
+        :param priority: (int, optional, default=0) The priority, higher priorities are run first,
+        and jobs of the same priority in the order they were submitted.
+        :return: (Job) The job.
+        """
+        scenario_request = server.parse_request(request)
+        order = next(self._order)
+        job = self._jobs[order] = Job(order, scenario_request, priority, self)
+        await self._queue.put((-priority, order))
+        return job
+
+    def cancel(self, job):
+        """
+        Cancel a job, see Job.cancel().
+
+        :param job: (Job, required) The job.
+        :return: None
+        """
+        if job.state == QUEUED:
+            # it is dropped when it comes to the front of the queue
+            self._jobs.pop(job.id, None)
+            job._finish(CANCELLED)
+        elif job.state == RUNNING:
+            self._cancelled[job.id] = True
+
+    async def close(self):
+        """
+        Cancel the jobs that are queued or running and shut down the workers.
+
+        :return: None
+        """
+        running = [job for job in self._jobs.values() if job.state == RUNNING]
+        for job in list(self._jobs.values()):
+            job.cancel()
+        # the running jobs stop at the end of their current day
+        await asyncio.gather(*(job.result() for job in running), return_exceptions=True)
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        await self._loop.run_in_executor(None, self._executor.shutdown)
+        self._messages.put(None)
+        await self._loop.run_in_executor(None, self._forwarder.join)
+        self._sync.shutdown()
+
+    async def _dispatch(self):
+        # a dispatcher runs one job at a time, there is a dispatcher for each worker
+        while True:
+            _, order = await self._queue.get()
+            job = self._jobs.get(order)
+            if job is None:
+                continue
+            job.state = RUNNING
+            try:
+                data = await self._loop.run_in_executor(
+                    self._executor, _run_job, job.id, job.request, self._messages, self._cancelled,
+                    self.progress_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                job._finish(FAILED, error=error)
+            else:
+                # the last of the progress can still be on its way from the worker
+                await job._streamed.wait()
+                job._finish(CANCELLED if job.id in self._cancelled else DONE, data)
+            finally:
+                self._jobs.pop(order, None)
+                self._cancelled.pop(order, None)
+
+    def _forward_messages(self):
+        # Move the progress from the workers to the jobs, in a thread because reading the queue
+        # blocks. The progress of a job that is finished is dropped.
+        while True:
+            message = self._messages.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._deliver, *message)
+
+    def _deliver(self, job_id, day, series):
+        job = self._jobs.get(job_id)
+        if job is None or job.done():
+            return
+        if day is None:
+            job._streamed.set()
+        else:
+            job._add_progress(day, series)
+
+
+async def _run_batch(requests, workers, progress_interval, health_states_file):
+    # Run a batch of scenarios, printing the progress of every run as a JSON line.
+    manager = JobManager(workers, progress_interval=progress_interval, health_states_file=health_states_file)
+
+    async def follow(job):
+        async for progress in job.progress():
+            print(json.dumps({'job': job.id, 'day': progress['day'],
+                              'active cases': job.series[s.ACTIVE_CASES_SERIES][-1],
+                              'cumulative cases': job.series[s.CUMULATIVE_CASES_SERIES][-1]}), flush=True)
+        data = await job.result()
+        print(json.dumps({'job': job.id, 'state': job.state,
+                          'cumulative cases': data[s.CUMULATIVE_CASES_SERIES][-1] if data else None}), flush=True)
+
+    followers = []
+    for request in requests:
+        followers.append(asyncio.create_task(follow(await manager.submit(request))))
+    await asyncio.gather(*followers)
+    await manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a batch of seeded runs of a scenario, streaming the progress of each run as JSON lines.')
+    parser.add_argument(
+        '-ph', '--phases', dest='phases', type=str, default=None,
+        help='The JSON file containing the phases data for the simulation.')
+    parser.add_argument(
+        '-p', '--population', dest='population', type=int, default=s.DEFAULT_POPULATION,
+        help='The population.')
+    parser.add_argument(
+        '-d', '--days', dest='sim_days', type=int, default=s.DEFAULT_SIMULATION_DAYS,
+        help='The number of days to simulate.')
+    parser.add_argument(
+        '-r', '--runs', dest='runs', type=int, default=4,
+        help='The number of runs, seeded 1 to runs.')
+    parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='The number of worker processes, the default is the number of cores.')
+    parser.add_argument(
+        '-i', '--interval', dest='interval', type=int, default=10,
+        help='The days between the progress lines of a run.')
+    parser.add_argument(
+        '-st', '--states', dest='states', type=str, default='./data/default_states.json',
+        help='The JSON file containing the health states data for the disease.')
+    args = parser.parse_args()
+
+    phases_config = None if args.phases is None else scenario.read_phases(args.phases)
+    asyncio.run(_run_batch(
+        [{'phases': phases_config, 'population': args.population, 'days': args.sim_days, 'seed': seed}
+         for seed in range(1, args.runs + 1)],
+        args.workers, args.interval, args.states))
@@ -0,0 +1,229 @@
+"""
+A static contact network for the array population model (see array_population.py). Rather than
+drawing new random contacts every day (the well-mixed assumption of covid_state.evaluate_contacts),
+people have the same contacts every day - the people in their household, at their school or
+workplace, and a few in the community. The network is generated once and kept as compressed sparse
+row (CSR) arrays: the contacts of person i are indices[indptr[i]:indptr[i + 1]], and the layer of
+each of those edges is in layer[indptr[i]:indptr[i + 1]]. Every edge is in the arrays in both
+directions. A person can be connected to another in more than one layer (i.e. family members who
+work together), these are separate edges.
+
+Transmission is evaluated over the edges from infectious people to people who can be infected, with
+one random draw per edge, so the cost of a day is in the number of edges of the infectious people.
+
+Generate a network for a population and use it as the contact model of an array population model:
+
+    contact_network = network.generate_network(population)
+    model = array_population.create_model(table, population, network.create_infections(contact_network))
+"""
+import numpy as np
+import simulate as s
+
+# The layers of the network:
+#   'size' - the mean number of people in a setting (a household, a school, ...), None if the
+#       layer is one setting (the community)
+#   'fraction' - the fraction of the population in the layer. The people in layers with a fraction
+#       less than 1.0 are drawn from one shuffled population in turn, so they are in only one of
+#       those layers (a person either goes to school or goes to work).
+#   'contacts' - the mean number of contacts a person has in a setting, None if a person has
+#       contact with everyone in the setting
+#   'daily probability' - the probability that an edge is a contact on any day
+#   'distanced' - is the layer reduced with the daily contacts of a phase (see layer_probabilities())
+DEFAULT_LAYERS = {
+    'household': {'size': 2.5, 'fraction': 1.0, 'contacts': None, 'daily probability': 1.0, 'distanced': False},
+    'school': {'size': 250.0, 'fraction': 0.2, 'contacts': 20.0, 'daily probability': 5.0 / 7.0, 'distanced': True},
+    'workplace': {'size': 20.0, 'fraction': 0.5, 'contacts': 16.0, 'daily probability': 5.0 / 7.0, 'distanced': True},
+    'community': {'size': None, 'fraction': 1.0, 'contacts': 12.0, 'daily probability': 1.0, 'distanced': True}
+}
+
+
+def _partition(members, mean_size, rng):
+    """
+    Split people into settings with sizes 1 + Poisson(mean size - 1).
+
+    :return: ((numpy.ndarray of int,) * 2) The start of each setting in members, and its size.
+    """
+    if mean_size is None:
+        return np.zeros(1, dtype=np.int64), np.array([len(members)])
+    sizes = 1 + rng.poisson(mean_size - 1.0, int(len(members) / mean_size * 1.2) + 10)
+    while sizes.sum() < len(members):
+        sizes = np.concatenate((sizes, 1 + rng.poisson(mean_size - 1.0, len(sizes))))
+    ends = np.cumsum(sizes)
+    count = np.searchsorted(ends, len(members)) + 1
+    sizes = sizes[:count]
+    sizes[-1] -= ends[count - 1] - len(members)
+    return np.concatenate(([0], ends[:count - 1])), sizes
+
+
+def _clique_edges(members, starts, sizes):
+    # everyone in a setting is connected to everyone else in it - settings of the same size are
+    # done together as the rows of a 2D array
+    sources = []
+    targets = []
+    for size in np.unique(sizes[sizes > 1]):
+        block = members[starts[sizes == size][:, None] + np.arange(size)]
+        first, second = np.triu_indices(size, 1)
+        sources.append(block[:, first].ravel())
+        targets.append(block[:, second].ravel())
+    if len(sources) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def _random_edges(members, starts, sizes, contacts, rng):
+    # every person starts Poisson(contacts / 2) edges to random people in their setting, and the
+    # same number on average are started to them, so the mean number of contacts is contacts
+    setting = np.repeat(np.arange(len(sizes)), sizes)
+    position = np.repeat(np.arange(len(members)), rng.poisson(contacts / 2.0, len(members)))
+    partner_setting = setting[position]
+    partner = starts[partner_setting] + (rng.random(len(position)) * sizes[partner_setting]).astype(np.int64)
+    keep = partner != position
+    return members[position[keep]], members[partner[keep]]
+
+
+def generate_network(population, layers=None, seed=None):
+    """
+    Generate a contact network.
+
+    :param population: (int, required) The number of people.
+    :param layers: (dict, optional, default=None) The layer descriptions keyed by layer name, see
+    DEFAULT_LAYERS, None for DEFAULT_LAYERS.
+    :param seed: (int, optional, default=None) The seed for generating the network.
+    :return: (dict) The network - the CSR arrays 'indptr', 'indices', and 'layer', the 'layer names',
+    and the layer 'daily probability' and 'distanced' arrays.
+    """
+    if layers is None:
+        layers = DEFAULT_LAYERS
+    rng = np.random.default_rng(seed)
+    exclusive = rng.permutation(population)
+    exclusive_used = 0
+    sources = []
+    targets = []
+    edge_layers = []
+    for layer_id, layer in enumerate(layers.values()):
+        if layer['fraction'] >= 1.0:
+            members = rng.permutation(population)
+        else:
+            count = min(int(population * layer['fraction']), population - exclusive_used)
+            members = exclusive[exclusive_used:exclusive_used + count]
+            exclusive_used += count
+        starts, sizes = _partition(members, layer['size'], rng)
+        if layer['contacts'] is None:
+            layer_sources, layer_targets = _clique_edges(members, starts, sizes)
+        else:
+            layer_sources, layer_targets = _random_edges(members, starts, sizes, layer['contacts'], rng)
+        sources.append(layer_sources)
+        targets.append(layer_targets)
+        edge_layers.append(np.full(len(layer_sources), layer_id, dtype=np.uint8))
+
+    # both directions of every edge, sorted by the source into CSR form
+    all_sources = np.concatenate(sources + targets)
+    all_targets = np.concatenate(targets + sources)
+    all_layers = np.concatenate(edge_layers + edge_layers)
+    del sources, targets, edge_layers
+    order = np.argsort(all_sources, kind='stable')
+    indptr = np.zeros(population + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_sources, minlength=population), out=indptr[1:])
+    index_type = np.int32 if population < 2 ** 31 else np.int64
+    return {
+        'indptr': indptr,
+        'indices': all_targets[order].astype(index_type),
+        'layer': all_layers[order],
+        'layer names': list(layers.keys()),
+        'daily probability': np.array([layer['daily probability'] for layer in layers.values()]),
+        'distanced': np.array([layer['distanced'] for layer in layers.values()])
+    }
+
+
+def write_network(network, file_name):
+    """
+    Save a network to a .npz file, so the same network can be used for many simulations.
+
+    :param network: (dict, required) The network.
+    :param file_name: (str, required) The file name.
+    :return: None
+    """
+    np.savez(file_name, indptr=network['indptr'], indices=network['indices'], layer=network['layer'],
+             layer_names=np.array(network['layer names']), daily_probability=network['daily probability'],
+             distanced=network['distanced'])
+
+
+def read_network(file_name):
+    """
+    Read a network saved by write_network().
+
+    :param file_name: (str, required) The file name.
+    :return: (dict) The network.
+    """
+    with np.load(file_name) as data:
+        return {
+            'indptr': data['indptr'],
+            'indices': data['indices'],
+            'layer': data['layer'],
+            'layer names': data['layer_names'].tolist(),
+            'daily probability': data['daily_probability'],
+            'distanced': data['distanced']
+        }
+
+
+def edges_of(indptr, nodes):
+    """
+    The edges of some nodes.
+
+    :param indptr: (numpy.ndarray of int, required) The CSR row pointers.
+    :param nodes: (numpy.ndarray of int, required) The nodes.
+    :return: ((numpy.ndarray of int,) * 2) The index of each edge in the CSR arrays, and the node
+    it is an edge of.
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) > 0 else 0), \
+        np.repeat(nodes, counts)
+
+
+def layer_probabilities(sim_state, network):
+    """
+    The probability that an edge of each layer is a contact today. A phase can set 'layer weights'
+    (i.e. {"school": 0.0} for closed schools) that multiply the daily probability of the layers,
+    otherwise the distanced layers are reduced by the ratio of the daily contacts of the phase to
+    the normal daily contacts.
+
+    :param sim_state: (dict, required) The simulation state.
+    :param network: (dict, required) The network.
+    :return: (numpy.ndarray of float) The probability for each layer.
+    """
+    weights = sim_state[s.CURRENT_PHASE].get('layer weights')
+    if weights is not None:
+        return network['daily probability'] * \
+            np.array([weights.get(name, 1.0) for name in network['layer names']])
+    normal_contacts = sim_state[s.NORMAL_DAILY_CONTACTS]
+    distancing = 1.0 if not normal_contacts else min(sim_state[s.CURRENT_DAILY_CONTACTS] / normal_contacts, 1.0)
+    return network['daily probability'] * np.where(network['distanced'], distancing, 1.0)
+
+
+def create_infections(network):
+    """
+    Create the contact model of a network for array_population.create_model().
+
+    :param network: (dict, required) The network.
+    :return: (function) The contact model.
+    """
+    def infections(sim_state, model):
+        table = model['table']
+        state = model['people']['state']
+        # people in the hospital make no contacts
+        infectious = np.flatnonzero(table['infectious'][state])
+        infectious = infectious[~table['hospitalize'][state[infectious]]]
+        edges, sources = edges_of(network['indptr'], infectious)
+        targets = network['indices'][edges]
+        susceptible = table['can be infected'][state[targets]]
+        edges = edges[susceptible]
+        sources = sources[susceptible]
+        targets = targets[susceptible]
+        probability = sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] * \
+            layer_probabilities(sim_state, network)[network['layer'][edges]] * \
+            table['activity level'][state[sources]] * table['activity level'][state[targets]]
+        return np.unique(targets[np.random.random(len(targets)) < probability])
+
+    return infections
@@ -2,13 +2,24 @@
 This is a program that reads a .csv file that is a compilation of data from the Oregon Health Authority found
 in the COVID-19 Daily Update reports and COVID-19 Weekly Reports. The fist ste of columns are from the daily
 reports, and the second set of columns is from the Weekly Reports.
+
+The columns are parsed into typed tables (pandas DataFrames of floats indexed by date), one for
+the daily updates and one for the weekly reports. The parsed tables are cached in a binary
+columnar (.npz) file next to the .csv file, keyed on the hash of the .csv file, so programs that
+load the observed data many times (like calibration) only pay the parsing cost once.
 """
 import csv
+import datetime
+import hashlib
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
 
+OREGON_CSV = './data/oregon/oregon.csv'
+# The 2019 population estimate for Oregon, to scale the observed data to a simulated population
+OREGON_POPULATION = 4217737
 HEADER_ROWS = 4
+# some dates have the full month name, some have the abbreviation
+DATE_FORMATS = ('%a %B %d %Y', '%a %b %d %Y')
 
 # Column IDs
 DATE = 0
@@ -22,8 +33,8 @@ WEEKLY_PERCENT_POSITIVE = PERCENT_POSITIVE + 1
 NEW_CASES = WEEKLY_PERCENT_POSITIVE + 1
 WEEKLY_NEW_CASES = NEW_CASES + 1
 CURRENTLY_HOSPITALIZED = WEEKLY_NEW_CASES + 1
-CUMULATIVE_DEATHS = CURRENTLY_HOSPITALIZED + 1
-NEW_DEATHS = CUMULATIVE_DEATHS + 1
+DAILY_CUMULATIVE_DEATHS = CURRENTLY_HOSPITALIZED + 1
+NEW_DEATHS = DAILY_CUMULATIVE_DEATHS + 1
 WEEKLY_DEATHS = NEW_DEATHS + 1
 CUMULATIVE_TESTS = WEEKLY_DEATHS + 1
 
@@ -106,122 +117,245 @@ UNK_ETHNICITY_CASES = NON_HISPANIC_HOSP + 1
 UNK_ETHNICITY_DEATHS = UNK_ETHNICITY_CASES + 1
 UNK_ETHNICITY_HOSP = UNK_ETHNICITY_DEATHS + 1
 
-def append_to_data_set(row, labels, indices, data_set, weekly_ct, what, by_what):
-    total_count = 0
-    for i in range(len(labels)):
-        count = int(row[indices[i]])
-        data_set[i].append(count)
-        total_count += count
-    if weekly_ct != total_count:
-        print(f'expected {what} by {by_what} to sum to {weekly_ct}, summed to {total_count}')
-
-
-def strip_graph_data_set(labels, data_set, title):
-    plt.clf()
-    plt.title(title)
-    plt.xlabel('week')
-    plt.ylabel('percentage')
-    # Make data
-    data = pd.DataFrame({labels[i]: data_set[i] for i in range(len(labels))},
-                        index=range(1, len(data_set[0]) + 1))
-    # We need to transform the data from raw data to percentage (fraction)
-    as_percent = data.divide(data.sum(axis=1), axis=0)
-    # Make the plot
-    plt.stackplot(range(1, len(data_set[0]) + 1), *[as_percent[label] for label in labels], labels=labels)
-    plt.legend(loc='upper left')
-    plt.margins(0, 0)
-    plt.show()
-    plt.pause(0.1)
-
-
-weekly_cases = []
-weekly_hosp = []
-weekly_deaths = []
-
 # The weekly summary  reported by age
 age_labels = ['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+', 'unknown']
 CASES_BY_AGE_INDS = [AGE_0_19_CASES, AGE_20_29_CASES, AGE_30_39_CASES, AGE_40_49_CASES, AGE_50_59_CASES,
                      AGE_60_69_CASES, AGE_70_79_CASES, AGE_80_PLUS_CASES, AGE_NOT_AVAIL_CASES]
-cases_by_age = [[] for _ in age_labels]
-
 HOSP_BY_AGE_INDS = [AGE_0_19_HOSP, AGE_20_29_HOSP, AGE_30_39_HOSP, AGE_40_49_HOSP, AGE_50_59_HOSP,
                     AGE_60_69_HOSP, AGE_70_79_HOSP, AGE_80_PLUS_HOSP, AGE_NOT_AVAIL_HOSP]
-hosp_by_age = [[] for _ in age_labels]
-
 DEATHS_BY_AGE_INDS = [AGE_0_19_DEATHS, AGE_20_29_DEATHS, AGE_30_39_DEATHS, AGE_40_49_DEATHS, AGE_50_59_DEATHS,
                       AGE_60_69_DEATHS, AGE_70_79_DEATHS, AGE_80_PLUS_DEATHS, AGE_NOT_AVAIL_DEATHS]
-deaths_by_age = [[] for _ in age_labels]
 
 # weekly summary reported by race
 race_labels = ['white', 'black', 'asian', 'native', 'islander', 'other', '>1 race', 'unknown']
 CASES_BY_RACE_INDS = [WHITE_CASES, BLACK_CASES, ASIAN_CASES, NATIVE_CASES,
                       ISLAND_CASES, OTHER_CASES, GT1_RACE_CASES, RACE_NOT_AVAIL_CASES]
-cases_by_race = [[] for _ in race_labels]
-
 HOSP_BY_RACE_INDS = [WHITE_HOSP, BLACK_HOSP, ASIAN_HOSP, NATIVE_HOSP,
                      ISLAND_HOSP, OTHER_HOSP, GT1_RACE_HOSP, RACE_NOT_AVAIL_HOSP]
-hosp_by_race = [[] for _ in race_labels]
-
 DEATHS_BY_RACE_INDS = [WHITE_DEATHS, BLACK_DEATHS, ASIAN_DEATHS, NATIVE_DEATHS,
                        ISLAND_DEATHS, OTHER_DEATHS, GT1_RACE_DEATHS, RACE_NOT_AVAIL_DEATHS]
-deaths_by_race = [[] for _ in race_labels]
 
 # weekly summary reported by ethnicity
-ethnicity_labels = ['hispanic','non-hispanic', 'unknown']
+ethnicity_labels = ['hispanic', 'non-hispanic', 'unknown']
 CASES_BY_ETHNICITY_INDS = [HISPANIC_CASES, NON_HISPANIC_CASES, UNK_ETHNICITY_CASES]
-cases_by_ethnicity = [[] for _ in ethnicity_labels]
-
 HOSP_BY_ETHNICITY_INDS = [HISPANIC_HOSP, NON_HISPANIC_HOSP, UNK_ETHNICITY_HOSP]
-hosp_by_ethnicity = [[] for _ in ethnicity_labels]
-
 DEATHS_BY_ETHNICITY_INDS = [HISPANIC_DEATHS, NON_HISPANIC_DEATHS, UNK_ETHNICITY_DEATHS]
-deaths_by_ethnicity = [[] for _ in ethnicity_labels]
-
-with open('./data/oregon/oregon.csv', 'r') as csv_file:
-    reader = csv.reader(csv_file)
-    row_index = 0
-    for row in reader:
-        row_index += 1
-        if row_index <= HEADER_ROWS:
-            # skip the header rows
-            continue
-
-        if row[CUMULATIVE_CASES] != '':
-            # This is a weekly report row - accumulate weekly data for plotting.
-            this_weeks_cases = int(row[CUMULATIVE_CASES])
-            print(f'{row[DATE]} {this_weeks_cases}')
-            weekly_cases.append(this_weeks_cases)
-            append_to_data_set(row, age_labels, CASES_BY_AGE_INDS, cases_by_age, this_weeks_cases,
-                               'cases', 'age')
-            append_to_data_set(row, race_labels, CASES_BY_RACE_INDS, cases_by_race, this_weeks_cases,
-                               'cases', 'race')
-            append_to_data_set(row, ethnicity_labels, CASES_BY_ETHNICITY_INDS, cases_by_ethnicity,
-                               this_weeks_cases, 'cases', 'ethnicity')
-
-            if row[AGE_0_19_DEATHS] != '':
-                this_weeks_hosp = int(row[CUMULATIVE_HOSPITALIZATION])
-                this_weeks_death = int(row[CUMULATIVE_DEATHS])
-                append_to_data_set(row, age_labels, HOSP_BY_AGE_INDS, hosp_by_age, this_weeks_hosp,
-                                   'hospitalizations', 'age')
-                append_to_data_set(row, age_labels, DEATHS_BY_AGE_INDS, deaths_by_age, this_weeks_death,
-                                   'deaths', 'age')
-                append_to_data_set(row, race_labels, HOSP_BY_RACE_INDS, hosp_by_race, this_weeks_hosp,
-                                   'hospitalizations', 'race')
-                append_to_data_set(row, race_labels, DEATHS_BY_RACE_INDS, deaths_by_race, this_weeks_death,
-                                   'deaths', 'race')
-                append_to_data_set(row, ethnicity_labels, HOSP_BY_ETHNICITY_INDS, hosp_by_ethnicity,
-                                   this_weeks_hosp, 'hospitalizations', 'ethnicity')
-                append_to_data_set(row, ethnicity_labels, DEATHS_BY_ETHNICITY_INDS, deaths_by_ethnicity,
-                                   this_weeks_death, 'deaths', 'ethnicity')
-
-strip_graph_data_set(age_labels, cases_by_age, 'Cases by Age')
-strip_graph_data_set(age_labels, hosp_by_age, 'Hospitalizations by Age')
-strip_graph_data_set(age_labels, deaths_by_age, 'Deaths by Age')
-
-strip_graph_data_set(race_labels, cases_by_race, 'Cases by Race')
-strip_graph_data_set(race_labels, hosp_by_race, 'Hospitalizations by Race')
-strip_graph_data_set(race_labels, deaths_by_race, 'Deaths by Race')
-
-strip_graph_data_set(ethnicity_labels, cases_by_ethnicity, 'Cases by Ethnicity')
-strip_graph_data_set(ethnicity_labels, hosp_by_ethnicity, 'Hospitalizations by Ethnicity')
-strip_graph_data_set(ethnicity_labels, deaths_by_ethnicity, 'Deaths by Ethnicity')
+
+# The names of the columns in the tables, and the .csv column they come from
+DAILY_UPDATE_COLUMNS = {
+    'tests': TESTS,
+    'weekly tests': WEEKLY_TESTS,
+    'positive': POSITIVE,
+    'percent positive': PERCENT_POSITIVE,
+    'weekly percent positive': WEEKLY_PERCENT_POSITIVE,
+    'new cases': NEW_CASES,
+    'weekly new cases': WEEKLY_NEW_CASES,
+    'hospitalized': CURRENTLY_HOSPITALIZED,
+    'cumulative deaths': DAILY_CUMULATIVE_DEATHS,
+    'new deaths': NEW_DEATHS,
+    'weekly deaths': WEEKLY_DEATHS,
+    'cumulative tests': CUMULATIVE_TESTS
+}
+WEEKLY_REPORT_COLUMNS = {
+    'cumulative cases': CUMULATIVE_CASES,
+    'cumulative deaths': CUMULATIVE_DEATHS,
+    'cumulative hospitalized': CUMULATIVE_HOSPITALIZATION
+}
+for _labels, _by_what, _indices in [
+        (age_labels, 'age', [CASES_BY_AGE_INDS, HOSP_BY_AGE_INDS, DEATHS_BY_AGE_INDS]),
+        (race_labels, 'race', [CASES_BY_RACE_INDS, HOSP_BY_RACE_INDS, DEATHS_BY_RACE_INDS]),
+        (ethnicity_labels, 'ethnicity', [CASES_BY_ETHNICITY_INDS, HOSP_BY_ETHNICITY_INDS, DEATHS_BY_ETHNICITY_INDS])]:
+    for _what, _what_indices in zip(['cases', 'hospitalizations', 'deaths'], _indices):
+        for _label, _index in zip(_labels, _what_indices):
+            WEEKLY_REPORT_COLUMNS[f'{_what} {_by_what} {_label}'] = _index
+
+# The tables that have already been loaded in this process, keyed by file hash
+_TABLES = {}
+
+
+def _file_hash(file_name):
+    with open(file_name, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
+
+
+def _cache_file_name(file_name, file_hash):
+    directory, base_name = os.path.split(file_name)
+    return os.path.join(directory, f'.{os.path.splitext(base_name)[0]}.{file_hash[:16]}.npz')
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.datetime.strptime(value.strip(), date_format).date())
+        except ValueError:
+            pass
+    raise ValueError(f'unrecognized date: "{value}"')
+
+
+def _parse_value(value):
+    value = value.strip().replace(',', '')
+    if value in ('', 'NA', 'N/A'):
+        return np.nan
+    if value.endswith('%'):
+        return float(value[:-1]) / 100.0
+    return float(value)
+
+
+def _parse_csv(file_name):
+    """
+    Parse the .csv file into the columns of the daily update and weekly report tables.
+
+    :param file_name: (str, required) The .csv file name.
+    :return: (dict) The dates and the columns of the two tables as numpy arrays.
+    """
+    dates = []
+    rows = []
+    with open(file_name, 'r') as csv_file:
+        reader = csv.reader(csv_file)
+        for row_index, row in enumerate(reader):
+            if row_index < HEADER_ROWS:
+                # skip the header rows
+                continue
+            dates.append(_parse_date(row[DATE]))
+            rows.append(row)
+
+    def column(index, row_selection):
+        return np.array([_parse_value(rows[i][index]) for i in row_selection], dtype=float)
+
+    all_rows = range(len(rows))
+    # weekly reports are the rows that have the weekly cumulative cases
+    weekly_rows = [i for i in all_rows if rows[i][CUMULATIVE_CASES] != '']
+    columns = {
+        'daily date': np.array(dates, dtype='datetime64[D]'),
+        'weekly date': np.array([dates[i] for i in weekly_rows], dtype='datetime64[D]')
+    }
+    for name, index in DAILY_UPDATE_COLUMNS.items():
+        columns[f'daily {name}'] = column(index, all_rows)
+    for name, index in WEEKLY_REPORT_COLUMNS.items():
+        columns[f'weekly {name}'] = column(index, weekly_rows)
+    return columns
+
+
+def _load_columns(file_name):
+    """
+    Load the columns of the tables, from the cache file if it exists, otherwise parse the .csv
+    file and write the cache file. The columns are kept for the rest of the process and shared by
+    every caller, so the arrays are read only.
+
+    :param file_name: (str, required) The .csv file name.
+    :return: (dict) The dates and the columns of the two tables as read only numpy arrays.
+    """
+    file_hash = _file_hash(file_name)
+    columns = _TABLES.get(file_hash, None)
+    if columns is not None:
+        return columns
+    cache_file_name = _cache_file_name(file_name, file_hash)
+    if os.path.exists(cache_file_name):
+        with np.load(cache_file_name) as cached:
+            names = cached['names']
+            columns = {str(name): cached[f'column_{i}'] for i, name in enumerate(names)}
+    else:
+        columns = _parse_csv(file_name)
+        # written to a temporary file and renamed, so a worker never reads a partly written cache
+        temporary_file_name = f'{cache_file_name}.{os.getpid()}'
+        with open(temporary_file_name, 'wb') as cache_file:
+            np.savez(cache_file, names=np.array(list(columns.keys())),
+                     **{f'column_{i}': values for i, values in enumerate(columns.values())})
+        os.replace(temporary_file_name, cache_file_name)
+    # every caller gets the same arrays, so they can not be changed
+    for values in columns.values():
+        values.flags.writeable = False
+    _TABLES[file_hash] = columns
+    return columns
+
+
+def _table(columns, prefix, names):
+    import pandas as pd
+    return pd.DataFrame({name: columns[f'{prefix} {name}'] for name in names},
+                        index=pd.DatetimeIndex(columns[f'{prefix} date'], name='date'))
+
+
+def read_daily_updates(file_name=OREGON_CSV):
+    """
+    Read the COVID-19 Daily Update columns.
+
+    :param file_name: (str, optional, default=OREGON_CSV) The .csv file name.
+    :return: (pandas.DataFrame) The daily updates indexed by date, the columns are the keys of
+    DAILY_UPDATE_COLUMNS, missing values are NaN and percentages are fractions.
+    """
+    return _table(_load_columns(file_name), 'daily', DAILY_UPDATE_COLUMNS.keys())
+
+
+def read_weekly_reports(file_name=OREGON_CSV):
+    """
+    Read the COVID-19 Weekly Report columns for the dates that have a weekly report.
+
+    :param file_name: (str, optional, default=OREGON_CSV) The .csv file name.
+    :return: (pandas.DataFrame) The weekly reports indexed by date, the columns are the keys of
+    WEEKLY_REPORT_COLUMNS, missing values are NaN.
+    """
+    return _table(_load_columns(file_name), 'weekly', WEEKLY_REPORT_COLUMNS.keys())
+
+
+def check_sums(weekly, what, by_what, labels, total_column):
+    """
+    Check that a breakdown of the weekly reports sums to the total reported for the week.
+
+    :param weekly: (pandas.DataFrame, required) The weekly reports.
+    :param what: (str, required) 'cases', 'hospitalizations', or 'deaths'.
+    :param by_what: (str, required) 'age', 'race', or 'ethnicity'.
+    :param labels: ([str], required) The labels of the breakdown.
+    :param total_column: (str, required) The weekly reports column with the total.
+    :return: None
+    """
+    breakdown = weekly[[f'{what} {by_what} {label}' for label in labels]]
+    reported = breakdown.notna().all(axis=1)
+    totals = breakdown[reported].sum(axis=1)
+    for date in totals.index[totals != weekly.loc[reported, total_column]]:
+        print(f'{date:%a %B %d %Y}: expected {what} by {by_what} to sum to '
+              f'{weekly.at[date, total_column]:.0f}, summed to {totals[date]:.0f}')
+
+
+def strip_graph_data_set(weekly, what, by_what, labels, title):
+    import matplotlib.pyplot as plt
+    plt.clf()
+    plt.title(title)
+    plt.xlabel('week')
+    plt.ylabel('percentage')
+    # Make data
+    data = weekly[[f'{what} {by_what} {label}' for label in labels]].dropna()
+    data.columns = labels
+    data.index = range(1, len(data) + 1)
+    # We need to transform the data from raw data to percentage (fraction)
+    as_percent = data.divide(data.sum(axis=1), axis=0)
+    # Make the plot
+    plt.stackplot(data.index, *[as_percent[label] for label in labels], labels=labels)
+    plt.legend(loc='upper left')
+    plt.margins(0, 0)
+    plt.show()
+    plt.pause(0.1)
+
+
+if __name__ == '__main__':
+    weekly_reports = read_weekly_reports()
+    for report_date, this_weeks_cases in weekly_reports['cumulative cases'].items():
+        print(f'{report_date:%a %B %d %Y} {this_weeks_cases:.0f}')
+    for check_what, check_total in [('cases', 'cumulative cases'),
+                                    ('hospitalizations', 'cumulative hospitalized'),
+                                    ('deaths', 'cumulative deaths')]:
+        check_sums(weekly_reports, check_what, 'age', age_labels, check_total)
+        check_sums(weekly_reports, check_what, 'race', race_labels, check_total)
+        check_sums(weekly_reports, check_what, 'ethnicity', ethnicity_labels, check_total)
+
+    strip_graph_data_set(weekly_reports, 'cases', 'age', age_labels, 'Cases by Age')
+    strip_graph_data_set(weekly_reports, 'hospitalizations', 'age', age_labels, 'Hospitalizations by Age')
+    strip_graph_data_set(weekly_reports, 'deaths', 'age', age_labels, 'Deaths by Age')
+
+    strip_graph_data_set(weekly_reports, 'cases', 'race', race_labels, 'Cases by Race')
+    strip_graph_data_set(weekly_reports, 'hospitalizations', 'race', race_labels, 'Hospitalizations by Race')
+    strip_graph_data_set(weekly_reports, 'deaths', 'race', race_labels, 'Deaths by Race')
+
+    strip_graph_data_set(weekly_reports, 'cases', 'ethnicity', ethnicity_labels, 'Cases by Ethnicity')
+    strip_graph_data_set(weekly_reports, 'hospitalizations', 'ethnicity', ethnicity_labels,
+                         'Hospitalizations by Ethnicity')
+    strip_graph_data_set(weekly_reports, 'deaths', 'ethnicity', ethnicity_labels, 'Deaths by Ethnicity')
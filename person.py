@@ -0,0 +1,134 @@
+"""
+A compact record for a person of the population of the simulation (see simulate.create_people()).
+A person dictionary takes a few hundred bytes, a Person has a fixed set of slots and keeps the
+health state as an integer state id, so it takes a fraction of that and the attributes are faster
+to get and set than dictionary items.
+
+The health state functions (see covid_state.py) use the attributes. Code that was written for
+person dictionaries still works through the dictionary compatibility of a Person - person['state'],
+person['days at state'], and the rest of the keys of a person dictionary are the attributes.
+"""
+
+# The health states of the people, indexed by state id. A state gets an id the first time someone
+# is put in it. The ids are by state name, so when the health states are replaced a person in a
+# state of the new health states gets the id of the state of the same name.
+_STATES = []
+_STATE_IDS = {}
+
+# the keys of a person dictionary, and the attribute of a Person for each of them
+_ATTRIBUTES = {
+    'id': 'id',
+    'state': 'state',
+    'tested': 'tested',
+    'days at state': 'days_at_state',
+    'state length': 'state_length',
+    'local': 'local',
+    'bed': 'bed'
+}
+
+# the bed of a person who is in a health state that needs hospital care (see covid_state.py)
+NO_BED = 0
+WAITING_FOR_HOSPITAL_BED = 1
+WAITING_FOR_ICU_BED = 2
+HOSPITAL_BED = 3
+ICU_BED = 4
+
+
+def get_state_id(health_state):
+    """
+    The state id of a health state.
+
+    :param health_state: (dict, required) The health state.
+    :return: (int) The state id.
+    """
+    state_id = _STATE_IDS.get(health_state['name'])
+    if state_id is None:
+        state_id = _STATE_IDS[health_state['name']] = len(_STATES)
+        _STATES.append(health_state)
+    elif _STATES[state_id] is not health_state:
+        _STATES[state_id] = health_state
+    return state_id
+
+
+class Person:
+    """
+    A person of the population.
+    """
+    __slots__ = ('id', 'state_id', 'tested', 'days_at_state', 'state_length', 'local', 'bed', 'index')
+
+    def __init__(self, person_id, state_id=-1, tested=False, days_at_state=1, state_length=-1, local=True,
+                 bed=NO_BED, index=-1):
+        """
+        :param person_id: (int, required) The id of the person, the index in simulate.EVERYONE.
+        :param state_id: (int, optional, default=-1) The state id of the health state, see
+        get_state_id(), -1 for none yet.
+        :param tested: (bool, optional, default=False) Has the person tested positive.
+        :param days_at_state: (int, optional, default=1) The day of the health state the person is on.
+        :param state_length: (int, optional, default=-1) The days the person will be in the health
+        state, -1 for a state that does not progress.
+        :param local: (bool, optional, default=True) Is the person in the local population.
+        :param bed: (int, optional, default=NO_BED) The bed the person is in, or is waiting for.
+        :param index: (int, optional, default=-1) The index of the person in simulate.PEOPLE, -1 when
+        the person is not in it (see simulate.remove_from_people()).
+        """
+        self.id = person_id
+        self.state_id = state_id
+        self.tested = tested
+        self.days_at_state = days_at_state
+        self.state_length = state_length
+        self.local = local
+        self.bed = bed
+        self.index = index
+
+    @property
+    def state(self):
+        """
+        The health state of the person.
+        """
+        return _STATES[self.state_id]
+
+    @state.setter
+    def state(self, health_state):
+        self.state_id = get_state_id(health_state)
+
+    def clone(self, person_id):
+        """
+        A copy of this person with another id, i.e. a person of a population created from a template.
+        The copy is at the index of its id in simulate.PEOPLE, as everyone is when a population is created.
+
+        :param person_id: (int, required) The id of the copy.
+        :return: (Person) The copy.
+        """
+        return Person(person_id, self.state_id, self.tested, self.days_at_state, self.state_length, self.local,
+                      self.bed, person_id)
+
+    def __reduce__(self):
+        # pickled (and deep copied) as the arguments of a new person, which is much smaller than
+        # the slots by name
+        return Person, (self.id, self.state_id, self.tested, self.days_at_state, self.state_length, self.local,
+                        self.bed, self.index)
+
+    # the dictionary compatibility
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, _ATTRIBUTES[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, _ATTRIBUTES[key], value)
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in _ATTRIBUTES
+
+    def get(self, key, default=None):
+        return getattr(self, _ATTRIBUTES[key]) if key in _ATTRIBUTES else default
+
+    def __repr__(self):
+        return f'Person(id={self.id}, state={self.state["name"] if self.state_id >= 0 else None}, ' \
+               f'days at state={self.days_at_state}, state length={self.state_length}, ' \
+               f'tested={self.tested}, local={self.local}, bed={self.bed})'
@@ -7,6 +7,7 @@ Phases are described in a dictionary where the key is the name of the phase, and
 the value is a dictionary describing the values for the phase and the conditions
 for moving to the next phase.
 """
+import copy
 import json
 import simulate as s
 
@@ -24,6 +25,14 @@ people behave normally, and the disease runs its course.
 """
 
 
+PHASE_TRANSITIONS = {}
+"""
+The compiled transitions out of each phase, keyed by phase name. The value is a list of
+(condition function, next phase name) in the order they are evaluated. These are built by
+compile_transitions() when the phases are read.
+"""
+
+
 def read_from_file(file_name):
     """
     Read the phases data from a file. The default if no phase data is read is
@@ -34,11 +43,220 @@ def read_from_file(file_name):
     :return: None
     """
     with open(file_name, "r") as data_file:
-        global SIMULATION_PHASES
-        global INITIAL_PHASE
-        phases_config = json.load(data_file)
-        SIMULATION_PHASES = phases_config['phases']
-        INITIAL_PHASE = phases_config['initial phase']
+        set_phases(json.load(data_file))
+
+
+def set_phases(phases_config):
+    """
+    Set the phases from a phases description (the contents of a phases file). The phases
+    are copied because the simulation records the 'Ro' and 'start day' in the phases.
+
+    :param phases_config: (dict, required) The phases description, with the 'phases' and
+    the 'initial phase'.
+    :return: None
+    """
+    global SIMULATION_PHASES
+    global INITIAL_PHASE
+    SIMULATION_PHASES = copy.deepcopy(phases_config['phases'])
+    INITIAL_PHASE = phases_config['initial phase']
+    compile_transitions()
+
+
+def compile_phases(phases_config=None):
+    """
+    Compile a phases description for one simulation. Each simulation needs its own copy of the
+    phases because the simulation records the 'Ro' and 'start day' in the phases, so a simulation
+    that keeps its phases in the simulation state (see set_simulation_phases()) does not share
+    anything with the module phases or with any other simulation.
+
+    :param phases_config: (dict, optional, default=None) The phases description, with the 'phases'
+    and the 'initial phase', None for the module phases.
+    :return: (dict) The 'phases', the 'initial phase', and the compiled 'transitions'.
+    """
+    if phases_config is None:
+        phases_config = {'phases': SIMULATION_PHASES, 'initial phase': INITIAL_PHASE}
+    simulation_phases = copy.deepcopy(phases_config['phases'])
+    return {
+        'phases': simulation_phases,
+        'initial phase': phases_config['initial phase'],
+        'transitions': _compile_transitions(simulation_phases)
+    }
+
+
+def set_simulation_phases(sim, compiled_phases):
+    """
+    Use compiled phases (see compile_phases()) for a simulation rather than the module phases.
+
+    :param sim: (dict, required) The simulation state.
+    :param compiled_phases: (dict, required) The compiled phases.
+    :return: None
+    """
+    sim[s.PHASES] = compiled_phases['phases']
+    sim[s.PHASE_TRANSITIONS] = compiled_phases['transitions']
+    sim[s.INITIAL_PHASE] = compiled_phases['initial phase']
+
+
+def compile_transitions():
+    """
+    Compile the transitions out of every phase in SIMULATION_PHASES. The phases are a graph, a
+    phase may have a list of 'transitions', each with a 'next phase', a 'condition', and an
+    optional 'priority'. The transitions are evaluated every day in priority order (lowest
+    first, then in the order they are listed) and the first one whose condition is met is
+    taken. A phase with a 'next phase' and a 'condition' has a single transition. The
+    conditions are compiled into functions of the simulation state and day, so the daily
+    evaluation does not need to interpret the condition description every day.
+
+    :return: None
+    """
+    global PHASE_TRANSITIONS
+    PHASE_TRANSITIONS = _compile_transitions(SIMULATION_PHASES)
+
+
+def _compile_transitions(simulation_phases):
+    """
+    Compile the transitions out of every phase, see compile_transitions().
+
+    :param simulation_phases: (dict, required) The phases, keyed by phase name.
+    :return: (dict) The transitions out of each phase, see PHASE_TRANSITIONS.
+    """
+    phase_transitions = {}
+    for key, phase in simulation_phases.items():
+        transitions = list(phase.get('transitions', []))
+        if 'next phase' in phase and 'condition' in phase:
+            transitions.append({'next phase': phase['next phase'], 'condition': phase['condition']})
+        compiled_transitions = []
+        for transition in sorted(transitions, key=lambda transition: transition.get('priority', 0)):
+            if transition['next phase'] not in simulation_phases:
+                raise ValueError(f'phase "{key}" has a transition to an unknown phase: '
+                                 f'"{transition["next phase"]}"')
+            compiled_transitions.append((compile_condition(transition['condition']), transition['next phase']))
+        if len(compiled_transitions) > 0:
+            phase_transitions[key] = compiled_transitions
+    return phase_transitions
+
+
+def compile_condition(condition):
+    """
+    Compile a condition description into a function. The condition types are:
+    - 'cumulative cases exceeds', 'cumulative confirmed cases exceeds' - 'count'
+    - 'days after max active', 'days after confirmed max active', 'days in phase' - 'days'
+    - 'average new cases exceeds', 'average new cases below',
+      'average new confirmed cases exceeds', 'average new confirmed cases below' - 'count',
+      and 'days', the days of the rolling average, one of simulate.ROLLING_WINDOWS (default 7)
+    - 'new cases growth exceeds', 'new cases growth below',
+      'new confirmed cases growth exceeds', 'new confirmed cases growth below' - 'rate', the
+      growth of the last 7 days of new cases over the 7 days before that (0.1 is 10% growth)
+    - 'hospitalized exceeds', 'hospitalized below', 'icu exceeds', 'icu below' - 'count'
+    - 'confirmed cases per test exceeds', 'confirmed cases per test below' - 'rate', the
+      confirmed cases of the last 7 days over the tests available in those days (the phase
+      'daily tests'). Tests are not simulated, so this is not the test positivity - it is a
+      threshold on the confirmed cases that is scaled by the test capacity of the phases
+    - 'and', 'or' - 'conditions', a list of conditions
+
+    :param condition: (dict, required) The condition description.
+    :return: (function) A function of (sim, day) that returns True if the condition is met.
+    """
+    condition_type = condition['type']
+    if condition_type not in _CONDITION_COMPILERS:
+        raise ValueError(f'unknown phase condition type: "{condition_type}"')
+    return _CONDITION_COMPILERS[condition_type](condition)
+
+
+def _rolling_average(sim, series_key, days):
+    return sim[s.ROLLING_SUMS][(series_key, days)] / days
+
+
+def _weekly_growth(sim, series_key):
+    this_week = sim[s.ROLLING_SUMS][(series_key, 7)]
+    last_week = sim[s.ROLLING_SUMS][(series_key, 14)] - this_week
+    if last_week == 0:
+        return 0.0 if this_week == 0 else float('inf')
+    return this_week / last_week - 1.0
+
+
+def _confirmed_cases_per_test(sim):
+    tests = sim[s.ROLLING_SUMS][(s.TEST_CAPACITY_SERIES, 7)]
+    # no tests means there is nothing to scale by - never meets the condition
+    return None if tests == 0 else sim[s.ROLLING_SUMS][(s.NEW_CONFIRMED_CASES_SERIES, 7)] / tests
+
+
+def _compile_composite(condition, combine):
+    conditions = [compile_condition(sub_condition) for sub_condition in condition['conditions']]
+    return lambda sim, day: combine(test(sim, day) for test in conditions)
+
+
+def _compile_average(series_key, exceeds):
+    def compile_average(condition):
+        count = condition['count']
+        days = condition.get('days', 7)
+        if days not in s.ROLLING_WINDOWS:
+            raise ValueError(f'rolling average days must be one of {s.ROLLING_WINDOWS}, not {days}')
+        if exceeds:
+            return lambda sim, day: _rolling_average(sim, series_key, days) >= count
+        return lambda sim, day: _rolling_average(sim, series_key, days) < count
+    return compile_average
+
+
+def _compile_growth(series_key, exceeds):
+    def compile_growth(condition):
+        rate = condition['rate']
+        if exceeds:
+            return lambda sim, day: _weekly_growth(sim, series_key) >= rate
+        return lambda sim, day: _weekly_growth(sim, series_key) < rate
+    return compile_growth
+
+
+def _compile_active(series_key, exceeds):
+    def compile_active(condition):
+        count = condition['count']
+        if exceeds:
+            return lambda sim, day: sim[series_key][day] >= count
+        return lambda sim, day: sim[series_key][day] < count
+    return compile_active
+
+
+def _compile_cases_per_test(exceeds):
+    def compile_cases_per_test(condition):
+        rate = condition['rate']
+
+        def cases_per_test_condition(sim, day):
+            cases_per_test = _confirmed_cases_per_test(sim)
+            if cases_per_test is None:
+                return False
+            return cases_per_test >= rate if exceeds else cases_per_test < rate
+        return cases_per_test_condition
+    return compile_cases_per_test
+
+
+_CONDITION_COMPILERS = {
+    'cumulative cases exceeds':
+        lambda condition: lambda sim, day: sim[s.CUMULATIVE_CASES_SERIES][day] >= condition['count'],
+    'cumulative confirmed cases exceeds':
+        lambda condition: lambda sim, day: sim[s.CUMULATIVE_CONFIRMED_CASES_SERIES][day] >= condition['count'],
+    'days after max active':
+        lambda condition: lambda sim, day: day - sim[s.MAX_ACTIVE_CASES] > condition['days'],
+    'days after confirmed max active':
+        lambda condition: lambda sim, day: day - sim[s.MAX_ACTIVE_CONFIRMED_CASES] > condition['days'],
+    'days in phase':
+        lambda condition: lambda sim, day: day - sim[s.CURRENT_PHASE]['start day'] > condition['days'],
+    'average new cases exceeds': _compile_average(s.NEW_CASES_SERIES, True),
+    'average new cases below': _compile_average(s.NEW_CASES_SERIES, False),
+    'average new confirmed cases exceeds': _compile_average(s.NEW_CONFIRMED_CASES_SERIES, True),
+    'average new confirmed cases below': _compile_average(s.NEW_CONFIRMED_CASES_SERIES, False),
+    'new cases growth exceeds': _compile_growth(s.NEW_CASES_SERIES, True),
+    'new cases growth below': _compile_growth(s.NEW_CASES_SERIES, False),
+    'new confirmed cases growth exceeds': _compile_growth(s.NEW_CONFIRMED_CASES_SERIES, True),
+    'new confirmed cases growth below': _compile_growth(s.NEW_CONFIRMED_CASES_SERIES, False),
+    'hospitalized exceeds': _compile_active(s.ACTIVE_HOSPITALIZED_CASES_SERIES, True),
+    'hospitalized below': _compile_active(s.ACTIVE_HOSPITALIZED_CASES_SERIES, False),
+    'icu exceeds': _compile_active(s.ACTIVE_ICU_CASES_SERIES, True),
+    'icu below': _compile_active(s.ACTIVE_ICU_CASES_SERIES, False),
+    'confirmed cases per test exceeds': _compile_cases_per_test(True),
+    'confirmed cases per test below': _compile_cases_per_test(False),
+    'and': lambda condition: _compile_composite(condition, all),
+    'or': lambda condition: _compile_composite(condition, any)
+    # Add new conditions here
+}
 
 
 def set_initial_phase(sim):
@@ -48,11 +266,35 @@ def set_initial_phase(sim):
     :param sim: (dict, required) The simulation state.
     :return: None
     """
-    _set_simulation_phase(sim, INITIAL_PHASE, 0)
+    if sim[s.PHASE_TRANSITIONS] is None:
+        # the simulation uses the module phases
+        sim[s.PHASE_TRANSITIONS] = PHASE_TRANSITIONS
+        sim[s.INITIAL_PHASE] = INITIAL_PHASE
+    _set_simulation_phase(sim, sim[s.INITIAL_PHASE], 0)
     sim[s.NORMAL_DAILY_CONTACTS] = sim[s.CURRENT_DAILY_CONTACTS]
     sim[s.NORMAL_TRANSMISSION_PROBABILITY] = sim[s.CURRENT_TRANSMISSION_PROBABILITY]
 
 
+def set_current_phase(sim, phase_key):
+    """
+    Set the properties of the current phase of the simulation from a phase, without starting the
+    phase - i.e. for a simulation state that is filled in with the results of a run that ended in
+    the phase (see result_cache.py).
+
+    :param sim: (dict, required) The simulation state.
+    :param phase_key: (str, required) The name of the phase.
+    :return: (dict) The phase.
+    """
+    phase = sim[s.CURRENT_PHASE] = sim[s.PHASES][phase_key]
+    sim[s.CURRENT_TRANSITIONS] = sim[s.PHASE_TRANSITIONS].get(phase_key, [])
+    sim[s.HAS_NEXT_PHASE] = len(sim[s.CURRENT_TRANSITIONS]) > 0
+    sim[s.CURRENT_DAILY_CONTACTS] = phase['daily contacts']
+    sim[s.CURRENT_TRANSMISSION_PROBABILITY] = phase['transmission probability']
+    sim[s.CURRENT_TESTING_PROBABILITY] = phase.get('testing probability', 1.0)
+    sim[s.CURRENT_DAILY_TESTS] = phase.get('daily tests', 0)
+    return phase
+
+
 def _set_simulation_phase(sim, phase_key, start_day):
     """
     Set a simulation phase (this is a local method).
@@ -62,14 +304,11 @@ def _set_simulation_phase(sim, phase_key, start_day):
     :param start_day: (int, required) The day that this phase is starting.
     :return: None
     """
-    phase = sim[s.CURRENT_PHASE] = SIMULATION_PHASES[phase_key]
-    sim[s.HAS_NEXT_PHASE] = 'next phase' in phase and 'condition' in phase
-    sim[s.CURRENT_DAILY_CONTACTS] = phase['daily contacts']
-    sim[s.CURRENT_TRANSMISSION_PROBABILITY] = phase['transmission probability']
-    sim[s.CURRENT_TESTING_PROBABILITY] = phase.get('testing probability', 1.0)
+    phase = set_current_phase(sim, phase_key)
     phase['Ro'] = sim[s.CURRENT_DAILY_CONTACTS] * sim[s.CURRENT_TRANSMISSION_PROBABILITY] \
                   * sim[s.CURRENT_CONTAGIOUS_DAYS]
     phase['start day'] = start_day
+    sim[s.PHASE_HISTORY].append([start_day, phase_key])
     return
 
 
@@ -82,23 +321,11 @@ def daily_phase_evaluation(sim, day):
     is being evaluated.
     :return: (bool) True if the state has advanced, False otherwise
     """
-    advance = False
     if sim[s.HAS_NEXT_PHASE]:
-        condition = sim[s.CURRENT_PHASE]['condition']
-        if condition['type'] == 'cumulative cases exceeds':
-            advance = sim[s.CUMULATIVE_CASES_SERIES][day] >= condition['count']
-        elif condition['type'] == 'cumulative confirmed cases exceeds':
-            advance = sim[s.CUMULATIVE_CONFIRMED_CASES_SERIES][day] >= condition['count']
-        elif condition['type'] == 'days after max active':
-            advance = day - sim[s.MAX_ACTIVE_CASES] > condition['days']
-        elif condition['type'] == 'days after confirmed max active':
-            advance = day - sim[s.MAX_ACTIVE_CONFIRMED_CASES] > condition['days']
-        elif condition['type'] == 'days in phase':
-            advance = day - sim[s.CURRENT_PHASE]['start day'] > condition['days']
-        # Add new conditions here
-
-        if advance:
-            print(f' advance to {sim[s.CURRENT_PHASE]["next phase"]} on day {day}')
-            _set_simulation_phase(sim, sim[s.CURRENT_PHASE]['next phase'], day)
-
-    return advance
+        for condition, next_phase in sim[s.CURRENT_TRANSITIONS]:
+            if condition(sim, day):
+                print(f' advance to {next_phase} on day {day}')
+                _set_simulation_phase(sim, next_phase, day)
+                return True
+
+    return False
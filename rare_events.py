@@ -0,0 +1,193 @@
+"""
+Estimate the probability of rare outcomes, i.e. "what is the probability the ICU demand reaches
+N beds?", by splitting. For a tail probability plain Monte Carlo needs many runs to see the outcome
+even a few times - a probability of 0.001 needs about 100,000 runs to be known to within 10%.
+
+Splitting puts intermediate levels between the start and the outcome (i.e. 10, 20, and 40 people
+in the ICU for an outcome of 80). The runs of the first stage start at day 0, and a run that
+reaches the first level is stopped on the day it reaches it (by its daily hook) and kept. The runs
+of the next stage start from copies of the kept runs (see simulate.checkpoint()), each with its own
+random numbers, and go on to the next level, and so on. The probability of the outcome is the
+product of the fraction of the runs of each stage that reach its level. Every stage has the same
+number of runs (fixed effort splitting), so most of the runs are spent on the trajectories that
+are already close to the outcome rather than on the ones that die out early.
+
+The levels work best when about 1 in 10 to 1 in 2 of the runs of each stage reach the level.
+"""
+import argparse
+import contextlib
+import io
+import math
+import random
+import numpy as np
+import simulate as s
+import scenario
+
+# the series that can be used for the outcome, by name
+SERIES = {
+    'icu': s.ACTIVE_ICU_CASES_SERIES,
+    'hospitalized': s.ACTIVE_HOSPITALIZED_CASES_SERIES,
+    'active': s.ACTIVE_CASES_SERIES,
+    'deaths': s.CUMULATIVE_DEATHS_SERIES
+}
+
+
+def default_levels(threshold, count=4):
+    """
+    Levels for an outcome, each level twice the one before it and the last one the threshold.
+
+    :param threshold: (int, required) The threshold of the outcome.
+    :param count: (int, optional, default=4) The most levels.
+    :return: ([int]) The levels, increasing.
+    """
+    return sorted({max(1, int(math.ceil(threshold / 2 ** level))) for level in range(count)})
+
+
+def _level_hook(series_key, level):
+    # a daily hook that stops the run on the day the series reaches the level
+    return lambda sim_state, day: sim_state[series_key][day] >= level
+
+
+def _run_to_level(sim_state, series_key, level):
+    """
+    Run a simulation on until the series reaches a level, or to the end of the simulation.
+
+    :param sim_state: (dict, required) The simulation state, at the start or stopped at a level.
+    :param series_key: (str, required) The series of the outcome.
+    :param level: (int, required) The level.
+    :return: (bool) True if the series reached the level, the simulation is stopped on that day.
+    """
+    # a run can go over more than one level in a day
+    if sim_state[s.NEXT_DAY] > 0 and sim_state[series_key][sim_state[s.NEXT_DAY]] >= level:
+        return True
+    sim_state[s.DAILY_HOOK] = _level_hook(series_key, level)
+    with contextlib.redirect_stdout(io.StringIO()):
+        s.run_simulation(sim_state)
+    return sim_state[s.STOPPED_DAY] is not None
+
+
+def estimate_probability(threshold, levels=None, runs=100, phases_config=None, event_list=None,
+                         population=s.DEFAULT_POPULATION, simulation_days=s.DEFAULT_SIMULATION_DAYS,
+                         initial_infection=s.DEFAULT_INITIAL_INFECTION, series='icu', seed=None,
+                         population_model=None, health_states_file=None):
+    """
+    Estimate the probability that a series reaches a threshold on some day of the simulation.
+
+    :param threshold: (int, required) The threshold, i.e. the ICU beds.
+    :param levels: ([int], optional, default=None) The intermediate levels, increasing and below
+    the threshold, None for default_levels().
+    :param runs: (int, optional, default=100) The runs of each stage.
+    :param phases_config: (dict, optional, default=None) The phases description, see scenario.create_simulation().
+    :param event_list: ([dict], optional, default=None) The event descriptions.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The population.
+    :param simulation_days: (int, optional, default=s.DEFAULT_SIMULATION_DAYS) The days to simulate.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The number of
+    people infected at the start of the simulation.
+    :param series: (str, optional, default='icu') The series of the outcome, one of SERIES.
+    :param seed: (int, optional, default=None) The seed of the estimate, None for a random estimate.
+    :param population_model: (dict, optional, default=None) The array population model, see
+    scenario.create_simulation().
+    :param health_states_file: (str, optional, default=None) The JSON health states file, see
+    scenario.create_simulation().
+    :return: (dict) The 'probability', its 'relative error' (the standard error over the
+    probability), the 'levels' and the 'level probabilities' (the fraction of the runs of each
+    stage that reached the level), the 'runs' that were started, and the 'monte carlo runs' plain
+    Monte Carlo would need for the same relative error.
+    """
+    if series not in SERIES:
+        raise ValueError(f'unknown series {series}, the series are {list(SERIES)}')
+    series_key = SERIES[series]
+    levels = default_levels(threshold) if levels is None else sorted(set(levels) | {threshold})
+    if levels[-1] != threshold:
+        raise ValueError('the levels must be below the threshold')
+    generator = random.Random(seed)
+    # the runs that reached the last level, the next stage starts from copies of them
+    entrances = []
+    level_probabilities = []
+    started = 0
+    for stage, level in enumerate(levels):
+        reached = []
+        for _ in range(runs):
+            run_seed = generator.getrandbits(32)
+            random.seed(run_seed)
+            np.random.seed(run_seed)
+            if stage == 0:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    sim_state = scenario.create_simulation(phases_config, event_list, population, simulation_days,
+                                                           initial_infection, population_model=population_model,
+                                                           health_states_file=health_states_file)
+            else:
+                sim_state = s.checkpoint(entrances[generator.randrange(len(entrances))])
+            started += 1
+            if _run_to_level(sim_state, series_key, level):
+                reached.append(sim_state)
+        level_probabilities.append(len(reached) / runs)
+        entrances = reached
+        if not reached:
+            break
+    probability = math.prod(level_probabilities) if len(level_probabilities) == len(levels) else 0.0
+    # The stages are treated as independent for the error, which is a little optimistic as the
+    # runs of a stage share their starting points.
+    relative_error = math.sqrt(sum((1.0 - p) / (runs * p) for p in level_probabilities)) \
+        if probability > 0.0 else float('inf')
+    return {
+        'probability': probability,
+        'relative error': relative_error,
+        'levels': levels,
+        'level probabilities': level_probabilities,
+        'runs': started,
+        'monte carlo runs': (1.0 - probability) / (probability * relative_error ** 2)
+        if 0.0 < probability and relative_error > 0.0 else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Estimate the probability that the ICU (or another series) reaches a threshold by splitting.')
+    parser.add_argument(
+        '-t', '--threshold', dest='threshold', type=int, required=True,
+        help='The threshold of the outcome, i.e. the ICU beds.')
+    parser.add_argument(
+        '-l', '--levels', dest='levels', type=str, default=None,
+        help='The comma separated intermediate levels, the default is halving from the threshold.')
+    parser.add_argument(
+        '-r', '--runs', dest='runs', type=int, default=100,
+        help='The runs of each stage.')
+    parser.add_argument(
+        '-s', '--series', dest='series', type=str, default='icu', choices=list(SERIES),
+        help='The series of the outcome.')
+    parser.add_argument(
+        '-ph', '--phases', dest='phases', type=str, default=None,
+        help='The JSON file containing the phases data for the simulation.')
+    parser.add_argument(
+        '-e', '--events', dest='events', type=str, default=None,
+        help='A comma separated list of JSON event files for the simulation.')
+    parser.add_argument(
+        '-p', '--population', dest='population', type=int, default=s.DEFAULT_POPULATION,
+        help='The population.')
+    parser.add_argument(
+        '-d', '--days', dest='sim_days', type=int, default=s.DEFAULT_SIMULATION_DAYS,
+        help='The number of days to simulate.')
+    parser.add_argument(
+        '-i', '--infection', dest='infection', type=int, default=s.DEFAULT_INITIAL_INFECTION,
+        help='The number of people infected at the start of the simulation.')
+    parser.add_argument(
+        '-sd', '--seed', dest='seed', type=int, default=None,
+        help='The seed of the estimate.')
+    parser.add_argument(
+        '-st', '--states', dest='states', type=str, default='./data/default_states.json',
+        help='The JSON file containing the health states data for the disease.')
+    args = parser.parse_args()
+
+    estimate = estimate_probability(
+        args.threshold, None if args.levels is None else [int(level) for level in args.levels.split(',')],
+        args.runs, None if args.phases is None else scenario.read_phases(args.phases),
+        None if args.events is None else scenario.read_events(args.events.split(',')),
+        args.population, args.sim_days, args.infection, args.series, args.seed,
+        health_states_file=args.states)
+    for level, level_probability in zip(estimate['levels'], estimate['level probabilities']):
+        print(f'  {args.series} {level:>8,}: {level_probability:6.3f}')
+    print(f'P({args.series} >= {args.threshold:,}) = {estimate["probability"]:.3g} '
+          f'(relative error {estimate["relative error"]:.2f}) from {estimate["runs"]:,} runs')
+    if estimate['monte carlo runs'] is not None:
+        print(f'plain Monte Carlo would need about {estimate["monte carlo runs"]:,.0f} runs')
@@ -0,0 +1,188 @@
+"""
+Run sets with an adaptive number of replicates. Rather than a fixed number of random runs, replicates
+are run in parallel batches until the confidence interval of the mean of each of the chosen outputs
+is within a tolerance, or the maximum number of replicates has been run. A stable scenario stops
+after a few runs, a scenario with a lot of run-to-run variance gets the runs it needs.
+
+The outputs are read from the data of a run (see simulate.simulation_data()), so they can also be
+computed for the data files of a run set.
+"""
+import concurrent.futures
+import contextlib
+import io
+import math
+import os
+import numpy as np
+import simulate as s
+import scenario
+
+# The outputs of a run that can be used to decide when a run set has converged.
+OUTPUTS = {
+    'peak active cases': lambda data: data[s.ACTIVE_CASES_SERIES][data[s.MAX_ACTIVE_CASES]],
+    'peak active day': lambda data: data[s.MAX_ACTIVE_CASES],
+    'peak new cases': lambda data: data[s.NEW_CASES_SERIES][data[s.MAX_NEW_DAILY_CASES]],
+    'peak new cases day': lambda data: data[s.MAX_NEW_DAILY_CASES],
+    'peak hospitalized': lambda data: data[s.ACTIVE_HOSPITALIZED_CASES_SERIES][data[s.MAX_ACTIVE_HOSPITALIZATIONS]],
+    'peak ICU': lambda data: data[s.ACTIVE_ICU_CASES_SERIES][data[s.MAX_ACTIVE_ICU]],
+    'cumulative cases': lambda data: data[s.CUMULATIVE_CASES_SERIES][-1],
+    'cumulative deaths': lambda data: data[s.CUMULATIVE_DEATHS_SERIES][-1]
+}
+DEFAULT_OUTPUTS = ('peak active cases', 'peak active day', 'cumulative deaths')
+
+
+def _t_central(t, dof):
+    """
+    The probability that a Student t variable is within t of 0 (Abramowitz and Stegun 26.7.3 and
+    26.7.4, exact for an integer number of degrees of freedom).
+    """
+    theta = math.atan(t / math.sqrt(dof))
+    cos_squared = math.cos(theta) ** 2
+    if dof % 2 == 1:
+        term = total = math.cos(theta) if dof > 1 else 0.0
+        for j in range(1, (dof - 1) // 2):
+            term *= cos_squared * 2 * j / (2 * j + 1)
+            total += term
+        return 2.0 / math.pi * (theta + math.sin(theta) * total)
+    term = total = 1.0
+    for j in range(1, dof // 2):
+        term *= cos_squared * (2 * j - 1) / (2 * j)
+        total += term
+    return math.sin(theta) * total
+
+
+def _t_quantile(probability, dof):
+    """
+    The quantile of the Student t distribution for a probability above 0.5 and an integer number of
+    degrees of freedom - the distribution in closed form (see _t_central()) inverted by bisection,
+    so it is exact for the few degrees of freedom of the first replicates.
+    """
+    central = 2.0 * probability - 1.0
+    low, high = 0.0, 1.0
+    while _t_central(high, dof) < central:
+        low, high = high, 2.0 * high
+    for _ in range(100):
+        middle = (low + high) / 2.0
+        if _t_central(middle, dof) < central:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2.0
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    The confidence interval of the mean of some values.
+
+    :param values: ([float], required) The values, at least 2.
+    :param confidence: (float, optional, default=0.95) The confidence level.
+    :return: ((float, float)) The mean and the half width of the interval.
+    """
+    values = np.asarray(values, dtype=float)
+    mean = values.mean()
+    standard_error = values.std(ddof=1) / math.sqrt(len(values))
+    return mean, _t_quantile(0.5 + 0.5 * confidence, len(values) - 1) * standard_error
+
+
+def is_converged(values, tolerance, confidence=0.95):
+    """
+    Is the confidence interval of the mean of some values within a tolerance?
+
+    :param values: ([float], required) The values.
+    :param tolerance: (float, required) The largest half width of the interval relative to the
+    mean, i.e. 0.05 is a mean known to within 5%.
+    :param confidence: (float, optional, default=0.95) The confidence level.
+    :return: (bool) True if the interval is within the tolerance.
+    """
+    if len(values) < 2:
+        return False
+    mean, half_width = confidence_interval(values, confidence)
+    return half_width <= tolerance * abs(mean)
+
+
+def _run_replicate(task):
+    # Run a replicate in a worker process and return the data from it.
+    (phases_config, event_list, population, simulation_days, initial_infection, seed, health_states_file,
+     common_random_numbers, hospital_beds, icu_beds) = task
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(phases_config, event_list, population, simulation_days,
+                                          initial_infection, seed, health_states_file=health_states_file,
+                                          common_random_numbers=common_random_numbers,
+                                          hospital_beds=hospital_beds, icu_beds=icu_beds)
+    return s.simulation_data(sim_state)
+
+
+def run_replicates(phases_config=None, event_list=None,
+                   population=s.DEFAULT_POPULATION,
+                   simulation_days=s.DEFAULT_SIMULATION_DAYS,
+                   initial_infection=s.DEFAULT_INITIAL_INFECTION,
+                   outputs=DEFAULT_OUTPUTS, tolerance=0.05, confidence=0.95,
+                   min_runs=3, max_runs=50, batch=None, seed=None, workers=None,
+                   run_complete=None, health_states_file=None, common_random_numbers=False,
+                   hospital_beds=None, icu_beds=None):
+    """
+    Run replicates of a scenario until the confidence interval of every output is within the
+    tolerance, or max_runs replicates have been run.
+
+    :param phases_config: (dict, optional, default=None) The phases description, see scenario.create_simulation().
+    :param event_list: ([dict], optional, default=None) The event descriptions.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The population.
+    :param simulation_days: (int, optional, default=s.DEFAULT_SIMULATION_DAYS) The days to simulate.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The initial infection.
+    :param outputs: ([str], optional, default=DEFAULT_OUTPUTS) The names of the outputs, see OUTPUTS.
+    :param tolerance: (float, optional, default=0.05) The tolerance, see is_converged().
+    :param confidence: (float, optional, default=0.95) The confidence level.
+    :param min_runs: (int, optional, default=3) The fewest replicates to run.
+    :param max_runs: (int, optional, default=50) The most replicates to run.
+    :param batch: (int, optional, default=None) The replicates run at a time, None for the workers.
+    :param seed: (int, optional, default=None) The seed the seeds of the replicates are drawn from.
+    :param workers: (int, optional, default=None) The worker processes, None for the number of cores.
+    :param run_complete: (function, optional, default=None) Called with the run id and the data of
+    each replicate as it is collected, i.e. to write it to a file.
+    :param health_states_file: (str, optional, default=None) The JSON health states file, None for
+    the built in health states.
+    :param common_random_numbers: (bool, optional, default=False) Draw the replicates from common
+    random number streams (see crn.py) - the run sets of different scenarios with the same seed are
+    then paired replicate by replicate.
+    :param hospital_beds: (int, optional, default=None) The hospital beds, see scenario.create_simulation().
+    :param icu_beds: (int, optional, default=None) The ICU beds, see scenario.create_simulation().
+    :return: (dict) The output 'values' of each replicate keyed by output name, the 'intervals'
+    (mean, half width) keyed by output name, the number of 'runs', and whether the run set 'converged'.
+    """
+    unknown = [output for output in outputs if output not in OUTPUTS]
+    if unknown:
+        raise ValueError(f'unknown outputs {unknown}, the outputs are {list(OUTPUTS.keys())}')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if batch is None:
+        batch = workers
+    rng = np.random.default_rng(seed)
+    values = {output: [] for output in outputs}
+    runs = 0
+    converged = False
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        while runs < max_runs:
+            # always run enough for the minimum, then a batch at a time
+            count = min(max(batch, min_runs - runs), max_runs - runs)
+            futures = [executor.submit(
+                _run_replicate,
+                (phases_config, event_list, population, simulation_days, initial_infection,
+                 int(rng.integers(2 ** 31)), health_states_file, common_random_numbers, hospital_beds, icu_beds))
+                for _ in range(count)]
+            for future in futures:
+                data = future.result()
+                for output in outputs:
+                    values[output].append(OUTPUTS[output](data))
+                if run_complete is not None:
+                    run_complete(runs, data)
+                runs += 1
+            if runs >= min_runs and all(is_converged(values[output], tolerance, confidence)
+                                        for output in outputs):
+                converged = True
+                break
+    return {
+        'values': values,
+        'intervals': {output: confidence_interval(output_values, confidence)
+                      for output, output_values in values.items() if len(output_values) > 1},
+        'runs': runs,
+        'converged': converged
+    }
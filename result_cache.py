@@ -0,0 +1,184 @@
+"""
+A disk cache of the results of seeded simulation runs. A seeded run is completely determined by
+its inputs - the phases, the events, the health state graph, the population, the days, the initial
+infection, the seed (and whether the draws are common random numbers), the bed capacities, and
+the version of the simulation engine (simulate.ENGINE_VERSION) - so the key of a result is the
+hash of those inputs in a canonical form, and a run that has been done before is read rather than
+run again (see scenario.run_scenario()).
+
+A result is the data of the run that is written to a data file (see simulate.simulation_data()) -
+the series, the maximums, and the phase history - with the phases, the rest of the maximums and
+the series, the rolling sums, and the day the run ended. A simulation state filled in from the cache
+has the results of the run and is in the phase the run ended in (see ResultCache.restore()), but
+the population is not kept, so it does not have the people and can not be run on.
+
+Every result is a file in the cache directory named by its key. A hit touches the file, and when
+the files are more than the size limit the least recently used are removed. The size of the files
+is found when the first result is written and is kept up to date as results are written and
+removed, so the directory is only scanned again when the cache is over its size.
+"""
+import hashlib
+import json
+import os
+import simulate as s
+import phases
+
+# The simulation state that is kept in a result along with the data of the run
+_RESULT_KEYS = [
+    s.MAX_NEW_DAILY_CONFIRMED_CASES, s.MAX_ACTIVE_CONFIRMED_CASES, s.TEST_CAPACITY_SERIES, s.NEXT_DAY, s.EXTINCT,
+    s.STOPPED_DAY
+]
+
+DEFAULT_CACHE_DIRECTORY = './data/result_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def result_key(phases_config, event_list, health_graph, population, simulation_days, initial_infection, seed,
+               common_random_numbers=False, hospital_beds=None, icu_beds=None):
+    """
+    The key of the result of a seeded run.
+
+    :param phases_config: (dict, required) The phases description.
+    :param event_list: ([dict], required) The event descriptions.
+    :param health_graph: (str, required) The key of the health state graph, see covid_state.health_graph_key().
+    :param population: (int, required) The population.
+    :param simulation_days: (int, required) The days to simulate.
+    :param initial_infection: (int, required) The number of people infected at the start.
+    :param seed: (int, required) The seed of the run.
+    :param common_random_numbers: (bool, optional, default=False) Was the run drawn from the common
+    random number streams (see crn.py).
+    :param hospital_beds: (int, optional, default=None) The hospital beds, None for no limit.
+    :param icu_beds: (int, optional, default=None) The ICU beds, None for no limit.
+    :return: (str) The key.
+    """
+    description = json.dumps([s.ENGINE_VERSION, phases_config, event_list, health_graph, population,
+                              simulation_days, initial_infection, seed, common_random_numbers, hospital_beds,
+                              icu_beds],
+                             sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    The results of seeded runs in a directory, with least recently used eviction.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: (str, optional, default=DEFAULT_CACHE_DIRECTORY) The cache directory, it
+        is created when the first result is written.
+        :param max_bytes: (int, optional, default=DEFAULT_MAX_BYTES) The most space the results use.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # the size of the results, None until the directory is scanned
+        self.total_bytes = None
+
+    def _file_name(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _results(self):
+        # the (modification time, size, path) of the results in the directory
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith('.json')]
+        except OSError:
+            return []
+        stats = []
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                stats.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                # removed by another process
+                pass
+        return stats
+
+    def get(self, key):
+        """
+        Read a result.
+
+        :param key: (str, required) The key, see result_key().
+        :return: (dict) The result, see put(), None if it is not in the cache.
+        """
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'r') as result_file:
+                result = json.load(result_file)
+            # the access time is not reliable (noatime mounts), the modification time is the use
+            os.utime(file_name)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, sim_state):
+        """
+        Write the result of a run, then remove the least recently used results if the cache is
+        over its size.
+
+        :param key: (str, required) The key, see result_key().
+        :param sim_state: (dict, required) The simulation state after the run.
+        :return: None
+        """
+        data = s.simulation_data(sim_state)
+        # the phases are kept as they are in the simulation state, not as they are in the data
+        del data[s.PHASES]
+        data.update({name: sim_state[name] for name in _RESULT_KEYS})
+        result = {
+            'phases': sim_state[s.PHASES],
+            'rolling sums': [[series_key, window, total] for (series_key, window), total in
+                             sim_state[s.ROLLING_SUMS].items()],
+            'data': data
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self._results())
+        file_name = self._file_name(key)
+        try:
+            # a result that is written again replaces the one that is there
+            self.total_bytes -= os.path.getsize(file_name)
+        except OSError:
+            pass
+        # written to a temporary file and renamed, so a worker never reads a partly written result
+        temporary_file_name = f'{file_name}.{os.getpid()}'
+        with open(temporary_file_name, 'w') as result_file:
+            json.dump(result, result_file, separators=(',', ':'))
+        self.total_bytes += os.path.getsize(temporary_file_name)
+        os.replace(temporary_file_name, file_name)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is within its size.
+
+        :return: None
+        """
+        # Other processes may write to the same directory, so the size is found again from the
+        # directory rather than trusted.
+        stats = self._results()
+        self.total_bytes = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.total_bytes -= size
+
+    def restore(self, result, sim_state):
+        """
+        Put a cached result into a simulation state, as if the run had been done - except that the
+        simulation state has no population.
+
+        :param result: (dict, required) The result, see get().
+        :param sim_state: (dict, required) The simulation state, created for the run.
+        :return: None
+        """
+        sim_state[s.PHASES] = result['phases']
+        sim_state.update(result['data'])
+        sim_state[s.ROLLING_SUMS] = {(series_key, window): total for series_key, window, total in result['rolling sums']}
+        # the phase the run ended in, and its testing rates
+        phases.set_current_phase(sim_state, sim_state[s.PHASE_HISTORY][-1][1])
+        sim_state[s.UPDATE_TESTING_RATES](sim_state[s.CURRENT_TESTING_PROBABILITY])
@@ -0,0 +1,185 @@
+"""
+Create and run a simulation of the covid_state disease model from a scenario - the phases, the
+events, the population, the length of the simulation, the initial infection, and the random
+seed. This is the setup exercise_3g does for a run, in a form that can be called many times
+in one process (i.e. by the workers of a process pool running a calibration).
+"""
+import json
+import os
+import random
+import numpy as np
+import simulate as s
+import phases
+import covid_state as state
+import events
+import result_cache
+import crn
+
+# The environment variable with the directory of the result cache, "off" for no cache.
+RESULT_CACHE_VARIABLE = 'SIMULATION_RESULT_CACHE'
+
+
+def _environment_result_cache():
+    # the result cache of the RESULT_CACHE_VARIABLE, the default cache if it is not set
+    directory = os.environ.get(RESULT_CACHE_VARIABLE, result_cache.DEFAULT_CACHE_DIRECTORY)
+    return None if directory.lower() in ('', 'off') else result_cache.ResultCache(directory)
+
+
+# The cache of the results of seeded runs (see result_cache.py), None for no cache. The seeded runs
+# of every script that runs scenarios are cached in the default cache directory unless the
+# RESULT_CACHE_VARIABLE says otherwise, or another cache is set (see set_result_cache()).
+RESULT_CACHE = _environment_result_cache()
+
+
+def read_phases(file_name):
+    """
+    Read a phases description file.
+
+    :param file_name: (str, required) The name of the JSON phases description file.
+    :return: (dict) The phases description.
+    """
+    with open(file_name, "r") as data_file:
+        return json.load(data_file)
+
+
+def read_events(file_names):
+    """
+    Read event description files.
+
+    :param file_names: ([str], required) The names of the JSON event description files.
+    :return: ([dict]) The event descriptions.
+    """
+    event_list = []
+    for file_name in file_names:
+        with open(file_name, "r") as data_file:
+            event_list.append(json.load(data_file))
+    return event_list
+
+
+def set_result_cache(directory=result_cache.DEFAULT_CACHE_DIRECTORY, max_bytes=result_cache.DEFAULT_MAX_BYTES):
+    """
+    Set the cache of the results of seeded runs. The workers of a process pool that are forked
+    after the cache is set use it too.
+
+    :param directory: (str, optional, default=result_cache.DEFAULT_CACHE_DIRECTORY) The cache
+    directory, None for no cache.
+    :param max_bytes: (int, optional, default=result_cache.DEFAULT_MAX_BYTES) The most space the
+    results use.
+    :return: None
+    """
+    global RESULT_CACHE
+    RESULT_CACHE = None if directory is None else result_cache.ResultCache(directory, max_bytes)
+
+
+def create_simulation(phases_config=None, event_list=None,
+                      population=s.DEFAULT_POPULATION,
+                      simulation_days=s.DEFAULT_SIMULATION_DAYS,
+                      initial_infection=s.DEFAULT_INITIAL_INFECTION,
+                      daily_hook=None, population_model=None, health_states_file=None,
+                      random_streams=None, hospital_beds=None, icu_beds=None):
+    """
+    Create the simulation state for a scenario, ready to be run.
+
+    :param phases_config: (dict, optional, default=None) The phases description, None for the
+    current phases (the default no-phases implementation if phases were never set). The simulation
+    has its own copy of the phases, so the phases of the phases module are not changed, and
+    simulations of different scenarios can be created side by side.
+    :param event_list: ([dict], optional, default=None) The event descriptions, None for no events.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The population.
+    :param simulation_days: (int, optional, default=s.DEFAULT_SIMULATION_DAYS) The days to simulate.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The number of
+    people infected at the start of the simulation.
+    :param daily_hook: (function, optional, default=None) The daily hook, see simulate.create_initial_state().
+    :param population_model: (dict, optional, default=None) The array population model, see
+    simulate.create_initial_state(), None for a population of person dictionaries.
+    :param health_states_file: (str, optional, default=None) The JSON health states file, see
+    covid_state.load_health_states(), None for the current health states.
+    :param random_streams: (crn.RandomStreams, optional, default=None) The common random number
+    streams, see simulate.create_initial_state(), None for the random module.
+    :param hospital_beds: (int, optional, default=None) The hospital beds outside of the ICU, None
+    for a bed for everyone who needs one.
+    :param icu_beds: (int, optional, default=None) The ICU beds, None for a bed for everyone who
+    needs one.
+    :return: (dict) The initialized simulation state.
+    """
+    if health_states_file is not None and health_states_file != state.HEALTH_STATES_FILE:
+        state.load_health_states(health_states_file)
+    if population_model is not None and event_list:
+        raise ValueError('events are not supported with an array population model')
+    if population_model is not None and random_streams is not None:
+        raise ValueError('common random numbers are not supported with an array population model')
+    if population_model is not None and (hospital_beds is not None or icu_beds is not None):
+        raise ValueError('bed capacities are not supported with an array population model')
+    compiled_phases = phases.compile_phases(phases_config)
+    sim_state = s.create_initial_state(
+        state.HEALTH_STATES, state.set_default_health_state,
+        state.set_initial_infected_state, state.evaluate_health_for_day,
+        state.evaluate_contacts, state.set_testing_for_phase,
+        compiled_phases['phases'], phases.daily_phase_evaluation,
+        events=[] if event_list is None else event_list, daily_event_evaluation=events.evaluate_events,
+        infect_person=state.infect_person, daily_hook=daily_hook, population_model=population_model,
+        random_streams=random_streams, hospital_beds=hospital_beds, icu_beds=icu_beds,
+        population=population, simulation_days=simulation_days,
+        initial_infection=initial_infection
+    )
+    phases.set_simulation_phases(sim_state, compiled_phases)
+    sim_state[s.CURRENT_CONTAGIOUS_DAYS] = state.get_mean_infectious_days()
+    phases.set_initial_phase(sim_state)
+    state.set_testing_for_phase(sim_state[s.CURRENT_TESTING_PROBABILITY])
+    return sim_state
+
+
+def run_scenario(phases_config=None, event_list=None,
+                 population=s.DEFAULT_POPULATION,
+                 simulation_days=s.DEFAULT_SIMULATION_DAYS,
+                 initial_infection=s.DEFAULT_INITIAL_INFECTION,
+                 seed=None, daily_hook=None, population_model=None, health_states_file=None,
+                 common_random_numbers=False, hospital_beds=None, icu_beds=None):
+    """
+    Create and run the simulation for a scenario. When there is a RESULT_CACHE (see
+    set_result_cache()) the result of a seeded run of the person population (no population model)
+    without a daily hook is kept in it, and if the same run has been done before the simulation
+    state is filled in from the cache rather than run.
+
+    :param phases_config: (dict, optional, default=None) The phases description, see create_simulation().
+    :param event_list: ([dict], optional, default=None) The event descriptions.
+    :param population: (int, optional, default=s.DEFAULT_POPULATION) The population.
+    :param simulation_days: (int, optional, default=s.DEFAULT_SIMULATION_DAYS) The days to simulate.
+    :param initial_infection: (int, optional, default=s.DEFAULT_INITIAL_INFECTION) The number of
+    people infected at the start of the simulation.
+    :param seed: (int, optional, default=None) The seed for the random number generators, None
+    to leave them as they are.
+    :param daily_hook: (function, optional, default=None) The daily hook, see simulate.create_initial_state().
+    :param population_model: (dict, optional, default=None) The array population model, see create_simulation().
+    :param health_states_file: (str, optional, default=None) The JSON health states file, see create_simulation().
+    :param common_random_numbers: (bool, optional, default=False) Draw the random numbers of the
+    people from common random number streams seeded with the seed (see crn.py), so that the runs
+    of different scenarios with the same seed are paired.
+    :param hospital_beds: (int, optional, default=None) The hospital beds, see create_simulation().
+    :param icu_beds: (int, optional, default=None) The ICU beds, see create_simulation().
+    :return: (dict) The simulation state after the run.
+    """
+    if common_random_numbers and seed is None:
+        raise ValueError('common random numbers need a seed')
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    sim_state = create_simulation(phases_config, event_list, population, simulation_days, initial_infection,
+                                  daily_hook, population_model, health_states_file,
+                                  crn.RandomStreams(seed) if common_random_numbers else None,
+                                  hospital_beds, icu_beds)
+    key = None
+    if RESULT_CACHE is not None and seed is not None and daily_hook is None and population_model is None:
+        key = result_cache.result_key(
+            {'phases': phases.SIMULATION_PHASES, 'initial phase': phases.INITIAL_PHASE}
+            if phases_config is None else phases_config,
+            [] if event_list is None else event_list, state.health_graph_key(),
+            population, simulation_days, initial_infection, seed, common_random_numbers, hospital_beds, icu_beds)
+        result = RESULT_CACHE.get(key)
+        if result is not None:
+            RESULT_CACHE.restore(result, sim_state)
+            return sim_state
+    s.run_simulation(sim_state)
+    if key is not None:
+        RESULT_CACHE.put(key, sim_state)
+    return sim_state
@@ -0,0 +1,342 @@
+"""
+A local simulation server. The dashboards make many small what-if runs, and as separate processes
+every one of them pays for starting python, the imports, compiling the health states, and building
+the population. The server starts a pool of worker processes once, and the workers keep the
+compiled health states and the population models (the contact network, grid, or ages, which can
+take longer to build than the run) from one request to the next. e.g.:
+
+    python server.py --port 8020 --workers 4 -st ./data/default_states.json
+
+A scenario is POSTed to /simulate as JSON, and the response is the data of the run, as it is
+written by simulate.write_data():
+
+    {
+        "phases": {"initial phase": "normal", "phases": {...}},
+        "events": [{...}, ...],
+        "population": 100000,
+        "days": 180,
+        "initial infection": 1,
+        "seed": 42,
+        "contact model": "network",
+        "ages": false,
+        "grid": "40x40",
+        "urban": 0.5,
+        "hospital beds": 400,
+        "icu beds": 60
+    }
+
+Everything is optional - the 'contact model' is "mixed" (random daily contacts, the default),
+"network", "grid" (with the 'grid' size and 'urban' fraction), or "ages" (the age contact matrix),
+and 'ages' adds age structure to a network or grid. The 'hospital beds' and 'icu beds' limit the
+beds of the mixed contact model (the default is a bed for everyone who needs one). GET /status
+returns the server settings and counts of the requests.
+
+Each simulation has its own copy of the phases and its own event schedule (see
+scenario.create_simulation()), so runs do not share anything through the phases and events
+modules.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import http.server
+import io
+import json
+import os
+import threading
+import time
+import numpy as np
+import simulate as s
+import scenario
+import covid_state
+import state_tables
+import array_population
+
+# the most population models a worker keeps, the oldest is dropped for a new one
+MAX_POPULATION_MODELS = 4
+CONTACT_MODELS = ('mixed', 'network', 'grid', 'ages')
+
+# the seed of the contact networks, grids, and age groups of the population models, so every
+# request for a population model gets the same population
+TEMPLATE_SEED = 42
+
+_WORKER_HEALTH_STATES_FILE = None
+_POPULATION_MODELS = {}
+
+
+def _convert(request, field, convert, default):
+    """
+    Convert a number of a scenario request.
+
+    :param request: (dict, required) The scenario request.
+    :param field: (str, required) The field of the number.
+    :param convert: (function, required) The conversion, i.e. int or float.
+    :param default: (object, required) The value when the field is missing, the
+    numbers that are optional are also None when the field is null.
+    :return: (object) The number.
+    """
+    value = request.get(field)
+    if value is None:
+        if field in request and default is not None:
+            raise ValueError(f'the "{field}" must be a number')
+        return default
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        # i.e. an object, a list, or a string that is not a number
+        raise ValueError(f'the "{field}" must be a number') from None
+
+
+def parse_request(request):
+    """
+    Check a scenario request and fill in the defaults.
+
+    :param request: (dict, required) The scenario request, see the module description.
+    :return: (dict) The scenario.
+    """
+    if not isinstance(request, dict):
+        raise ValueError('the request must be a JSON object')
+    known = {'phases', 'events', 'population', 'days', 'initial infection', 'seed', 'contact model',
+             'ages', 'grid', 'urban', 'hospital beds', 'icu beds'}
+    unknown = sorted(set(request.keys()) - known)
+    if unknown:
+        raise ValueError(f'unknown request fields {unknown}')
+    scenario_request = {
+        'phases': request.get('phases'),
+        'events': request.get('events'),
+        'population': _convert(request, 'population', int, s.DEFAULT_POPULATION),
+        'days': _convert(request, 'days', int, s.DEFAULT_SIMULATION_DAYS),
+        'initial infection': _convert(request, 'initial infection', int, s.DEFAULT_INITIAL_INFECTION),
+        'seed': _convert(request, 'seed', int, None),
+        'contact model': request.get('contact model', 'mixed'),
+        'ages': bool(request.get('ages', False)),
+        'grid': request.get('grid'),
+        'urban': _convert(request, 'urban', float, 0.5),
+        'hospital beds': _convert(request, 'hospital beds', int, None),
+        'icu beds': _convert(request, 'icu beds', int, None)
+    }
+    if scenario_request['phases'] is not None and \
+            (not isinstance(scenario_request['phases'], dict) or
+             not {'phases', 'initial phase'} <= set(scenario_request['phases'].keys())):
+        raise ValueError('the phases must be an object with the "phases" and the "initial phase"')
+    if scenario_request['events'] is not None and \
+            (not isinstance(scenario_request['events'], list) or
+             not all(isinstance(event, dict) for event in scenario_request['events'])):
+        raise ValueError('the events must be a list of event objects')
+    if scenario_request['population'] <= 0 or scenario_request['days'] <= 0:
+        raise ValueError('the population and the days must be positive')
+    if not isinstance(scenario_request['contact model'], str) or \
+            scenario_request['contact model'] not in CONTACT_MODELS:
+        raise ValueError(f'unknown contact model {scenario_request["contact model"]}, '
+                         f'the contact models are {list(CONTACT_MODELS)}')
+    if scenario_request['contact model'] == 'ages':
+        scenario_request['ages'] = True
+    if scenario_request['contact model'] == 'grid':
+        if scenario_request['grid'] is None:
+            raise ValueError('the grid contact model needs the "grid" size, i.e. "40x40"')
+        scenario_request['grid'] = tuple(int(size) for size in str(scenario_request['grid']).lower().split('x'))
+        if len(scenario_request['grid']) != 2:
+            raise ValueError('the grid size is "ROWSxCOLUMNS"')
+    elif scenario_request['contact model'] == 'mixed' and scenario_request['ages']:
+        raise ValueError('ages are not supported with the mixed contact model, use the ages contact model')
+    if scenario_request['contact model'] != 'mixed' and scenario_request['events']:
+        raise ValueError('events are only supported with the mixed contact model')
+    if scenario_request['contact model'] != 'mixed' and \
+            (scenario_request['hospital beds'] is not None or scenario_request['icu beds'] is not None):
+        raise ValueError('bed capacities are only supported with the mixed contact model')
+    return scenario_request
+
+
+def initialize_worker(health_states_file):
+    """
+    Warm a worker process - load (and compile) the health states once, the process pool initializer.
+
+    :param health_states_file: (str, required) The JSON health states file, None for the built in
+    health states.
+    :return: None
+    """
+    global _WORKER_HEALTH_STATES_FILE
+    _WORKER_HEALTH_STATES_FILE = health_states_file
+    if health_states_file is not None:
+        covid_state.load_health_states(health_states_file)
+
+
+def _population_model(scenario_request):
+    """
+    The population model of a scenario - built the first time a worker needs it and kept for the
+    following requests. A population model is reset by every simulation that uses it (see
+    array_population.initialize()), and a worker runs one simulation at a time.
+
+    :param scenario_request: (dict, required) The scenario, see parse_request().
+    :return: (dict) The population model, None for random daily contacts.
+    """
+    contact_model = scenario_request['contact model']
+    if contact_model == 'mixed':
+        return None
+    population = scenario_request['population']
+    key = (contact_model, scenario_request['ages'], population, scenario_request['grid'],
+           scenario_request['urban'] if contact_model == 'grid' else None)
+    model = _POPULATION_MODELS.pop(key, None)
+    if model is None:
+        # the network, grid, and ages are imported with the first population model that needs them
+        if contact_model == 'network':
+            import network
+            infections = network.create_infections(network.generate_network(population, seed=TEMPLATE_SEED))
+        elif contact_model == 'grid':
+            import spatial
+            infections = spatial.create_infections(spatial.create_grid(
+                population, spatial.urban_density(scenario_request['grid'], scenario_request['urban']),
+                seed=TEMPLATE_SEED))
+        else:
+            import ages
+            infections = ages.create_infections()
+        if scenario_request['ages']:
+            import ages
+            model = array_population.create_model(
+                state_tables.compile_health_states(ages.add_age_branches(covid_state.HEALTH_STATES),
+                                                   age_groups=ages.AGE_GROUPS),
+                population, infections, age_groups=ages.assign_age_groups(population, seed=TEMPLATE_SEED + 1))
+        else:
+            model = array_population.create_model(
+                covid_state.load_health_states(_WORKER_HEALTH_STATES_FILE) if _WORKER_HEALTH_STATES_FILE
+                else state_tables.compile_health_states(covid_state.HEALTH_STATES), population, infections)
+        while len(_POPULATION_MODELS) >= MAX_POPULATION_MODELS:
+            del _POPULATION_MODELS[next(iter(_POPULATION_MODELS))]
+    # the most recently used model is the last to be dropped
+    _POPULATION_MODELS[key] = model
+    return model
+
+
+def run_request(scenario_request, daily_hook=None):
+    """
+    Run the simulation of a scenario in a worker process.
+
+    :param scenario_request: (dict, required) The scenario, see parse_request().
+    :param daily_hook: (function, optional, default=None) The daily hook, see simulate.create_initial_state().
+    :return: (dict) The data of the simulation, see simulate.simulation_data().
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(
+            scenario_request['phases'], scenario_request['events'], scenario_request['population'],
+            scenario_request['days'], scenario_request['initial infection'], scenario_request['seed'],
+            daily_hook=daily_hook, population_model=_population_model(scenario_request),
+            health_states_file=_WORKER_HEALTH_STATES_FILE, hospital_beds=scenario_request['hospital beds'],
+            icu_beds=scenario_request['icu beds'])
+    return s.simulation_data(sim_state)
+
+
+def _json_default(value):
+    # numpy numbers in the simulation data
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class SimulationRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    The requests of the simulation server, the server is a SimulationServer.
+    """
+
+    def _respond(self, status, body):
+        content = json.dumps(body, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self._respond(404, {'error': f'unknown path {self.path}'})
+            return
+        self._respond(200, self.server.status())
+
+    def do_POST(self):
+        if self.path != '/simulate':
+            self._respond(404, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            scenario_request = parse_request(json.loads(self.rfile.read(length) or b'{}'))
+        except ValueError as error:
+            # json.JSONDecodeError is a ValueError
+            self._respond(400, {'error': str(error)})
+            return
+        self.server.count('received')
+        try:
+            data = self.server.executor.submit(run_request, scenario_request).result()
+        except Exception as error:
+            self.server.count('failed')
+            self._respond(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self.server.count('completed')
+        self._respond(200, data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class SimulationServer(http.server.ThreadingHTTPServer):
+    """
+    The HTTP server - each request is handled in a thread that waits for the run in the worker pool,
+    so requests are run as fast as there are workers to run them.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, health_states_file=None, verbose=False):
+        super().__init__(address, SimulationRequestHandler)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.health_states_file = health_states_file
+        self.verbose = verbose
+        self.started = time.time()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=initialize_worker, initargs=(health_states_file,))
+        self._counts = {'received': 0, 'completed': 0, 'failed': 0}
+        self._counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def status(self):
+        with self._counts_lock:
+            counts = dict(self._counts)
+        return {
+            'workers': self.workers,
+            'health states file': self.health_states_file,
+            'uptime': time.time() - self.started,
+            'requests': counts
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local simulation server.')
+    parser.add_argument(
+        '--host', dest='host', type=str, default='127.0.0.1',
+        help='The address the server listens on.')
+    parser.add_argument(
+        '--port', dest='port', type=int, default=8020,
+        help='The port the server listens on.')
+    parser.add_argument(
+        '-w', '--workers', dest='workers', type=int, default=None,
+        help='The number of worker processes, the default is the number of cores.')
+    parser.add_argument(
+        '-st', '--states', dest='states', type=str, default='./data/default_states.json',
+        help='The JSON file containing the health states data for the disease.')
+    parser.add_argument(
+        '-v', '--verbose', dest='verbose', action='store_true',
+        help='Log every request.')
+    args = parser.parse_args()
+
+    simulation_server = SimulationServer((args.host, args.port), args.workers, args.states, args.verbose)
+    print(f'simulation server on http://{args.host}:{args.port} with {simulation_server.workers} workers')
+    try:
+        simulation_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulation_server.server_close()
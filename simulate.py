@@ -2,25 +2,37 @@
 The code that holds the state of the simulation, runs the simulation, saves the simulation to a file,
 reads a simulation from a file, and plots a simulation.
 """
+import collections
+import copy
+import gc
 import json
 import random
-import matplotlib.pyplot as plt
 import numpy as np
+from person import Person
+import crn
 
 # larger simulation defaults
 DEFAULT_POPULATION = 50000
 DEFAULT_INITIAL_INFECTION = 20
 DEFAULT_SIMULATION_DAYS = 211
 
+# The version of the simulation engine. Change this whenever a change to the simulation changes the
+# results of a seeded run, so results cached by an older engine are not used (see result_cache.py).
+ENGINE_VERSION = 5
+
 # define the keys for the simulation state
 # some of the basic stuff
 SIMULATION_DAYS = 'simulation_days'
 POPULATION = 'population'
 INITIAL_INFECTION = 'initial_infection'
 PEOPLE = 'people'
+EVERYONE = 'everyone'
+# the people in states requiring hospitalization (in a bed or waiting for one), keyed by person id
 HOSPITALIZED_PEOPLE = 'hospitalized_people'
 HEALTH_STATES = 'health_states'
 PHASES = 'phases'
+PHASE_TRANSITIONS = 'phase_transitions'
+INITIAL_PHASE = 'initial_phase'
 DAILY_PHASE_EVALUATION = 'daily_phase_evaluation'
 SET_DEFAULT_HEALTH = 'set_initial_health'
 SET_INFECTED = 'set_infected'
@@ -28,16 +40,43 @@ DAILY_HEALTH_EVALUATION = 'daily_health_evaluation'
 DAILY_EVALUATE_CONTACTS = 'daily_evaluate_contacts'
 UPDATE_TESTING_RATES = 'update_testing_rates'
 EVENTS = 'events'
+EVENT_SCHEDULE = 'event_schedule'
+COMPILED_EVENTS = 'compiled_events'
 DAILY_EVENT_EVALUATION = 'daily_event_evaluation'
+INFECT_PERSON = 'infect_person'
+EVENT_ROSTERS = 'event_rosters'
+VISITOR_POOL = 'visitor_pool'
+DAILY_HOOK = 'daily_hook'
+STOPPED_DAY = 'stopped_day'
+POPULATION_MODEL = 'population_model'
+RANDOM_STREAMS = 'random_streams'
+NEXT_DAY = 'next_day'
+EXTINCT = 'extinct'
+
+# The beds for the people in health states that need hospital care (see covid_state.py) - the
+# capacities (None for as many beds as are needed), the beds that are occupied, and the queues of
+# the people who are waiting for a bed with the count of them (the queues may still hold people
+# who stopped waiting).
+HOSPITAL_BEDS = 'hospital_beds'
+ICU_BEDS = 'icu_beds'
+OCCUPIED_HOSPITAL_BEDS = 'occupied_hospital_beds'
+OCCUPIED_ICU_BEDS = 'occupied_icu_beds'
+HOSPITAL_QUEUE = 'hospital_queue'
+ICU_QUEUE = 'icu_queue'
+WAITING_FOR_HOSPITAL = 'waiting_for_hospital'
+WAITING_FOR_ICU = 'waiting_for_icu'
 
 # Properties for the simulation of the current phase, note that everything
 # comes from the phases except current contagious days which comes from state
 CURRENT_PHASE = 'current_phase'
 HAS_NEXT_PHASE = 'has_next_phase'
+CURRENT_TRANSITIONS = 'current_transitions'
+PHASE_HISTORY = 'phase_history'
 CURRENT_DAILY_CONTACTS = 'current_daily_contacts'
 CURRENT_CONTAGIOUS_DAYS = 'current_contagious_days'
 CURRENT_TRANSMISSION_PROBABILITY = 'current_transmission_probability'
 CURRENT_TESTING_PROBABILITY = 'current_testing_probability'
+CURRENT_DAILY_TESTS = 'current_daily_tests'
 NORMAL_DAILY_CONTACTS = 'normal_daily_contacts'
 NORMAL_TRANSMISSION_PROBABILITY = 'normal_transmission_probability'
 
@@ -73,22 +112,34 @@ ACTIVE_CASES_SERIES = 'active cases'
 ACTIVE_CONFIRMED_CASES_SERIES = 'active confirmed cases'
 ACTIVE_HOSPITALIZED_CASES_SERIES = 'active hospitalized cases'
 ACTIVE_ICU_CASES_SERIES = 'active ICU cases'
+WAITING_FOR_HOSPITAL_SERIES = 'waiting for hospital bed'
+WAITING_FOR_ICU_SERIES = 'waiting for ICU bed'
 NEW_CASES_SERIES = 'new cases'
 NEW_CONFIRMED_CASES_SERIES = 'new confirmed cases'
 NEW_ACTIVE_CASES_SERIES = 'new active cases'
 NEW_CONFIRMED_ACTIVE_CASES_SERIES = 'new confirmed active cases'
 NEW_RECOVERIES_SERIES = 'new recoveries'
 NEW_DEATHS_SERIES = 'new deaths'
+# the phase 'daily tests', the tests that are available each day - tests are not simulated
+TEST_CAPACITY_SERIES = 'daily test capacity'
+
+# Rolling sums of some of the daily series over the last ROLLING_WINDOWS days, these are
+# maintained as the simulation runs so phase conditions can use rolling averages without
+# summing the series every day. The ROLLING_SUMS value is a dictionary keyed by
+# (series key, window days).
+ROLLING_SUMS = 'rolling_sums'
+ROLLING_WINDOWS = (7, 14)
+_ROLLING_SERIES = (NEW_CASES_SERIES, NEW_CONFIRMED_CASES_SERIES, TEST_CAPACITY_SERIES)
 
 # The keys that should be serialized to a file to save the results of a simulation.
 _SERIALIZE_KEYS = [
-    SIMULATION_DAYS, POPULATION, INITIAL_INFECTION, MAX_NEW_DAILY_CASES, MAX_ACTIVE_CASES,
+    SIMULATION_DAYS, POPULATION, INITIAL_INFECTION, PHASE_HISTORY, MAX_NEW_DAILY_CASES, MAX_ACTIVE_CASES,
     MAX_ACTIVE_HOSPITALIZATIONS, MAX_ACTIVE_ICU, CUMULATIVE_CASES_SERIES,
     CUMULATIVE_CONFIRMED_CASES_SERIES, CUMULATIVE_RECOVERIES_SERIES,
     CUMULATIVE_CONFIRMED_RECOVERIES_SERIES, CUMULATIVE_DEATHS_SERIES,
     CUMULATIVE_CONFIRMED_DEATHS_SERIES, ACTIVE_CASES_SERIES,
     ACTIVE_CONFIRMED_CASES_SERIES, ACTIVE_HOSPITALIZED_CASES_SERIES, ACTIVE_ICU_CASES_SERIES,
-    NEW_CASES_SERIES, NEW_CONFIRMED_CASES_SERIES, NEW_ACTIVE_CASES_SERIES,
+    WAITING_FOR_HOSPITAL_SERIES, WAITING_FOR_ICU_SERIES, NEW_CASES_SERIES, NEW_CONFIRMED_CASES_SERIES, NEW_ACTIVE_CASES_SERIES,
     NEW_CONFIRMED_ACTIVE_CASES_SERIES, NEW_RECOVERIES_SERIES, NEW_DEATHS_SERIES
  ]
 
@@ -98,6 +149,8 @@ def create_initial_state(health_states, set_default_health_state,
                          evaluate_contacts, update_testing_rates,
                          phases, daily_phase_evaluation,
                          events=None, daily_event_evaluation=None,
+                         infect_person=None, daily_hook=None, population_model=None, random_streams=None,
+                         hospital_beds=None, icu_beds=None,
                          simulation_days=DEFAULT_SIMULATION_DAYS,
                          population=DEFAULT_POPULATION,
                          initial_infection=DEFAULT_INITIAL_INFECTION):
@@ -113,6 +166,22 @@ def create_initial_state(health_states, set_default_health_state,
     :param daily_phase_evaluation:
     :param events:
     :param daily_event_evaluation:
+    :param infect_person: (function, optional, default=None) Infect a person who can be infected,
+    used when infections are computed outside of the daily contacts (i.e. at events).
+    :param daily_hook: (function, optional, default=None) Called as daily_hook(sim_state, day) at the
+    end of every day, after the statistics for the day are in the series at index day. If it returns
+    True the simulation is stopped, the series end at that day, and STOPPED_DAY is set to that day.
+    :param population_model: (dict, optional, default=None) A model that keeps the population in
+    arrays and evaluates its health and contacts for a day in vectorized steps (see
+    array_population.create_model()), None for a population of person dictionaries evaluated with
+    the health and contact callbacks.
+    :param random_streams: (crn.RandomStreams, optional, default=None) The common random number
+    streams for the draws of the people, so that runs of different scenarios with the same streams
+    seed are paired, None for the random module.
+    :param hospital_beds: (int, optional, default=None) The hospital beds outside of the ICU, None
+    for a bed for everyone who needs one.
+    :param icu_beds: (int, optional, default=None) The ICU beds, None for a bed for everyone who
+    needs one.
     :param simulation_days:
     :param population:
     :param initial_infection:
@@ -123,7 +192,8 @@ def create_initial_state(health_states, set_default_health_state,
         POPULATION: population,
         INITIAL_INFECTION: initial_infection,
         PEOPLE: [],
-        HOSPITALIZED_PEOPLE: [],
+        EVERYONE: [],
+        HOSPITALIZED_PEOPLE: {},
         HEALTH_STATES: health_states,
         SET_DEFAULT_HEALTH: set_default_health_state,
         SET_INFECTED: set_initial_infected_state,
@@ -131,9 +201,31 @@ def create_initial_state(health_states, set_default_health_state,
         DAILY_EVALUATE_CONTACTS: evaluate_contacts,
         UPDATE_TESTING_RATES: update_testing_rates,
         PHASES: phases,
+        PHASE_TRANSITIONS: None,
+        INITIAL_PHASE: None,
         DAILY_PHASE_EVALUATION: daily_phase_evaluation,
+        PHASE_HISTORY: [],
         EVENTS: events,
+        EVENT_SCHEDULE: None,
+        COMPILED_EVENTS: None,
         DAILY_EVENT_EVALUATION: daily_event_evaluation,
+        INFECT_PERSON: infect_person,
+        EVENT_ROSTERS: {},
+        VISITOR_POOL: None,
+        DAILY_HOOK: daily_hook,
+        STOPPED_DAY: None,
+        POPULATION_MODEL: population_model,
+        RANDOM_STREAMS: random_streams,
+        NEXT_DAY: 0,
+        EXTINCT: False,
+        HOSPITAL_BEDS: hospital_beds,
+        ICU_BEDS: icu_beds,
+        OCCUPIED_HOSPITAL_BEDS: 0,
+        OCCUPIED_ICU_BEDS: 0,
+        HOSPITAL_QUEUE: collections.deque(),
+        ICU_QUEUE: collections.deque(),
+        WAITING_FOR_HOSPITAL: 0,
+        WAITING_FOR_ICU: 0,
         MAX_NEW_DAILY_CASES: 0,
         MAX_NEW_DAILY_CONFIRMED_CASES: 0,
         MAX_ACTIVE_CASES: 0,
@@ -150,48 +242,103 @@ def create_initial_state(health_states, set_default_health_state,
         ACTIVE_CONFIRMED_CASES_SERIES: [0],
         ACTIVE_HOSPITALIZED_CASES_SERIES: [0],
         ACTIVE_ICU_CASES_SERIES: [0],
+        WAITING_FOR_HOSPITAL_SERIES: [0],
+        WAITING_FOR_ICU_SERIES: [0],
         NEW_CASES_SERIES: [0],
         NEW_CONFIRMED_CASES_SERIES: [0],
         NEW_ACTIVE_CASES_SERIES: [0],
         NEW_CONFIRMED_ACTIVE_CASES_SERIES: [0],
         NEW_RECOVERIES_SERIES: [0],
-        NEW_DEATHS_SERIES: [0]
+        NEW_DEATHS_SERIES: [0],
+        TEST_CAPACITY_SERIES: [0],
+        ROLLING_SUMS: {(series_key, window): 0 for series_key in _ROLLING_SERIES for window in ROLLING_WINDOWS}
     }
     return sim_state
 
 
+def create_people(ss):
+    """
+    Create the healthy population. Everyone starts in the same default health, so the default
+    health is set once, for a template person, and everyone is a copy of the template with their
+    own id - a copy is much faster than a call to SET_DEFAULT_HEALTH for each person.
+    The garbage collector is paused while the people are created, otherwise it would look through
+    all of the people created so far many times over (people do not refer to each other, there is
+    nothing for it to find).
+
+    :param ss: (dict, required) The simulation state.
+    :return: ([person.Person]) The people, indexed by person id.
+    """
+    template = Person(0)
+    ss[SET_DEFAULT_HEALTH](template, True)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return [template.clone(person_id) for person_id in range(ss[POPULATION])]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def add_to_people(ss, person):
+    """
+    Put a person (back) into PEOPLE, i.e. someone who comes home from the hospital.
+
+    :param ss: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    person.index = len(ss[PEOPLE])
+    ss[PEOPLE].append(person)
+
+
+def remove_from_people(ss, person):
+    """
+    Take a person out of PEOPLE, i.e. someone who goes into the hospital or dies. The last person of
+    PEOPLE is moved into their place, so this does not look through PEOPLE for them, and the people
+    of PEOPLE that are still to be visited by a loop from the end (see run_simulation()) do not move.
+
+    :param ss: (dict, required) The simulation state.
+    :param person: (person.Person, required) The person.
+    :return: None
+    """
+    people = ss[PEOPLE]
+    last = people.pop()
+    if last is not person:
+        people[person.index] = last
+        last.index = person.index
+    person.index = -1
+
+
 def run_simulation(ss):
     """
-    Run the simulation
+    Run the simulation. A simulation that was stopped by its daily hook can be continued - run it
+    again (usually with another daily hook, or none) and it picks up at the day after the day it
+    stopped, see checkpoint().
 
     :param ss: (dict, required) The simulation state.
     :return: None
     """
-    # OK, let's setup and run the simulation for SIMULATION_DAYS days. The first thing
-    # we need is the population. For this initial model we will represent each person
-    # with a dictionary and we will keep their 'state' as one of the health states, and
-    # 'days' as the number of days they have been at that state. Create a healthy
-    # population:
-    for person_id in range(ss[POPULATION]):
-        person = {'id': person_id}
-        ss[SET_DEFAULT_HEALTH](person, True)
-        ss[PEOPLE].append(person)
-
-    # OK, now I've got a healthy population - let's infect the 'INITIAL_INFECTION',
-    # randomly - these may be people who came from an infected area to their second house,
-    # or went to a place that was infected to shop or work, and then came back into the
-    # population we are modeling.
-    for _ in range(ss[INITIAL_INFECTION]):
-        ss[SET_INFECTED](
-            ss[PEOPLE][random.randint(0, ss[POPULATION] - 1)])
+    population_model = ss[POPULATION_MODEL]
+    if ss[NEXT_DAY] == 0:
+        _start_simulation(ss)
+    else:
+        # The testing rates are kept in the health states, which are shared by all of the
+        # simulations, so they are set again for the phase this simulation is in.
+        ss[STOPPED_DAY] = None
+        ss[UPDATE_TESTING_RATES](ss[CURRENT_TESTING_PROBABILITY])
+
+    # Once nobody is infected (or in the hospital) and there are no more events that could bring
+    # visitors who are infected, nothing will ever happen to the health of the population again,
+    # so there is no reason to look at every person for the rest of the simulation.
+    last_event_day = _last_event_day(ss[EVENTS])
 
     # OK, let's simulate. For each day every person will have DAILY_CONTACTS random
     # contacts. If it is a contact between a person who can get infected and an
     # infected person, then we will guess whether the person was infected based on
     # the TRANSMISSION_POSSIBILITY
-    ss[DAILY_POPULATION] = ss[POPULATION]
-
-    for day in range(ss[SIMULATION_DAYS]):
+    for day in range(ss[NEXT_DAY], ss[SIMULATION_DAYS]):
+        if ss[RANDOM_STREAMS] is not None:
+            ss[RANDOM_STREAMS].day = day
         # Does the simulation state change today based on the
         # numbers at the beginning of the day??
         if ss[DAILY_PHASE_EVALUATION](ss, day):
@@ -206,19 +353,22 @@ def run_simulation(ss):
         ss[DAILY_CONFIRMED_DEATHS] = 0
         ss[DAILY_HOSPITALIZATIONS] = 0
         ss[DAILY_ICU] = 0
-        # update the health state of every person
-        for person in reversed(ss[HOSPITALIZED_PEOPLE]):
-            ss[DAILY_HEALTH_EVALUATION](ss, person)
-        for person in reversed(ss[PEOPLE]):
-            ss[DAILY_HEALTH_EVALUATION](ss, person)
-
-        for person in ss[PEOPLE]:
-            # can this person infect, or be infected - if so, daily contacts
-            # must be traced to see if there is an infection event
-            ss[DAILY_EVALUATE_CONTACTS](ss, person, ss[PEOPLE])
-
-        if ss[DAILY_EVENT_EVALUATION] is not None:
-            ss[DAILY_EVENT_EVALUATION](ss, day)
+        if not ss[EXTINCT] and population_model is not None:
+            population_model['evaluate day'](ss, day)
+        elif not ss[EXTINCT]:
+            # update the health state of every person
+            for person in reversed(list(ss[HOSPITALIZED_PEOPLE].values())):
+                ss[DAILY_HEALTH_EVALUATION](ss, person)
+            for person in reversed(ss[PEOPLE]):
+                ss[DAILY_HEALTH_EVALUATION](ss, person)
+
+            for person in ss[PEOPLE]:
+                # can this person infect, or be infected - if so, daily contacts
+                # must be traced to see if there is an infection event
+                ss[DAILY_EVALUATE_CONTACTS](ss, person, ss[PEOPLE])
+
+            if ss[DAILY_EVENT_EVALUATION] is not None:
+                ss[DAILY_EVENT_EVALUATION](ss, day)
 
         # append the today's statistics to the lists
         # new_confirmed_cases = sim_state[s.CURRENT_TESTING_PROBABILITY] * sim_state[s.DAILY_CASES]
@@ -249,6 +399,8 @@ def run_simulation(ss):
         if ss[ACTIVE_ICU_CASES_SERIES][day + 1] > \
                 ss[ACTIVE_ICU_CASES_SERIES][ss[MAX_ACTIVE_ICU]]:
             ss[MAX_ACTIVE_ICU] = day + 1
+        ss[WAITING_FOR_HOSPITAL_SERIES].append(ss[WAITING_FOR_HOSPITAL])
+        ss[WAITING_FOR_ICU_SERIES].append(ss[WAITING_FOR_ICU])
 
         ss[CUMULATIVE_RECOVERIES_SERIES].append(
             ss[CUMULATIVE_RECOVERIES_SERIES][day] + ss[DAILY_RECOVERIES])
@@ -273,10 +425,127 @@ def run_simulation(ss):
             ss[DAILY_CONFIRMED_CASES] - ss[DAILY_CONFIRMED_RECOVERIES] - ss[DAILY_DEATHS])
         ss[NEW_RECOVERIES_SERIES].append(ss[DAILY_RECOVERIES])
         ss[NEW_DEATHS_SERIES].append(ss[DAILY_DEATHS])
+        ss[TEST_CAPACITY_SERIES].append(ss[CURRENT_DAILY_TESTS])
+
+        # the day that just ended comes into the rolling sums, and the day that is now outside
+        # the window goes out.
+        rolling_sums = ss[ROLLING_SUMS]
+        for series_key, window in rolling_sums:
+            series_data = ss[series_key]
+            rolling_sums[(series_key, window)] += series_data[day + 1] - \
+                (series_data[day + 1 - window] if day + 1 >= window else 0)
+
+        ss[NEXT_DAY] = day + 1
+        if ss[DAILY_HOOK] is not None and ss[DAILY_HOOK](ss, day + 1):
+            ss[STOPPED_DAY] = day + 1
+            break
+
+        if not ss[EXTINCT] and day >= last_event_day and ss[ACTIVE_CASES_SERIES][day + 1] == 0:
+            ss[EXTINCT] = True
+            if not ss[HAS_NEXT_PHASE] and ss[DAILY_HOOK] is None:
+                # There is nothing that the remaining days can change, fill in the
+                # rest of the series in one step. Otherwise the remaining days are still
+                # stepped through for the phase changes and daily hook, but there are
+                # no people to look at.
+                _fill_extinct_days(ss, day + 1)
+                ss[NEXT_DAY] = ss[SIMULATION_DAYS]
+                break
+
+
+def _start_simulation(ss):
+    """
+    Create and infect the population for the first day of the simulation.
 
+    :param ss: (dict, required) The simulation state.
+    :return: None
+    """
+    # OK, let's setup and run the simulation for SIMULATION_DAYS days. The first thing
+    # we need is the population. For this initial model we will represent each person
+    # with a dictionary and we will keep their 'state' as one of the health states, and
+    # 'days' as the number of days they have been at that state. Create a healthy
+    # population:
+    population_model = ss[POPULATION_MODEL]
+    if population_model is not None:
+        # the population model creates and infects its own population
+        population_model['initialize'](ss)
+    else:
+        ss[PEOPLE].extend(create_people(ss))
+        # PEOPLE changes as people go to and come back from the hospital, EVERYONE is the
+        # population indexed by the person id
+        ss[EVERYONE] = list(ss[PEOPLE])
+
+        # OK, now I've got a healthy population - let's infect the 'INITIAL_INFECTION',
+        # randomly - these may be people who came from an infected area to their second house,
+        # or went to a place that was infected to shop or work, and then came back into the
+        # population we are modeling.
+        streams = ss[RANDOM_STREAMS]
+        for infection in range(ss[INITIAL_INFECTION]):
+            ss[SET_INFECTED](
+                ss[PEOPLE][random.randint(0, ss[POPULATION] - 1) if streams is None else
+                           streams.randrange(infection, crn.INITIAL_INFECTION, 0, ss[POPULATION])])
 
-def write_data(ss, file_name):
-    # save the data from this simulation to a file
+    ss[DAILY_POPULATION] = ss[POPULATION]
+
+
+def checkpoint(ss):
+    """
+    A copy of a simulation state, at the day the simulation is at, that can be run on (see
+    run_simulation()) without changing the simulation it was copied from - i.e. a simulation that
+    was stopped by its daily hook on an interesting day is copied, and the copies are run on with
+    different random numbers (see rare_events.py). The health states are shared by the copies, as
+    they are by all simulations.
+
+    :param ss: (dict, required) The simulation state.
+    :return: (dict) The copy of the simulation state.
+    """
+    shared = {id(ss[HEALTH_STATES]): ss[HEALTH_STATES]}
+    for health_state in ss[HEALTH_STATES].values():
+        shared[id(health_state)] = health_state
+    return copy.deepcopy(ss, shared)
+
+
+def _last_event_day(events):
+    """
+    The last day of the simulation that has an event.
+
+    :param events: ([dict], required) The event descriptions, may be None.
+    :return: (int) The last day with an event, -1 if there are no events.
+    """
+    return max((max(event.get('day', -1), event.get('end day', -1)) for event in events or ()), default=-1)
+
+
+def _fill_extinct_days(ss, last_day):
+    """
+    Fill in the series for the days after the epidemic has gone extinct - nothing new happens, so
+    the cumulative and active series stay where they are and the new series are 0.
+
+    :param ss: (dict, required) The simulation state.
+    :param last_day: (int, required) The last day that was simulated.
+    :return: None
+    """
+    remaining = ss[SIMULATION_DAYS] - last_day
+    for series_key in (CUMULATIVE_CASES_SERIES, CUMULATIVE_CONFIRMED_CASES_SERIES, CUMULATIVE_RECOVERIES_SERIES,
+                       CUMULATIVE_CONFIRMED_RECOVERIES_SERIES, CUMULATIVE_DEATHS_SERIES,
+                       CUMULATIVE_CONFIRMED_DEATHS_SERIES, ACTIVE_CASES_SERIES, ACTIVE_CONFIRMED_CASES_SERIES,
+                       ACTIVE_HOSPITALIZED_CASES_SERIES, ACTIVE_ICU_CASES_SERIES, WAITING_FOR_HOSPITAL_SERIES,
+                       WAITING_FOR_ICU_SERIES):
+        ss[series_key].extend([ss[series_key][last_day]] * remaining)
+    for series_key in (NEW_CASES_SERIES, NEW_CONFIRMED_CASES_SERIES, NEW_ACTIVE_CASES_SERIES,
+                       NEW_CONFIRMED_ACTIVE_CASES_SERIES, NEW_RECOVERIES_SERIES, NEW_DEATHS_SERIES):
+        ss[series_key].extend([0] * remaining)
+    ss[TEST_CAPACITY_SERIES].extend([ss[CURRENT_DAILY_TESTS]] * remaining)
+    rolling_sums = ss[ROLLING_SUMS]
+    for series_key, window in rolling_sums:
+        rolling_sums[(series_key, window)] = sum(ss[series_key][-window:])
+
+
+def simulation_data(ss):
+    """
+    Get the data from a simulation that is saved to a data file, see write_data().
+
+    :param ss: (dict, required) The simulation state.
+    :return: (dict) The data from the simulation.
+    """
     phases_data = {}
     for key, value in ss[PHASES].items():
         if 'start day' in value:
@@ -290,9 +559,13 @@ def write_data(ss, file_name):
     data = {PHASES: phases_data}
     for key in _SERIALIZE_KEYS:
         data[key] = ss[key]
+    return data
 
+
+def write_data(ss, file_name):
+    # save the data from this simulation to a file
     with open(file_name, "w") as fw:
-        json.dump(data, fw, indent=2)
+        json.dump(simulation_data(ss), fw, indent=2)
 
 
 def graph_simulation(ss, title, series):
@@ -304,6 +577,9 @@ def graph_simulation(ss, title, series):
     :param series: ([str,str,...], required) The
     :return:
     """
+    # matplotlib is only loaded when there is something to plot, it is slow to import
+    import matplotlib.pyplot as plt
+
     # plot the results
     # These are the cumulative stats
     plt.clf()
@@ -312,15 +588,19 @@ def graph_simulation(ss, title, series):
     plt.ylabel('count')
     plt.xticks(np.arange(0, 211, 14))
     plt.grid(b=True, which='major', color='#aaaaff', linestyle='-')
-    for key, phase in ss[PHASES].items():
-        start_day = phase.get('start day', 0)
+    # a phase may be started more than once, mark every time it started
+    phase_days = {}
+    for start_day, key in ss[PHASE_HISTORY]:
         if start_day > 1:
-            day = []
-            data = []
+            phase_days.setdefault(key, []).append(start_day)
+    for key, start_days in phase_days.items():
+        day = []
+        data = []
+        for start_day in start_days:
             for series_key in series:
                 day.append(start_day)
                 data.append(ss[series_key][start_day])
-            plt.scatter(day, data, label=key)
+        plt.scatter(day, data, label=key)
     for series_key in series:
         plt.plot(ss[series_key], label=series_key)
     plt.legend()
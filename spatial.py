@@ -0,0 +1,132 @@
+"""
+A spatial population for the array population model (see array_population.py). People live in the
+cells of a grid, with more people in some cells than others (i.e. a town and the farms around it),
+and their contacts are mostly with people in their own cell, less with people in the neighboring
+cells, and never with anyone farther away.
+
+The infectious people are counted in a numpy grid every day, and the chance that a contact is
+infectious is a sum over the neighborhood of each cell, weighted by a distance kernel, that is
+computed for the whole grid at once by shifting the grid - there are no distances between people:
+
+    grid = spatial.create_grid(population, spatial.urban_density((40, 40), 0.6))
+    model = array_population.create_model(table, population, spatial.create_infections(grid))
+"""
+import numpy as np
+import simulate as s
+
+
+def urban_density(shape, urban_fraction=0.5, centers=None, radius=None):
+    """
+    A population density for a grid that is a uniform rural background plus towns.
+
+    :param shape: ((int, int), required) The rows and columns of the grid.
+    :param urban_fraction: (float, optional, default=0.5) The fraction of the population in the towns.
+    :param centers: ([(int, int)], optional, default=None) The row and column of the center of each
+    town, None for one town at the center of the grid.
+    :param radius: (float, optional, default=None) The radius (standard deviation in cells) of a
+    town, None for 1/16 of the size of the grid.
+    :return: (numpy.ndarray of float) The fraction of the population in each cell.
+    """
+    rows, cols = shape
+    if centers is None:
+        centers = [(rows // 2, cols // 2)]
+    if radius is None:
+        radius = max(min(rows, cols) / 16.0, 0.5)
+    row, col = np.mgrid[0:rows, 0:cols]
+    towns = np.zeros(shape)
+    for center_row, center_col in centers:
+        towns += np.exp(-((row - center_row) ** 2 + (col - center_col) ** 2) / (2.0 * radius ** 2))
+    return (1.0 - urban_fraction) * np.full(shape, 1.0 / (rows * cols)) + urban_fraction * towns / towns.sum()
+
+
+def create_grid(population, density, seed=None):
+    """
+    Place a population on a grid.
+
+    :param population: (int, required) The number of people.
+    :param density: (numpy.ndarray of float, required) The relative population of each cell of the grid.
+    :param seed: (int, optional, default=None) The seed for placing the people.
+    :return: (dict) The grid - the 'shape' of the grid, and the (flattened) 'cell' of each person.
+    """
+    density = np.asarray(density, dtype=float)
+    return {
+        'shape': density.shape,
+        'cell': np.random.default_rng(seed).choice(density.size, population, p=(density / density.sum()).ravel())
+    }
+
+
+def distance_kernel(radius=1, scale=0.5):
+    """
+    The weight of the contacts with people in the cells around a cell - exp(-distance / scale) for
+    the cells within radius of the cell, and 0 for the cells farther away.
+
+    :param radius: (int, optional, default=1) The farthest a contact can be, in cells.
+    :param scale: (float, optional, default=0.5) The distance scale, in cells.
+    :return: (numpy.ndarray of float) The (2 x radius + 1) x (2 x radius + 1) kernel, the cell is at the center.
+    """
+    offset_row, offset_col = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    distance = np.sqrt(offset_row ** 2 + offset_col ** 2)
+    return np.where(distance <= radius, np.exp(-distance / scale), 0.0)
+
+
+def neighborhood_sum(grid, kernel):
+    """
+    The kernel weighted sum of the neighborhood of every cell of a grid, the cells outside of the
+    grid are 0 (the kernel is symmetric, so this is the same as a convolution).
+
+    :param grid: (numpy.ndarray, required) The grid.
+    :param kernel: (numpy.ndarray of float, required) The kernel, see distance_kernel().
+    :return: (numpy.ndarray of float) The sum for every cell.
+    """
+    rows, cols = grid.shape
+    radius = kernel.shape[0] // 2
+    padded = np.pad(grid.astype(float), radius)
+    total = np.zeros((rows, cols))
+    for offset_row, offset_col in zip(*np.nonzero(kernel)):
+        total += kernel[offset_row, offset_col] * padded[offset_row:offset_row + rows, offset_col:offset_col + cols]
+    return total
+
+
+def create_infections(grid, kernel=None, density_exponent=0.0):
+    """
+    Create the spatial contact model for array_population.create_model(). Each day the contacts of
+    a person are spread over the occupied cells around them by the kernel, and are with random
+    people in those cells, so the force of infection on a cell is the transmission probability x
+    the daily contacts x the kernel weighted infectious fraction of the cells around it.
+
+    :param grid: (dict, required) The grid, see create_grid().
+    :param kernel: (numpy.ndarray of float, optional, default=None) The kernel, None for distance_kernel().
+    :param density_exponent: (float, optional, default=0.0) The daily contacts of a person are
+    proportional to the number of people in their cell to this power (scaled so that the mean is the
+    daily contacts of the phase), 0.0 for the same contacts everywhere, larger for more contacts
+    in towns than in the country.
+    :return: (function) The contact model.
+    """
+    if kernel is None:
+        kernel = distance_kernel()
+    cell = grid['cell']
+    shape = grid['shape']
+    cells = shape[0] * shape[1]
+
+    def infections(sim_state, model):
+        table = model['table']
+        state = model['people']['state']
+        # people in the hospital or dead are not in the population, and make no contacts
+        present = ~table['hospitalize'][state] & (state != table['dead state'])
+        present_count = np.bincount(cell[present], minlength=cells).reshape(shape)
+        infectious = np.flatnonzero(table['infectious'][state] & present)
+        infectious_activity = np.bincount(cell[infectious], weights=table['activity level'][state[infectious]],
+                                          minlength=cells).reshape(shape)
+        # the contacts toward an empty cell go to the occupied cells instead
+        infectious_fraction = neighborhood_sum(infectious_activity / np.maximum(present_count, 1), kernel) / \
+            np.maximum(neighborhood_sum(present_count > 0, kernel), 1.0e-12)
+        contacts = np.full(shape, float(sim_state[s.CURRENT_DAILY_CONTACTS]))
+        if density_exponent != 0.0:
+            crowding = np.where(present_count > 0, np.maximum(present_count, 1) ** density_exponent, 0.0)
+            contacts *= crowding * present_count.sum() / max(float((crowding * present_count).sum()), 1.0e-12)
+        force = (sim_state[s.CURRENT_TRANSMISSION_PROBABILITY] * contacts * infectious_fraction).ravel()
+        susceptible = np.flatnonzero(table['can be infected'][state])
+        probability = -np.expm1(-force[cell[susceptible]] * table['activity level'][state[susceptible]])
+        return susceptible[np.random.random(len(susceptible)) < probability]
+
+    return infections
@@ -0,0 +1,76 @@
+"""
+Measure the startup cost of the simulation-only path - importing the modules that a batch run or
+a sweep worker imports, in a new interpreter as a worker process would - and check it against a
+budget. The plotting and data frame libraries (matplotlib, pandas) should only be loaded when a
+plot or a report of the observed data is requested, so loading one of them on this path is a
+failure whatever the time. e.g.:
+
+    python startup_budget.py --budget 400
+
+The exit status is 0 if every module is within the budget, 1 otherwise.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# the modules of the simulation-only path
+SIMULATION_MODULES = ('simulate', 'scenario', 'replicates', 'calibrate', 'abc_inference')
+# the modules that should not be loaded on the simulation-only path
+HEAVY_MODULES = ('matplotlib', 'pandas')
+DEFAULT_BUDGET_MS = 500.0
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000.0, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeats=5):
+    """
+    Measure the time to import a module in a new interpreter.
+
+    :param module: (str, required) The module name.
+    :param repeats: (int, optional, default=5) The number of measurements.
+    :return: ((float, [str])) The median import time in milliseconds, and the heavy modules that
+    the import loaded.
+    """
+    times = []
+    loaded = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', _MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True)
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(measurement['ms'])
+        loaded = measurement['loaded']
+    return statistics.median(times), loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the import time of the simulation-only modules against a budget.')
+    parser.add_argument(
+        '-b', '--budget', dest='budget', type=float, default=DEFAULT_BUDGET_MS,
+        help='The import time budget for each module in milliseconds.')
+    parser.add_argument(
+        '-r', '--repeats', dest='repeats', type=int, default=5,
+        help='The number of measurements of each module, the median is used.')
+    args = parser.parse_args()
+
+    numpy_ms, _ = measure_import('numpy', args.repeats)
+    print(f'{"numpy (for reference)":24s}{numpy_ms:10.1f}ms')
+    within_budget = True
+    for module_name in SIMULATION_MODULES:
+        import_ms, heavy = measure_import(module_name, args.repeats)
+        problems = []
+        if import_ms > args.budget:
+            problems.append(f'over the {args.budget:.0f}ms budget')
+        if heavy:
+            problems.append(f'loaded {", ".join(heavy)}')
+        within_budget = within_budget and not problems
+        print(f'{module_name:24s}{import_ms:10.1f}ms  {"; ".join(problems) if problems else "ok"}')
+    sys.exit(0 if within_budget else 1)
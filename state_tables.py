@@ -0,0 +1,194 @@
+"""
+The health state graph (see covid_state.HEALTH_STATES) compiled into numpy arrays so the health
+of a group of people that is kept in arrays, rather than as a person dictionary for each person,
+can be advanced in one vectorized step.
+
+A group of people is a dictionary of arrays with one entry per person, the keys are the same
+as the keys of a person dictionary:
+    'state' - the index of the health state of the person in the table
+    'days at state' - the number of days the person has been at that state
+    'state length' - the number of days the person will be at that state, -1 if the state does
+        not progress
+    'tested' - has the person tested positive
+    'age group' - the index of the age group of the person in the table, the branch
+        probabilities of the health states can be different for each age group
+"""
+import math
+import numpy as np
+
+# the standard deviation of the log of the days at a state, as in covid_state.advance_health_state
+_LOG_STD_DEV = np.log(math.sqrt(2.0))
+
+
+def compile_health_states(health_states, default_state='well', infected_state='infected',
+                          recovered_state='immune', dead_state='dead', age_groups=None):
+    """
+    Compile a health state graph into the array transition tables. A health state can have
+    'next state by age', a dictionary keyed by age group of the 'next state' for people in that
+    age group, the 'next state' of the state is used for the age groups that are not in it.
+
+    :param health_states: (dict, required) The health states, keyed by state name.
+    :param default_state: (str, optional, default='well') The state of a healthy person.
+    :param infected_state: (str, optional, default='infected') The state of a newly infected person.
+    :param recovered_state: (str, optional, default='immune') The state of a person who has recovered.
+    :param dead_state: (str, optional, default='dead') The state of a person who has died.
+    :param age_groups: ([str], optional, default=None) The names of the age groups, None for one
+    age group for everyone.
+    :return: (dict) The compiled table.
+    """
+    names = list(health_states.keys())
+    index = {name: state_id for state_id, name in enumerate(names)}
+    if age_groups is None:
+        age_groups = [None]
+
+    def branches(state, age_group):
+        return state.get('next state by age', {}).get(age_group, state.get('next state', ()))
+
+    max_next = max(len(branches(state, age_group))
+                   for state in health_states.values() for age_group in age_groups)
+    next_cumulative = np.full((len(age_groups), len(names), max(max_next, 1)), 2.0)
+    next_state = np.zeros((len(age_groups), len(names), max(max_next, 1)), dtype=int)
+    for group_id, age_group in enumerate(age_groups):
+        for state_id, state in enumerate(health_states.values()):
+            state_branches = branches(state, age_group)
+            for next_id, (probability, name) in enumerate(state_branches):
+                next_cumulative[group_id, state_id, next_id] = probability
+                next_state[group_id, state_id, next_id] = index[name]
+            # make sure the last next state is always selected
+            if len(state_branches) > 0:
+                next_cumulative[group_id, state_id, len(state_branches) - 1] = 1.0
+
+    def flags(key, default=False, dtype=bool):
+        return np.array([state.get(key, default) for state in health_states.values()], dtype=dtype)
+
+    return {
+        'names': names,
+        'index': index,
+        'age groups': age_groups,
+        'default state': index[default_state],
+        'infected state': index[infected_state],
+        'recovered state': index[recovered_state],
+        'dead state': index[dead_state],
+        'can be infected': flags('can be infected'),
+        'infectious': flags('infectious'),
+        'hospitalize': flags('hospitalize'),
+        'icu': flags('icu'),
+        'activity level': flags('activity level', 0.0, float),
+        'mean days': flags('days at state', -1.0, float),
+        'lognormal': np.array(['standard_deviation' in state for state in health_states.values()]),
+        'testing': flags('testing', 0.0, float),
+        'next cumulative': next_cumulative,
+        'next state': next_state
+    }
+
+
+def update_testing(table, health_states):
+    """
+    Update the testing probabilities in the table from the health states - these change when the
+    simulation phase changes (see covid_state.set_testing_for_phase).
+
+    :param table: (dict, required) The compiled table.
+    :param health_states: (dict, required) The health states the table was compiled from.
+    :return: None
+    """
+    table['testing'][:] = [state.get('testing', 0.0) for state in health_states.values()]
+
+
+def create_people(table, count, age_groups=None):
+    """
+    Create a group of healthy people.
+
+    :param table: (dict, required) The compiled table.
+    :param count: (int, required) The number of people.
+    :param age_groups: (numpy.ndarray of int, optional, default=None) The age group of each person,
+    None for everyone in the first age group.
+    :return: (dict) The group of people.
+    """
+    return {
+        'state': np.full(count, table['default state'], dtype=int),
+        'days at state': np.ones(count, dtype=int),
+        'state length': np.full(count, -1.0),
+        'tested': np.zeros(count, dtype=bool),
+        'age group': np.zeros(count, dtype=int) if age_groups is None else np.array(age_groups, dtype=int)
+    }
+
+
+def set_default(table, people, indices):
+    """
+    Set some people in a group to the default healthy state.
+
+    :param table: (dict, required) The compiled table.
+    :param people: (dict, required) The group of people.
+    :param indices: (numpy.ndarray of int, required) The indices of the people in the group.
+    :return: None
+    """
+    people['state'][indices] = table['default state']
+    people['days at state'][indices] = 1
+    people['state length'][indices] = -1.0
+    people['tested'][indices] = False
+
+
+def set_infected(table, people, indices):
+    """
+    Set some people in a group to the infected state so that they will immediately progress
+    the next time the group is advanced (as covid_state.set_initial_infected_state).
+
+    :param table: (dict, required) The compiled table.
+    :param people: (dict, required) The group of people.
+    :param indices: (numpy.ndarray of int, required) The indices of the people in the group.
+    :return: None
+    """
+    people['state'][indices] = table['infected state']
+    people['days at state'][indices] = 1
+    people['state length'][indices] = 0.0
+    people['tested'][indices] = False
+
+
+def transition(table, people, indices):
+    """
+    Move some people in a group to their next state, chaining through any states that they are
+    in for less than a day.
+
+    :param table: (dict, required) The compiled table.
+    :param people: (dict, required) The group of people.
+    :param indices: (numpy.ndarray of int, required) The indices of the people in the group.
+    :return: ((numpy.ndarray of int,) * 3) The indices, old states, and new states of every
+    transition, in the order they happened.
+    """
+    moved = []
+    old_states = []
+    new_states = []
+    while len(indices) > 0:
+        old = people['state'][indices]
+        age_group = people['age group'][indices]
+        choice = (np.random.random((len(indices), 1)) > table['next cumulative'][age_group, old]).sum(axis=1)
+        new = table['next state'][age_group, old, choice]
+        people['state'][indices] = new
+        people['days at state'][indices] = 1
+        mean = table['mean days'][new]
+        length = mean.copy()
+        lognormal = table['lognormal'][new] & (mean != -1)
+        length[lognormal] = np.random.lognormal(np.log(mean[lognormal]), _LOG_STD_DEV).astype(int)
+        people['state length'][indices] = length
+        moved.append(indices)
+        old_states.append(old)
+        new_states.append(new)
+        # This can happen because some states can be less than a day in length
+        indices = indices[(length >= 0) & (length < 1)]
+    if len(moved) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=int)
+    return np.concatenate(moved), np.concatenate(old_states), np.concatenate(new_states)
+
+
+def advance_day(table, people, indices):
+    """
+    Advance the health of some people in a group by one day.
+
+    :param table: (dict, required) The compiled table.
+    :param people: (dict, required) The group of people.
+    :param indices: (numpy.ndarray of int, required) The indices of the people in the group.
+    :return: ((numpy.ndarray of int,) * 3) The transitions, see transition().
+    """
+    people['days at state'][indices] += 1
+    length = people['state length'][indices]
+    return transition(table, people, indices[(length >= 0) & (length < people['days at state'][indices])])
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import json
+import simulate as s
+import scenario
+import events
+
+
+def _fire_camp(local_participants, start_day, end_day):
+    with open('./data/expl3/fire_camp.json', 'r') as event_file:
+        event = json.load(event_file)
+    event.update({'participants': local_participants + event['visiting participants'],
+                  'start day': start_day, 'end day': end_day})
+    return event
+
+
+def test_roster_of_more_local_participants_than_the_population():
+    checked_days = []
+
+    def check_rosters(sim_state, day):
+        people_ids = {person.id for person in sim_state[s.PEOPLE]}
+        for roster in sim_state[s.EVENT_ROSTERS].values():
+            assert len(roster['local']) <= len(people_ids)
+            assert set(roster['positions']) == set(roster['local'].tolist())
+            assert set(roster['positions']) <= people_ids
+            if roster['outside'] is not None:
+                outside = roster['outside']
+                assert set(outside['ids']) == people_ids - set(roster['positions'])
+                assert all(outside['positions'][person_id] == index for index, person_id in enumerate(outside['ids']))
+        checked_days.append(day)
+        return False
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(None, [_fire_camp(1000, 1, 60)], population=800, simulation_days=60,
+                                          initial_infection=50, seed=3, daily_hook=check_rosters)
+    assert len(checked_days) == 60
+    assert sim_state[s.CUMULATIVE_CASES_SERIES][-1] > 50
+
+
+def test_leave_rosters_replaces_then_shrinks():
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.create_simulation(None, None, population=10, simulation_days=1, initial_infection=0)
+    sim_state[s.PEOPLE].extend(s.create_people(sim_state))
+    sim_state[s.EVERYONE] = list(sim_state[s.PEOPLE])
+    roster = sim_state[s.EVENT_ROSTERS][0] = events.create_roster(sim_state, 8)
+    assert len(roster['local']) == 8
+
+    # there are people who are not at the event to replace someone who leaves
+    leaving = sim_state[s.EVERYONE][int(roster['local'][0])]
+    s.remove_from_people(sim_state, leaving)
+    events.leave_rosters(sim_state, leaving)
+    assert len(roster['local']) == 8 and leaving.id not in roster['positions']
+
+    # everyone left is at the event, the roster gets smaller
+    leaving = sim_state[s.EVERYONE][int(roster['local'][3])]
+    s.remove_from_people(sim_state, leaving)
+    events.leave_rosters(sim_state, leaving)
+    assert len(roster['local']) == 8
+    leaving = sim_state[s.EVERYONE][int(roster['local'][5])]
+    s.remove_from_people(sim_state, leaving)
+    events.leave_rosters(sim_state, leaving)
+    assert len(roster['local']) == 7
+    assert set(roster['positions']) == set(roster['local'].tolist())
+    assert all(roster['positions'][person_id] == index for index, person_id in enumerate(roster['local'].tolist()))
+
+
+def test_leave_rosters_draws_from_the_people_outside_of_a_full_event():
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.create_simulation(None, None, population=100, simulation_days=1, initial_infection=0)
+    sim_state[s.PEOPLE].extend(s.create_people(sim_state))
+    sim_state[s.EVERYONE] = list(sim_state[s.PEOPLE])
+    roster = sim_state[s.EVENT_ROSTERS][0] = events.create_roster(sim_state, 90)
+    assert len(roster['outside']['ids']) == 10
+
+    # someone at the event is replaced by one of the people outside of it
+    leaving = sim_state[s.EVERYONE][int(roster['local'][0])]
+    s.remove_from_people(sim_state, leaving)
+    events.leave_rosters(sim_state, leaving)
+    assert len(roster['local']) == 90 and len(roster['outside']['ids']) == 9
+    # someone outside of the event leaves, and someone comes back
+    leaving = sim_state[s.EVERYONE][roster['outside']['ids'][0]]
+    s.remove_from_people(sim_state, leaving)
+    events.leave_rosters(sim_state, leaving)
+    assert leaving.id not in roster['outside']['positions']
+    s.add_to_people(sim_state, leaving)
+    events.join_rosters(sim_state, leaving)
+    assert set(roster['outside']['ids']) == {person.id for person in sim_state[s.PEOPLE]} - set(roster['positions'])
@@ -0,0 +1,25 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import oregon_data
+
+
+def test_columns_are_cached_and_read_only(tmp_path):
+    file_name = str(tmp_path / 'oregon.csv')
+    shutil.copyfile(oregon_data.OREGON_CSV, file_name)
+    columns = oregon_data._load_columns(file_name)
+    # the cache file is renamed into place, no temporary file is left behind
+    assert [name for name in os.listdir(tmp_path) if name != 'oregon.csv'] == \
+           [os.path.basename(oregon_data._cache_file_name(file_name, oregon_data._file_hash(file_name)))]
+    with pytest.raises(ValueError):
+        columns['daily date'][0] = columns['daily date'][1]
+
+    # the columns read back from the cache file are the columns that were parsed
+    oregon_data._TABLES.clear()
+    cached = oregon_data._load_columns(file_name)
+    assert cached is not columns and list(cached) == list(columns)
+    for name, values in columns.items():
+        assert not cached[name].flags.writeable
+        np.testing.assert_array_equal(cached[name], values)
+    assert len(oregon_data.read_daily_updates(file_name)) == len(columns['daily date'])
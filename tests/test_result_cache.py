@@ -0,0 +1,40 @@
+import contextlib
+import io
+import os
+import simulate as s
+import scenario
+import result_cache
+
+
+def _run(phases_config, event_list):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return scenario.run_scenario(phases_config, event_list, population=1000, simulation_days=60,
+                                     initial_infection=20, seed=7, hospital_beds=10, icu_beds=2)
+
+
+def test_a_cached_result_is_the_result_of_the_run(tmp_path, monkeypatch):
+    assert scenario.RESULT_CACHE is None
+    phases_config = scenario.read_phases('./data/expl3/covid_phases.json')
+    event_list = scenario.read_events(['./data/expl3/fire_camp.json'])
+    monkeypatch.setattr(scenario, 'RESULT_CACHE', result_cache.ResultCache(str(tmp_path)))
+    ran = _run(phases_config, event_list)
+    assert scenario.RESULT_CACHE.total_bytes == sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+
+    def not_run(sim_state):
+        raise AssertionError('the run is in the cache')
+    monkeypatch.setattr(s, 'run_simulation', not_run)
+    cached = _run(phases_config, event_list)
+    assert s.simulation_data(cached) == s.simulation_data(ran)
+    for key in (s.NEXT_DAY, s.EXTINCT, s.STOPPED_DAY, s.MAX_ACTIVE_CONFIRMED_CASES, s.MAX_NEW_DAILY_CONFIRMED_CASES,
+                s.TEST_CAPACITY_SERIES, s.ROLLING_SUMS, s.PHASE_HISTORY, s.CURRENT_DAILY_CONTACTS,
+                s.CURRENT_TESTING_PROBABILITY, s.HAS_NEXT_PHASE):
+        assert cached[key] == ran[key], key
+    assert cached[s.CURRENT_PHASE] is cached[s.PHASES][cached[s.PHASE_HISTORY][-1][1]]
+
+
+def test_the_least_recently_used_results_are_removed(tmp_path, monkeypatch):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=1)
+    monkeypatch.setattr(scenario, 'RESULT_CACHE', cache)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario.run_scenario(None, None, population=300, simulation_days=30, initial_infection=5, seed=1)
+    assert os.listdir(tmp_path) == [] and cache.total_bytes == 0
@@ -0,0 +1,36 @@
+import pytest
+import simulate as s
+import server
+
+
+def test_parse_request_fills_in_the_defaults():
+    scenario_request = server.parse_request({'population': '1000', 'hospital beds': None})
+    assert scenario_request['population'] == 1000
+    assert scenario_request['days'] == s.DEFAULT_SIMULATION_DAYS
+    assert scenario_request['hospital beds'] is None
+    assert scenario_request['contact model'] == 'mixed'
+
+
+@pytest.mark.parametrize('request_body', [
+    [1],
+    {'phases': [1]},
+    {'phases': 'normal'},
+    {'phases': {'phases': {}}},
+    {'events': {'description': 'a party'}},
+    {'events': [1]},
+    {'population': None},
+    {'days': None},
+    {'initial infection': None},
+    {'urban': None},
+    {'population': [1000]},
+    {'days': 'a week'},
+    {'seed': {}},
+    {'hospital beds': 'many'},
+    {'population': 0},
+    {'contact model': ['mixed']},
+    {'contact model': 'grid', 'grid': '40 by 40'},
+    {'what': 1}
+])
+def test_parse_request_rejects_a_bad_request(request_body):
+    with pytest.raises(ValueError):
+        server.parse_request(request_body)
@@ -0,0 +1,23 @@
+import contextlib
+import io
+import simulate as s
+import scenario
+
+
+def test_people_are_at_their_index_as_they_go_to_and_from_the_hospital():
+    checked_days = []
+
+    def check_people(sim_state, day):
+        assert [person.index for person in sim_state[s.PEOPLE]] == list(range(len(sim_state[s.PEOPLE])))
+        assert all(person.index == -1 for person in sim_state[s.HOSPITALIZED_PEOPLE].values())
+        assert len(sim_state[s.PEOPLE]) == sim_state[s.DAILY_POPULATION]
+        checked_days.append(day)
+        return False
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim_state = scenario.run_scenario(None, None, population=3000, simulation_days=100, initial_infection=30,
+                                          seed=2, daily_hook=check_people, hospital_beds=20, icu_beds=5)
+    assert len(checked_days) == 100
+    assert sim_state[s.CUMULATIVE_DEATHS_SERIES][-1] > 0
+    assert len(sim_state[s.PEOPLE]) + len(sim_state[s.HOSPITALIZED_PEOPLE]) + \
+        sim_state[s.CUMULATIVE_DEATHS_SERIES][-1] == sim_state[s.POPULATION]